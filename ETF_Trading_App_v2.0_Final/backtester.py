@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+DMA20 Dip-Buy Backtester
+Replays the shop's strategy over a (days x ETFs) close matrix: capital split into equal parts,
+each day sell the most profitable LIFO lot that reached the target, then buy the ETF furthest
+below its DMA20 (or average down a held ETF that fell below its last buy).
+Indicators are computed for the whole matrix up front; the day loop works on numpy state
+with a leading scenario axis, so the same rules also step thousands of simulated paths at once.
+"""
+
+import argparse
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from dma_calculator import DMA_WINDOW, dma_matrix
+from lifo_ledger import LTCG_DAYS, LTCG_RATE, STCG_RATE, TARGET
+
+PARTS = 50
+AVERAGING_THRESHOLD = 0.025  # average down once the CMP is this far below the last buy
+TOP_K = 5
+TRADING_DAYS = 252
+
+
+def forward_fill(closes: np.ndarray) -> np.ndarray:
+    """Carry each column's last close over gaps (leading gaps stay NaN)"""
+    rows = np.where(~np.isnan(closes), np.arange(len(closes))[:, None], 0)
+    np.maximum.accumulate(rows, axis=0, out=rows)
+    return closes[rows, np.arange(closes.shape[1])]
+
+
+def max_drawdown(equity: np.ndarray) -> float:
+    if not len(equity):
+        return 0.0
+    peaks = np.maximum.accumulate(equity)
+    return float(np.max((peaks - equity) / peaks))
+
+
+def top_k(pct: np.ndarray, k: int) -> np.ndarray:
+    """Columns of the k most fallen ETFs per row of a (scenarios x ETFs) matrix, most fallen first"""
+    masked = np.where(np.isnan(pct), np.inf, pct)
+    rows = np.arange(len(masked))[:, None]
+    if k < masked.shape[1]:
+        columns = np.argpartition(masked, k - 1, axis=1)[:, :k]
+    else:
+        columns = np.broadcast_to(np.arange(masked.shape[1]), masked.shape)
+    return columns[rows, np.argsort(masked[rows, columns], axis=1, kind='stable')]
+
+
+class Backtester:
+    def __init__(self, capital: float = 1000000, parts: int = PARTS, target: float = TARGET,
+                 averaging_threshold: float = AVERAGING_THRESHOLD, top_k: int = TOP_K,
+                 dma_window: int = DMA_WINDOW, compound: bool = False):
+        """compound: size each buy from current equity / parts instead of starting capital / parts"""
+        self.capital = capital
+        self.parts = parts
+        self.target = target
+        self.averaging_threshold = averaging_threshold
+        self.top_k = top_k
+        self.dma_window = dma_window
+        self.compound = compound
+
+    def pct_from_dma(self, closes: np.ndarray) -> np.ndarray:
+        """(close - DMA) / DMA for the whole matrix"""
+        dma = dma_matrix(closes, self.dma_window)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (closes - dma) / dma
+
+    def run(self, dates, symbols: List[str], closes: np.ndarray, start: int = 0) -> Dict:
+        """
+        Backtest one close matrix. Trading starts at row `start`; earlier rows only warm up the DMA.
+        dates: datetime64 per row (calendar days drive the LTCG holding period)
+        """
+        closes = np.asarray(closes, dtype=np.float64)
+        dates = np.asarray(dates, dtype='datetime64[D]')
+        days, count = closes.shape
+        pct = self.pct_from_dma(closes)
+        marks = np.nan_to_num(forward_fill(closes))
+        calendar = (dates - dates[0]).astype(np.int64) if days else dates.astype(np.int64)
+
+        simulation = Simulation(self, 1, count, record=True)
+        equity = np.empty(max(days - start, 0))
+        for day in range(start, days):
+            equity[day - start] = simulation.step(calendar[day], closes[day][None], pct[day][None],
+                                                  marks[day][None])[0]
+        return self._report(dates[start:], symbols, equity, simulation, marks[-1] if days else np.zeros(count),
+                            dates[0] if days else None)
+
+    def _report(self, dates, symbols, equity, simulation: 'Simulation', last_marks, origin) -> Dict:
+        log = np.array(simulation.trades, dtype=np.float64).reshape(-1, 6)
+        day, column, side, units, price, buy_price = log.T
+        sells = side == 1
+        open_mask = np.arange(simulation.capacity)[None, :] < simulation.depth[0][:, None]
+        lot_qty, lot_price = simulation.lot_qty[0], simulation.lot_price[0]
+        invested = float((lot_price * lot_qty)[open_mask].sum())
+        market_value = float((lot_qty.sum(axis=1, where=open_mask) * last_marks).sum())
+        final = float(equity[-1]) if len(equity) else float(self.capital)
+        sold = int(simulation.sells[0])
+
+        summary = {
+            'start': str(dates[0]) if len(dates) else None,
+            'end': str(dates[-1]) if len(dates) else None,
+            'days': len(equity),
+            'capital': self.capital,
+            'final_equity': round(final, 2),
+            'total_return': final / self.capital - 1,
+            'cagr': cagr(final / self.capital, len(equity)),
+            'max_drawdown': max_drawdown(equity),
+            'utilisation': float(simulation.utilisation[0] / len(equity)) if len(equity) else 0.0,
+            'buys': int(simulation.buys[0]),
+            'sells': sold,
+            'realised_profit': round(float(simulation.realised[0]), 2),
+            'tax': round(float(simulation.tax[0]), 2),
+            'avg_holding_days': float(simulation.holding_days[0] / sold) if sold else None,
+            'open_lots': int(simulation.depth[0].sum()),
+            'open_invested': round(invested, 2),
+            'unrealised_pl': round(market_value - invested, 2),
+            'cash': round(float(simulation.cash[0]), 2),
+        }
+        return {
+            'summary': summary,
+            'equity': equity,
+            'trades': {
+                'date': origin + day.astype(np.int64) if origin is not None else np.array([], 'datetime64[D]'),
+                'symbol': np.asarray(symbols, dtype=object)[column.astype(int)],
+                'side': np.where(sells, 'SELL', 'BUY'),
+                'quantity': units.astype(np.int64),
+                'price': price,
+                'buy_price': buy_price,
+            },
+        }
+
+
+def cagr(growth, days: int):
+    """Annualised growth from a final/initial equity ratio (scalar or array) over `days` trading days"""
+    years = max(days / TRADING_DAYS, 1 / TRADING_DAYS)
+    growth = np.asarray(growth, dtype=np.float64)
+    result = np.where(growth > 0, np.maximum(growth, 1e-12) ** (1 / years) - 1, -1.0)
+    return float(result) if result.ndim == 0 else result
+
+
+class Simulation:
+    """
+    Strategy state for S independent scenarios over the same N ETFs, advanced one day at a time.
+    Every rule is applied to all scenarios with array operations; lots are per-scenario,
+    per-ETF LIFO stacks.
+    """
+
+    def __init__(self, strategy: Backtester, scenarios: int, count: int, record: bool = False):
+        self.strategy = strategy
+        self.capacity = 8
+        self.cash = np.full(scenarios, float(strategy.capital))
+        self.equity = self.cash.copy()
+        self.depth = np.zeros((scenarios, count), dtype=np.int64)
+        self.quantity = np.zeros((scenarios, count), dtype=np.int64)
+        self.lot_price = np.zeros((scenarios, count, self.capacity))
+        self.lot_qty = np.zeros((scenarios, count, self.capacity), dtype=np.int64)
+        self.lot_day = np.zeros((scenarios, count, self.capacity), dtype=np.int64)
+        self.realised = np.zeros(scenarios)
+        self.tax = np.zeros(scenarios)
+        self.buys = np.zeros(scenarios, dtype=np.int64)
+        self.sells = np.zeros(scenarios, dtype=np.int64)
+        self.holding_days = np.zeros(scenarios, dtype=np.int64)
+        self.utilisation = np.zeros(scenarios)
+        self._grid = (np.arange(scenarios)[:, None], np.arange(count)[None, :])
+        # (calendar day, column, side, qty, price, buy price) for scenario 0, when recording
+        self.trades = [] if record else None
+
+    def _grow(self):
+        self.capacity *= 2
+        pad = ((0, 0), (0, 0), (0, self.capacity - self.lot_price.shape[2]))
+        self.lot_price = np.pad(self.lot_price, pad)
+        self.lot_qty = np.pad(self.lot_qty, pad)
+        self.lot_day = np.pad(self.lot_day, pad)
+
+    def step(self, day: int, close: np.ndarray, pct: np.ndarray, marks: np.ndarray) -> np.ndarray:
+        """
+        Trade one day. close/pct/marks are (scenarios x ETFs); day is a calendar day number.
+        Returns each scenario's end-of-day equity.
+        """
+        strategy = self.strategy
+        live = ~np.isnan(close)
+        top_lot = np.maximum(self.depth - 1, 0)
+        last_price = self.lot_price[self._grid + (top_lot,)]
+        last_qty = self.lot_qty[self._grid + (top_lot,)]
+        held = self.depth > 0
+
+        # Sell: in each scenario, the LIFO lot with the largest profit among those at target
+        with np.errstate(invalid='ignore'):
+            ready = held & live & (close >= last_price * (1 + strategy.target))
+        rows = np.flatnonzero(ready.any(axis=1))
+        if rows.size:
+            column = np.argmax(np.where(ready[rows], (close[rows] - last_price[rows]) * last_qty[rows], -np.inf), axis=1)
+            slot = self.depth[rows, column] - 1
+            units = self.lot_qty[rows, column, slot]
+            price = close[rows, column]
+            bought = self.lot_price[rows, column, slot]
+            held_days = day - self.lot_day[rows, column, slot]
+            gain = (price - bought) * units
+            self.cash[rows] += units * price
+            self.quantity[rows, column] -= units
+            self.depth[rows, column] -= 1
+            self.realised[rows] += gain
+            self.tax[rows] += np.maximum(gain, 0) * np.where(held_days >= LTCG_DAYS, LTCG_RATE, STCG_RATE)
+            self.sells[rows] += 1
+            self.holding_days[rows] += held_days
+            held[rows, column] = self.depth[rows, column] > 0
+            last_price[rows, column] = self.lot_price[rows, column, np.maximum(slot - 1, 0)]
+            if self.trades is not None and rows[0] == 0:
+                self.trades.append((day, column[0], 1, units[0], price[0], bought[0]))
+
+        # Buy: first top-K ETF not held, else average down the held ETF that fell the most
+        chunk = np.broadcast_to((self.equity if strategy.compound else strategy.capital) / strategy.parts,
+                                self.cash.shape)
+        rows = np.flatnonzero(self.cash >= chunk)
+        if rows.size:
+            candidates = top_k(pct[rows], strategy.top_k)
+            fresh = ~np.isnan(pct[rows[:, None], candidates]) & ~held[rows[:, None], candidates]
+            has_fresh = fresh.any(axis=1)
+            first_fresh = candidates[np.arange(rows.size), np.argmax(fresh, axis=1)]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                fallen = np.where(held[rows] & live[rows], (last_price[rows] - close[rows]) / last_price[rows], -np.inf)
+            most_fallen = np.argmax(fallen, axis=1)
+            averaging = fallen[np.arange(rows.size), most_fallen] >= strategy.averaging_threshold
+            column = np.where(has_fresh, first_fresh, most_fallen)
+            buying = has_fresh | averaging
+            rows, column = rows[buying], column[buying]
+            price = close[rows, column]
+            units = (chunk[rows] // price).astype(np.int64)
+            rows, column, price, units = rows[units > 0], column[units > 0], price[units > 0], units[units > 0]
+            if rows.size:
+                slot = self.depth[rows, column]
+                while slot.max() >= self.capacity:
+                    self._grow()
+                self.lot_price[rows, column, slot] = price
+                self.lot_qty[rows, column, slot] = units
+                self.lot_day[rows, column, slot] = day
+                self.depth[rows, column] += 1
+                self.quantity[rows, column] += units
+                self.cash[rows] -= units * price
+                self.buys[rows] += 1
+                if self.trades is not None and rows[0] == 0:
+                    self.trades.append((day, column[0], 0, units[0], price[0], price[0]))
+
+        self.equity = self.cash + (self.quantity * marks).sum(axis=1)
+        self.utilisation += 1 - self.cash / self.equity
+        return self.equity
+
+
+def run_from_store(store, symbols: Optional[List[str]] = None, start: Optional[str] = None,
+                   end: Optional[str] = None, **params) -> Dict:
+    """Backtest over the close matrix in a history_store.HistoryStore"""
+    dates, columns, closes = store.closes(symbols, start, end)
+    return Backtester(**params).run(dates, columns, closes)
+
+
+def main():
+    from history_store import HistoryStore, HISTORY_DB
+
+    parser = argparse.ArgumentParser(description='Backtest the DMA20 dip-buy / LIFO target strategy')
+    parser.add_argument('--db', default=HISTORY_DB)
+    parser.add_argument('--symbols', help='comma separated, default every symbol in the store')
+    parser.add_argument('--start')
+    parser.add_argument('--end')
+    parser.add_argument('--capital', type=float, default=1000000)
+    parser.add_argument('--parts', type=int, default=PARTS)
+    parser.add_argument('--target', type=float, default=TARGET)
+    parser.add_argument('--compound', action='store_true')
+    args = parser.parse_args()
+
+    symbols = args.symbols.split(',') if args.symbols else None
+    result = run_from_store(HistoryStore(args.db), symbols, args.start, args.end, capital=args.capital,
+                            parts=args.parts, target=args.target, compound=args.compound)
+    for key, value in result['summary'].items():
+        print(f"{key:>18}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from backtester import Backtester, forward_fill, max_drawdown, top_k
+from dma_calculator import DMA_WINDOW, DMACalculator, dma_matrix
+
+
+def gapped_market(days=300, count=6, seed=7, gaps=0.1):
+    """Random-walk closes for `count` ETFs with a share of missing days (NaN) and a late listing"""
+    rng = np.random.default_rng(seed)
+    closes = 100 * np.cumprod(1 + rng.normal(0, 0.015, size=(days, count)), axis=0)
+    closes[rng.random((days, count)) < gaps] = np.nan
+    closes[:60, -1] = np.nan
+    dates = np.datetime64('2022-01-03') + np.arange(days)
+    return dates, closes
+
+
+def test_dma_matrix_matches_calculate_dma20_on_gapped_history():
+    _, closes = gapped_market()
+    closes[5:9, 0] = 0.0  # bad ticks are skipped like missing days
+    dma = dma_matrix(closes)
+    calculator = DMACalculator()
+    for column in range(closes.shape[1]):
+        for day in range(len(closes)):
+            bars = [{'close': value} for value in closes[:day + 1, column] if not np.isnan(value)]
+            expected = calculator.calculate_dma20(bars)
+            if expected is None:
+                assert np.isnan(dma[day, column])
+            else:
+                assert dma[day, column] == pytest.approx(expected)
+
+
+def test_dma_matrix_empty_and_short():
+    assert dma_matrix(np.empty((0, 3))).shape == (0, 3)
+    assert np.isnan(dma_matrix(np.ones((DMA_WINDOW - 1, 2)))).all()
+
+
+def test_final_equity_is_cash_plus_open_positions():
+    dates, closes = gapped_market()
+    summary = Backtester(capital=100000, parts=10).run(dates, [f'E{i}' for i in range(closes.shape[1])], closes,
+                                                       start=DMA_WINDOW)['summary']
+    assert summary['buys'] > 0 and summary['sells'] > 0
+    assert summary['final_equity'] == pytest.approx(
+        summary['cash'] + summary['open_invested'] + summary['unrealised_pl'], abs=0.05)
+
+
+def test_trades_log_matches_counts():
+    dates, closes = gapped_market()
+    result = Backtester(capital=100000, parts=10).run(dates, list('ABCDEF'), closes, start=DMA_WINDOW)
+    sides = list(result['trades']['side'])
+    assert sides.count('BUY') == result['summary']['buys']
+    assert sides.count('SELL') == result['summary']['sells']
+    assert len(result['equity']) == len(closes) - DMA_WINDOW
+
+
+def test_helpers():
+    closes = np.array([[np.nan, 1.0], [2.0, np.nan], [np.nan, 3.0]])
+    filled = forward_fill(closes)
+    assert np.isnan(filled[0, 0])
+    assert list(filled[1:, 0]) == [2.0, 2.0] and list(filled[:, 1]) == [1.0, 1.0, 3.0]
+    assert max_drawdown(np.array([100.0, 120.0, 90.0, 130.0])) == pytest.approx(0.25)
+    assert top_k(np.array([[0.1, -0.2, np.nan, -0.5]]), 2).tolist() == [[3, 1]]
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Basket Execution Pipeline
+Turns the day's buy/sell decisions into one broker basket, gets its margin from the broker
+and places the netted orders through the bulk order engine
+"""
+
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from structured_logging import get_logger
+from warmup import IST
+
+logger = get_logger('basket_executor')
+
+INDEX_PATH = os.environ.get('ETF_INSTRUMENT_INDEX', 'etf_instruments.idx')
+INDEX_MAX_AGE = 24 * 3600
+
+# MStocks basket codes for the CalculateBasket form fields
+PRODUCT_CODES = {'CNC': 'C', 'MIS': 'I', 'NRML': 'M'}
+ORDER_TYPE_CODES = {'MARKET': 'MKT', 'LIMIT': 'LMT', 'SL': 'SL', 'SL-M': 'SLM'}
+EXCHANGE_IDS = {'NSE': '1', 'BSE': '4'}
+SIDE_CODES = {'BUY': 'B', 'SELL': 'S'}
+MARGIN_FIELDS = ('total_margin', 'TotalMargin', 'basket_margin', 'required_margin', 'margin', 'Margin')
+
+
+def _first(data, fields):
+    """First present field from a response dict (or the first dict of a list)"""
+    if isinstance(data, list):
+        data = data[0] if data else {}
+    if not isinstance(data, dict):
+        return None
+    for field in fields:
+        if data.get(field) not in (None, ''):
+            return data[field]
+    return None
+
+
+def build_orders(decisions: Dict) -> List[Dict]:
+    """
+    Net the day's decisions into one order per symbol.
+    decisions: {'buy': [{'symbol', 'quantity', 'price'?}], 'sell': [...one entry per LIFO lot...]}
+    Lots of the same symbol collapse into one order; a buy and sell of the same symbol cancel out.
+    """
+    net = {}
+    for side, sign in (('buy', 1), ('sell', -1)):
+        for item in decisions.get(side) or []:
+            symbol = str(item.get('symbol', '')).replace('NSE:', '').replace('BSE:', '').strip()
+            if not symbol:
+                continue
+            entry = net.setdefault(symbol, {'quantity': 0, 'price': 0.0,
+                                            'exchange': item.get('exchange', 'NSE'),
+                                            'product': item.get('product', 'CNC')})
+            entry['quantity'] += sign * int(item.get('quantity', 0))
+            if item.get('price'):
+                entry['price'] = float(item['price'])
+    orders = []
+    for symbol, entry in net.items():
+        if entry['quantity'] == 0:
+            continue
+        orders.append({
+            'symbol': symbol,
+            'exchange': entry['exchange'],
+            'transaction_type': 'BUY' if entry['quantity'] > 0 else 'SELL',
+            'quantity': abs(entry['quantity']),
+            'order_type': 'MARKET',
+            'product': entry['product'],
+            'price': entry['price'],
+        })
+    return orders
+
+
+def basket_digest(orders: List[Dict]) -> str:
+    """Short hash of a netted basket; the same legs in any order give the same digest"""
+    legs = sorted(f"{order['transaction_type']}:{order['symbol']}:{order['quantity']}" for order in orders)
+    return hashlib.sha256('|'.join(legs).encode()).hexdigest()[:16]
+
+
+class BasketPipeline:
+    def __init__(self, fetcher, order_engine, index_path: str = INDEX_PATH):
+        self.fetcher = fetcher
+        self.order_engine = order_engine
+        self.index_path = index_path
+        self._client = None
+        self._index = None
+        self._baskets: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def client(self):
+        """MConnect bound to the fetcher's current session"""
+        from tradingapi_a.mconnect import MConnect
+        with self._lock:
+            if self._client is None:
+                self._client = MConnect(api_key=self.fetcher.api_key, access_Token=self.fetcher.access_token, debug=False)
+            else:
+                self._client.set_api_key(self.fetcher.api_key)
+                self._client.set_access_token(self.fetcher.access_token)
+            return self._client
+
+    def instrument_index(self, refresh: bool = False):
+        """ETF instrument index, rebuilt from the streamed scriptmaster when missing, a day old or `refresh`"""
+        from tradingapi_a.scriptmaster import InstrumentIndex
+        with self._lock:
+            fresh = (not refresh and os.path.exists(self.index_path)
+                     and time.time() - os.path.getmtime(self.index_path) < INDEX_MAX_AGE)
+            if self._index is not None and fresh:
+                return self._index
+        if not fresh:
+            count = self.client().build_instrument_index(self.index_path)
+            logger.info("Instrument index rebuilt", extra={'instruments': count, 'path': self.index_path})
+        with self._lock:
+            self._index = InstrumentIndex(self.index_path)
+            return self._index
+
+    def _find_basket(self, name: str) -> Optional[str]:
+        for basket in self.client().fetch_basket().json().get('data') or []:
+            if name in (basket.get('BaskName'), basket.get('basket_name'), basket.get('BasketName')):
+                basket_id = _first(basket, ('BasketId', 'basket_id', 'basketId', 'BaskId'))
+                return str(basket_id) if basket_id else None
+        return None
+
+    def basket_id(self, name: str, fresh: bool = False) -> str:
+        """ID of the named basket, creating it on first use; `fresh` deletes an existing one so it starts empty"""
+        if fresh:
+            existing = self._baskets.pop(name, None) or self._find_basket(name)
+            if existing:
+                # Raises if the broker refuses, rather than loading legs on top of the old ones
+                self.client().delete_basket(existing)
+        elif name in self._baskets:
+            return self._baskets[name]
+        client = self.client()
+        basket_id = None
+        try:
+            basket_id = _first(client.create_basket(name, 'ETF daily rebalance').json().get('data'),
+                               ('BasketId', 'basket_id', 'basketId', 'BaskId'))
+        except Exception as e:
+            # Most likely the basket already exists; look it up below
+            logger.debug("Create basket failed: %s", e, extra={'basket': name})
+        if not basket_id and not fresh:
+            basket_id = self._find_basket(name)
+        if not basket_id:
+            raise RuntimeError(f'Could not create or find basket {name}')
+        self._baskets[name] = str(basket_id)
+        return self._baskets[name]
+
+    def prepare(self, orders: List[Dict], name: str) -> Dict:
+        """
+        Load the orders into a fresh basket of that name (a re-run replaces the earlier legs instead of
+        adding to them). CalculateBasket adds one leg per call and answers with the margin of the basket
+        so far, so the last leg's response carries the margin for exactly these orders.
+        """
+        client = self.client()
+        index = self.instrument_index()
+        basket_id = self.basket_id(name, fresh=True)
+        legs, margin = [], None
+        for priority, order in enumerate(orders, start=1):
+            instrument = index.get(order['symbol'], order.get('exchange', 'NSE'))
+            if instrument is None:
+                legs.append({'symbol': order['symbol'], 'status': 'error', 'message': 'Unknown instrument'})
+                continue
+            response = client.calculate_basket(
+                "0", PRODUCT_CODES.get(order['product'], 'C'), "0", "E", "0",
+                str(instrument['exchange_token']), ORDER_TYPE_CODES.get(order['order_type'], 'MKT'),
+                name, "I", "DAY", str(order['quantity']), "A", SIDE_CODES[order['transaction_type']],
+                str(priority), str(order.get('price') or 0), basket_id,
+                EXCHANGE_IDS.get(order.get('exchange', 'NSE'), '1'),
+            )
+            data = response.json().get('data')
+            leg_margin = _first(data, MARGIN_FIELDS)
+            if leg_margin is not None:
+                margin = float(leg_margin)
+            legs.append({'symbol': order['symbol'], 'status': 'success', 'margin': leg_margin})
+        return {'basket_id': basket_id, 'name': name, 'margin': margin, 'legs': legs}
+
+    def execute(self, decisions: Dict, place: bool = True, name: Optional[str] = None,
+                wait_seconds: float = 0, run_id: Optional[str] = None) -> Dict:
+        """
+        Net the decisions, build the basket and (unless place=False) submit it.
+        Submissions are keyed by the IST day, `run_id` and the basket contents, so retrying the same
+        basket never double-places; a second, deliberate run of the same basket that day needs a new
+        `run_id`.
+        """
+        orders = build_orders(decisions)
+        if not orders:
+            return {'status': 'success', 'message': 'Nothing to trade after netting', 'orders': []}
+        day = datetime.now(IST).date()
+        name = name or f"ETF-{day:%Y%m%d}"
+        basket = self.prepare(orders, name)
+        result = {'status': 'success', 'basket': basket, 'orders': orders}
+        if any(leg['status'] == 'error' for leg in basket['legs']):
+            result['status'] = 'error'
+            result['message'] = 'Some basket legs could not be resolved'
+            return result
+        if place:
+            # Legs are keyed by side/symbol/quantity (one order per symbol after netting), not by position,
+            # so re-ordered decisions still hit the same keys
+            batch_id = f"basket:{day.isoformat()}:{run_id or 'default'}:{basket_digest(orders)}"
+            keyed = [dict(order, idempotency_key=(
+                f"{batch_id}:{order['transaction_type']}:{order['symbol']}:{order['quantity']}")) for order in orders]
+            result['execution'] = self.order_engine.submit(
+                keyed, batch_id=batch_id, sells_first=True, wait_seconds=wait_seconds,
+                basket_margin=basket['margin'])
+            result['status'] = result['execution']['status']
+        return result
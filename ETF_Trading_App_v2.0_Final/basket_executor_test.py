@@ -0,0 +1,71 @@
+import pytest
+
+from basket_executor import BasketPipeline, basket_digest, build_orders
+from order_engine import BulkOrderEngine, IdempotencyStore
+
+
+class FakeFetcher:
+    def __init__(self):
+        self.placed = []
+
+    def place_order(self, **order):
+        self.placed.append(order['tradingsymbol'])
+        return {'status': 'success', 'data': [{'order_id': f"OID{len(self.placed)}"}]}
+
+    def get_order_book(self):
+        return {'status': 'success', 'data': []}
+
+
+class FakePipeline(BasketPipeline):
+    """Skips the broker basket; only the submission is exercised"""
+
+    def prepare(self, orders, name):
+        return {'basket_id': '1', 'name': name, 'margin': None, 'legs': [{'status': 'success'} for _ in orders]}
+
+
+DECISIONS = {
+    'buy': [{'symbol': 'NIFTYBEES', 'quantity': 10}, {'symbol': 'GOLDBEES', 'quantity': 5}],
+    'sell': [{'symbol': 'ITBEES', 'quantity': 3}],
+}
+
+
+@pytest.fixture
+def pipeline(tmp_path):
+    fetcher = FakeFetcher()
+    return FakePipeline(fetcher, BulkOrderEngine(fetcher, store=IdempotencyStore(str(tmp_path / 'orders.db'))))
+
+
+def test_build_orders_nets_lots_per_symbol():
+    orders = build_orders({'buy': [{'symbol': 'NSE:NIFTYBEES', 'quantity': 10}],
+                           'sell': [{'symbol': 'NIFTYBEES', 'quantity': 4}, {'symbol': 'GOLDBEES', 'quantity': 2},
+                                    {'symbol': 'GOLDBEES', 'quantity': 3}]})
+    assert [(o['symbol'], o['transaction_type'], o['quantity']) for o in orders] == [
+        ('NIFTYBEES', 'BUY', 6), ('GOLDBEES', 'SELL', 5)]
+
+
+def test_retried_basket_is_not_placed_twice_even_reordered(pipeline):
+    assert pipeline.execute(DECISIONS)['status'] == 'success'
+    reordered = {'buy': DECISIONS['buy'][::-1], 'sell': DECISIONS['sell']}
+    retry = pipeline.execute(reordered)
+    assert retry['execution']['summary']['duplicates'] == 3
+    assert len(pipeline.fetcher.placed) == 3
+
+
+def test_new_run_id_places_the_same_basket_again(pipeline):
+    pipeline.execute(DECISIONS, run_id='morning')
+    second = pipeline.execute(DECISIONS, run_id='averaging')
+    assert second['execution']['summary']['duplicates'] == 0
+    assert len(pipeline.fetcher.placed) == 6
+
+
+def test_changed_basket_gets_its_own_batch(pipeline):
+    first = pipeline.execute(DECISIONS)
+    changed = pipeline.execute({'buy': DECISIONS['buy'] + [{'symbol': 'BANKBEES', 'quantity': 1}]})
+    assert first['execution']['batch_id'] != changed['execution']['batch_id']
+    assert changed['execution']['summary']['duplicates'] == 0
+
+
+def test_basket_digest_ignores_leg_order():
+    orders = build_orders(DECISIONS)
+    assert basket_digest(orders) == basket_digest(orders[::-1])
+    assert basket_digest(orders) != basket_digest(orders[:2])
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Upstream Circuit Breakers
+One breaker per MStocks API family (Type A, Type B). After repeated upstream failures
+(timeouts, connection errors, 5xx) the family's circuit opens and callers route straight to
+the healthy family; after a cool-down a single trial call decides whether it closes again
+"""
+
+import os
+import threading
+import time
+from typing import Dict
+
+from metrics import CIRCUIT_STATE, CIRCUIT_REJECTED
+from structured_logging import get_logger
+
+logger = get_logger('circuit_breaker')
+
+FAILURE_THRESHOLD = int(os.environ.get('ETF_CIRCUIT_FAILURES', '5'))
+RESET_SECONDS = float(os.environ.get('ETF_CIRCUIT_RESET_SECONDS', '30'))
+
+CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+def upstream_failed(status_code) -> bool:
+    """Responses that say the API itself is unhealthy (4xx are about the request or session)"""
+    return status_code is None or status_code >= 500
+
+
+class CircuitBreaker:
+    def __init__(self, family: str, failure_threshold: int = FAILURE_THRESHOLD, reset_seconds: float = RESET_SECONDS):
+        self.family = family
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._trial_at = None
+        self._lock = threading.Lock()
+        CIRCUIT_STATE.set(0, family=family)
+
+    def _set(self, state: str):
+        """Caller holds the lock"""
+        if state != self.state:
+            logger.warning("Circuit %s: %s -> %s", self.family, self.state, state,
+                           extra={'family': self.family, 'failures': self.failures})
+            self.state = state
+            CIRCUIT_STATE.set(STATE_VALUES[state], family=self.family)
+
+    @property
+    def closed(self) -> bool:
+        return self.state == CLOSED
+
+    def allow(self) -> bool:
+        """True if a call may go to this family now (an open circuit lets one trial through per cool-down)"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            now = time.monotonic()
+            if self.state == OPEN and now - self.opened_at >= self.reset_seconds:
+                self._set(HALF_OPEN)
+            if self.state == HALF_OPEN and (self._trial_at is None or now - self._trial_at >= self.reset_seconds):
+                self._trial_at = now
+                return True
+            CIRCUIT_REJECTED.inc(family=self.family)
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._trial_at = None
+            self._set(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._trial_at = None
+                self._set(OPEN)
+
+    def record(self, status_code):
+        """Record one response by its status code (None for a timeout or connection error)"""
+        if upstream_failed(status_code):
+            self.record_failure()
+        else:
+            self.record_success()
+
+    def status(self) -> Dict:
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'retry_in': (round(max(self.reset_seconds - (time.monotonic() - self.opened_at), 0), 1)
+                         if self.state == OPEN else None),
+        }
+
+
+# Shared by every fetcher in this process
+CIRCUITS = {family: CircuitBreaker(family) for family in ('typeb', 'typea')}
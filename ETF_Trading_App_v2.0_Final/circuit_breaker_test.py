@@ -0,0 +1,176 @@
+import threading
+import time
+
+import pytest
+
+import circuit_breaker
+import price_fetcher
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, upstream_failed
+from price_fetcher import CIRCUITS, MStocksPriceFetcher
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker.time, 'monotonic', clock)
+    return clock
+
+
+def test_upstream_failed():
+    assert upstream_failed(None) and upstream_failed(500) and upstream_failed(503)
+    assert not upstream_failed(200) and not upstream_failed(401) and not upstream_failed(429)
+
+
+def test_opens_after_threshold_failures(clock):
+    breaker = CircuitBreaker('test', failure_threshold=3, reset_seconds=30)
+    for _ in range(2):
+        breaker.record(None)
+    assert breaker.state == CLOSED and breaker.allow()
+    breaker.record(502)
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.status() == {'state': OPEN, 'failures': 3, 'retry_in': 30.0}
+
+
+def test_success_resets_the_failure_count(clock):
+    breaker = CircuitBreaker('test', failure_threshold=3)
+    breaker.record(None)
+    breaker.record(None)
+    breaker.record(200)
+    breaker.record(None)
+    assert breaker.state == CLOSED
+    assert breaker.failures == 1
+
+
+def test_half_open_allows_one_trial_per_cool_down(clock):
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_seconds=30)
+    breaker.record_failure()
+    clock.now += 29
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()  # the trial is still out
+    clock.now += 30
+    assert breaker.allow()      # a trial that never reported back does not wedge the circuit
+
+
+def test_half_open_trial_closes_or_reopens(clock):
+    breaker = CircuitBreaker('test', failure_threshold=2, reset_seconds=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_failure()  # one failed trial is enough to re-open
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_success()
+    assert (breaker.state, breaker.failures) == (CLOSED, 0)
+    assert breaker.allow()
+
+
+@pytest.fixture
+def fetcher(tmp_path, monkeypatch):
+    monkeypatch.setenv('MSTOCKS_SESSION_DB', str(tmp_path / 'session.db'))
+    monkeypatch.setitem(CIRCUITS, 'typeb', CircuitBreaker('typeb'))
+    monkeypatch.setitem(CIRCUITS, 'typea', CircuitBreaker('typea'))
+    fetcher = MStocksPriceFetcher(restore=False)
+    fetcher.auto_refresh_session = lambda: True
+    fetcher.hedge_delay = 0.05
+    fetcher.calls = []
+    return fetcher
+
+
+def quote_source(fetcher, name, price=None, delay=0.0, gate=None):
+    """
+    Stub for _get_live_price_typeb/_typea answering `price` after `delay` (or once `gate` is set).
+    Without a price Type B returns None (fall back) and Type A an error result, as the real calls do.
+    """
+    def get(symbol):
+        fetcher.calls.append(name)
+        if gate is not None:
+            gate.wait(2)
+        time.sleep(delay)
+        if price:
+            return {'status': 'success', 'price': price, 'symbol': symbol}
+        return None if name == 'typeb' else {'status': 'error', 'message': 'Price not found', 'symbol': symbol}
+    setattr(fetcher, f'_get_live_price_{name}', get)
+
+
+def test_hedge_pool_is_created_by_the_first_hedged_call(fetcher, monkeypatch):
+    monkeypatch.setattr(price_fetcher, '_hedge_pool', None)
+    quote_source(fetcher, 'typeb', 101.0)
+    other = MStocksPriceFetcher(restore=False)
+    assert price_fetcher._hedge_pool is None
+    fetcher.get_live_price('NIFTYBEES', hedge=False)
+    assert price_fetcher._hedge_pool is None
+    fetcher.get_live_price('NIFTYBEES', hedge=True)
+    pool = price_fetcher._hedge_pool
+    assert pool is not None
+    quote_source(other, 'typeb', 101.0)
+    other.auto_refresh_session = lambda: True
+    other.get_live_price('NIFTYBEES', hedge=True)
+    assert price_fetcher._hedge_pool is pool
+    pool.shutdown()
+
+
+def test_fast_primary_is_not_hedged(fetcher):
+    quote_source(fetcher, 'typeb', 101.0)
+    quote_source(fetcher, 'typea', 99.0)
+    assert fetcher.get_live_price('NIFTYBEES', hedge=True)['price'] == 101.0
+    assert fetcher.calls == ['typeb']
+
+
+def test_slow_primary_loses_to_the_hedge(fetcher):
+    release = threading.Event()
+    quote_source(fetcher, 'typeb', 101.0, gate=release)
+    quote_source(fetcher, 'typea', 99.0)
+    try:
+        assert fetcher.get_live_price('NIFTYBEES', hedge=True)['price'] == 99.0
+        assert fetcher.calls == ['typeb', 'typea']
+    finally:
+        release.set()
+
+
+def test_slow_primary_wins_when_the_hedge_finds_nothing(fetcher):
+    quote_source(fetcher, 'typeb', 101.0, delay=0.2)
+    quote_source(fetcher, 'typea', None)
+    assert fetcher.get_live_price('NIFTYBEES', hedge=True)['price'] == 101.0
+
+
+def test_no_price_anywhere_is_an_error(fetcher):
+    quote_source(fetcher, 'typeb', None, delay=0.1)
+    quote_source(fetcher, 'typea', None)
+    result = fetcher.get_live_price('NIFTYBEES', hedge=True)
+    assert result['status'] == 'error'
+
+
+def test_open_circuit_skips_the_hedge_and_the_family(fetcher):
+    for _ in range(CIRCUITS['typeb'].failure_threshold):
+        CIRCUITS['typeb'].record_failure()
+    quote_source(fetcher, 'typeb', 101.0)
+    quote_source(fetcher, 'typea', 99.0)
+    assert fetcher.get_live_price('NIFTYBEES', hedge=True)['price'] == 99.0
+    assert fetcher.calls == ['typea']
+
+
+def test_both_circuits_open_is_an_error_without_calls(fetcher):
+    for family in ('typeb', 'typea'):
+        for _ in range(CIRCUITS[family].failure_threshold):
+            CIRCUITS[family].record_failure()
+    quote_source(fetcher, 'typeb', 101.0)
+    quote_source(fetcher, 'typea', 99.0)
+    result = fetcher.get_live_price('NIFTYBEES')
+    assert result['status'] == 'error' and 'circuit open' in result['message']
+    assert fetcher.calls == []
@@ -4,7 +4,6 @@ Debug script to test session storage
 """
 
 from price_fetcher import MStocksPriceFetcher
-import os
 
 def test_session_storage():
     print("🧪 Testing Session Storage")
@@ -13,8 +12,8 @@ def test_session_storage():
     # Create a new fetcher instance
     fetcher = MStocksPriceFetcher()
     
-    print(f"📁 Session file: {fetcher.session_file}")
-    print(f"📁 File exists: {os.path.exists(fetcher.session_file)}")
+    print(f"📁 Session store: {fetcher.session_file}")
+    print(f"📁 Store version: {fetcher.session_store.version()}")
     
     # Test saving session
     print("\n💾 Testing session save...")
@@ -25,7 +24,7 @@ def test_session_storage():
     
     save_result = fetcher.save_session()
     print(f"Save result: {save_result}")
-    print(f"📁 File exists after save: {os.path.exists(fetcher.session_file)}")
+    print(f"📁 Store version after save: {fetcher.session_store.version()}")
     
     # Test restoring session
     print("\n📂 Testing session restore...")
@@ -43,7 +42,7 @@ def test_session_storage():
     # Clean up
     print("\n🧹 Cleaning up...")
     fetcher.clear_session()
-    print(f"📁 File exists after clear: {os.path.exists(fetcher.session_file)}")
+    print(f"📁 Stored session after clear: {fetcher.session_store.load()[0]}")
 
 if __name__ == "__main__":
     test_session_storage() 
\ No newline at end of file
@@ -6,16 +6,63 @@ Fetches historical data and calculates DMA20 for ETFs
 
 import requests
 import json
+import os
+import threading
 import time
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional
-import pandas as pd
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from structured_logging import get_logger
+from tracing import span
+from rate_limiter import limited_call
+from metrics import (symbol_format_label, SYMBOL_FORMAT_RESOLVED, SYMBOL_FORMAT_EXHAUSTED,
+                     DMA_METHOD, CACHE_REQUESTS)
+
+logger = get_logger('dma_calculator')
+
+DMA_WINDOW = 20
+PRICE_FIELDS = ('close', 'last_price', 'ltp', 'price')
+HISTORY_RETRY_SECONDS = float(os.environ.get('ETF_HISTORY_RETRY_SECONDS', '900'))  # failed history is re-probed after this
+ESTIMATE_LOOKBACK_DAYS = 60  # calendar days of stored closes read for a stale estimate
+
+
+def dma_matrix(closes, window: int = DMA_WINDOW):
+    """
+    Moving average of every column of a (days x symbols) close matrix, as calculate_dma20
+    computes it from the history up to each day: mean of the last `window` valid (positive)
+    closes, skipping missing days, NaN until `window` valid closes are available
+    """
+    import numpy as np  # imported here so the API server starts without numpy
+    closes = np.asarray(closes, dtype=np.float64)
+    flat = closes.reshape(len(closes), int(np.prod(closes.shape[1:])))
+    valid = flat > 0  # NaN compares False; calculate_dma20 also drops non-positive closes
+    counts = np.cumsum(valid, axis=0)
+    sums = np.cumsum(np.where(valid, flat, 0.0), axis=0)
+    # by_count[k, j]: sum of the first k valid closes of column j
+    by_count = np.zeros((len(flat) + 1, flat.shape[1]))
+    rows, cols = np.nonzero(valid)
+    by_count[counts[rows, cols], cols] = sums[rows, cols]
+    columns = np.broadcast_to(np.arange(flat.shape[1]), counts.shape)
+    window_sum = by_count[counts, columns] - by_count[np.maximum(counts - window, 0), columns]
+    dma = np.where(counts >= window, window_sum / window, np.nan)
+    return dma.reshape(closes.shape)
+
 
 class DMACalculator:
-    def __init__(self):
+    def __init__(self, price_fetcher=None, history_store=None):
+        """
+        price_fetcher: shared MStocksPriceFetcher for current prices (None = a new one per call)
+        history_store: local HistoryStore that fetched bars are saved to and stale estimates read from
+        """
         self.base_url = "https://api.mstock.trade/openapi/typea"
         self.access_token = None
         self.api_key = None
+        self.price_fetcher = price_fetcher
+        self._history_formats: Dict[str, str] = {}  # symbol -> history format that last returned data
+        self.history_store = history_store
+        self._dma_cache: Dict[str, Tuple[date, Dict]] = {}  # symbol -> (trading day, DMA20 from history)
+        self._history_failures: Dict[str, float] = {}  # symbol -> monotonic time history last failed
+        self._lock = threading.Lock()
         
     def login(self, username: str, password: str) -> Dict:
         """Login to MStocks API"""
@@ -30,19 +77,19 @@ class DMACalculator:
                 'password': password
             }
             
-            print(f"🔐 Logging in with username: {username}")
-            response = requests.post(url, headers=headers, data=data, timeout=10)
+            logger.info("Logging in", extra={'username': username})
+            response = limited_call('login', requests.post, url, headers=headers, data=data, timeout=10)
             
             if response.status_code == 200:
                 result = response.json()
-                print(f"✅ Login successful: {result.get('status', 'Unknown')}")
+                logger.info("Login response: %s", result.get('status', 'Unknown'))
                 return result
             else:
-                print(f"❌ Login failed: {response.status_code} - {response.text}")
+                logger.warning("Login failed: %s", response.status_code, extra={'body': response.text[:200]})
                 return {'status': 'error', 'message': f'Login failed: {response.status_code}'}
                 
         except Exception as e:
-            print(f"❌ Login error: {str(e)}")
+            logger.error("Login error: %s", e)
             return {'status': 'error', 'message': str(e)}
     
     def generate_session(self, api_key: str, request_token: str, otp: str = None) -> Dict:
@@ -63,27 +110,26 @@ class DMACalculator:
             if otp:
                 payload['otp'] = otp
             
-            print(f"🔐 Generating session with API key: {api_key[:10]}...")
-            response = requests.post(url, headers=headers, data=payload, timeout=10)
+            logger.info("Generating session", extra={'api_key': api_key[:6] + '...'})
+            response = limited_call('session_token', requests.post, url, headers=headers, data=payload, timeout=10)
             
             if response.status_code == 200:
                 result = response.json()
-                print(f"✅ Session generated successfully")
                 
                 # Store credentials
                 self.access_token = result.get('data', {}).get('access_token')
                 self.api_key = api_key
                 
                 if self.access_token:
-                    print(f"✅ Access token obtained: {self.access_token[:20]}...")
+                    logger.info("Session generated successfully")
                 
                 return result
             else:
-                print(f"❌ Session generation failed: {response.status_code} - {response.text}")
+                logger.warning("Session generation failed: %s", response.status_code, extra={'body': response.text[:200]})
                 return {'status': 'error', 'message': f'Session generation failed: {response.status_code}'}
                 
         except Exception as e:
-            print(f"❌ Session generation error: {str(e)}")
+            logger.error("Session generation error: %s", e)
             return {'status': 'error', 'message': str(e)}
     
     def get_historical_data(self, symbol: str, days: int = 30) -> Dict:
@@ -105,6 +151,11 @@ class DMACalculator:
                 f"NSE:{clean_symbol}",
                 f"BSE:{clean_symbol}"
             ]
+            # Try the format that worked last time first
+            known = self._history_formats.get(clean_symbol)
+            if known in symbol_formats:
+                symbol_formats.remove(known)
+                symbol_formats.insert(0, known)
             
             headers = {
                 'X-Mirae-Version': '1',
@@ -114,7 +165,7 @@ class DMACalculator:
             
             for symbol_format in symbol_formats:
                 try:
-                    print(f"🔍 Trying to get historical data for: {symbol_format}")
+                    logger.debug("Trying historical data", extra={'symbol_format': symbol_format})
                     
                     # Try historical data endpoint
                     url = f"{self.base_url}/instruments/history"
@@ -125,13 +176,17 @@ class DMACalculator:
                         'interval': '1D'  # Daily data
                     }
                     
-                    response = requests.post(url, headers=headers, json=payload, timeout=10)
+                    with span('dma.history_attempt', endpoint='history', symbol_format=symbol_format):
+                        response = limited_call('history', requests.post, url, headers=headers, json=payload, timeout=10)
                     
                     if response.status_code == 200:
                         data = response.json()
-                        print(f"✅ Success getting historical data for {symbol_format}")
+                        logger.debug("Historical data response OK", extra={'symbol_format': symbol_format, 'endpoint': 'instruments/history'})
                         
                         if data.get('status') == 'success' and data.get('data'):
+                            self._history_formats[clean_symbol] = symbol_format
+                            SYMBOL_FORMAT_RESOLVED.inc(route='history',
+                                                       format=symbol_format_label(symbol_format, clean_symbol))
                             return {
                                 'status': 'success',
                                 'symbol': symbol,
@@ -147,13 +202,17 @@ class DMACalculator:
                         'to': datetime.now().strftime('%Y-%m-%d')
                     }
                     
-                    response = requests.post(url, headers=headers, json=payload, timeout=10)
+                    with span('dma.history_attempt', endpoint='market_history', symbol_format=symbol_format):
+                        response = limited_call('market_history', requests.post, url, headers=headers, json=payload, timeout=10)
                     
                     if response.status_code == 200:
                         data = response.json()
-                        print(f"✅ Success getting historical data from market endpoint for {symbol_format}")
+                        logger.debug("Historical data response OK", extra={'symbol_format': symbol_format, 'endpoint': 'market/history'})
                         
                         if data.get('status') == 'success' and data.get('data'):
+                            self._history_formats[clean_symbol] = symbol_format
+                            SYMBOL_FORMAT_RESOLVED.inc(route='market_history',
+                                                       format=symbol_format_label(symbol_format, clean_symbol))
                             return {
                                 'status': 'success',
                                 'symbol': symbol,
@@ -161,16 +220,17 @@ class DMACalculator:
                                 'format_used': symbol_format
                             }
                     
-                    print(f"⚠️ Format {symbol_format} failed: {response.status_code}")
+                    logger.debug("Historical data format failed", extra={'symbol_format': symbol_format, 'status_code': response.status_code})
                     
                 except Exception as e:
-                    print(f"❌ Error with format {symbol_format}: {str(e)}")
+                    logger.debug("Error with format %s: %s", symbol_format, e)
                     continue
             
+            SYMBOL_FORMAT_EXHAUSTED.inc(route='history')
             return {'status': 'error', 'message': 'All symbol formats failed for historical data'}
             
         except Exception as e:
-            print(f"❌ Get historical data error: {str(e)}")
+            logger.error("Get historical data error: %s", e, extra={'symbol': symbol})
             return {'status': 'error', 'message': str(e)}
     
     def get_current_price(self, symbol: str) -> Optional[float]:
@@ -198,7 +258,7 @@ class DMACalculator:
             
             for symbol_format in symbol_formats:
                 try:
-                    print(f"🔍 Trying Type B API for current price: {symbol_format}")
+                    logger.debug("Trying Type B API for current price", extra={'symbol_format': symbol_format})
                     
                     # Use Type B API endpoint as per official docs
                     url = f"{typeb_base_url}/instruments/quote"
@@ -211,28 +271,28 @@ class DMACalculator:
                         }
                     }
                     
-                    response = requests.get(url, headers=headers, json=payload, timeout=10)
+                    response = limited_call('typeb_quote', requests.get, url, headers=headers, json=payload, timeout=10)
                     
                     if response.status_code == 200:
                         data = response.json()
                         price = self._extract_price_typeb(data, clean_symbol)
                         
                         if price is not None:
-                            print(f"💰 Current price for {symbol}: ₹{price}")
+                            logger.debug("Current price", extra={'symbol': symbol, 'price': price})
                             return price
                     else:
-                        print(f"❌ Type B API failed for {symbol_format}: {response.status_code}")
+                        logger.debug("Type B API failed", extra={'symbol_format': symbol_format, 'status_code': response.status_code})
                         
                 except Exception as e:
-                    print(f"❌ Error with Type B API for {symbol_format}: {str(e)}")
+                    logger.debug("Error with Type B API for %s: %s", symbol_format, e)
                     continue
             
             # Fallback to Type A API if Type B fails
-            print("🔄 Falling back to Type A API for current price...")
+            logger.debug("Falling back to Type A API for current price", extra={'symbol': symbol})
             return self._get_current_price_typea(symbol)
             
         except Exception as e:
-            print(f"❌ Get current price error: {str(e)}")
+            logger.error("Get current price error: %s", e, extra={'symbol': symbol})
             return None
 
     def _extract_price_typeb(self, data: Dict, clean_symbol: str) -> Optional[float]:
@@ -245,14 +305,14 @@ class DMACalculator:
                     if item.get('exchange') == 'NSE' and item.get('tradingSymbol', '').startswith(clean_symbol):
                         price = float(item.get('ltp', 0))
                         if price > 0:
-                            print(f"💰 Found Type B price for {clean_symbol}: {price}")
+                            logger.debug("Found Type B price", extra={'symbol': clean_symbol, 'price': price})
                             return price
             
-            print(f"❌ No valid Type B price found in response")
+            logger.debug("No valid Type B price found in response")
             return None
             
         except Exception as e:
-            print(f"❌ Type B price extraction error: {str(e)}")
+            logger.warning("Type B price extraction error: %s", e)
             return None
 
     def _get_current_price_typea(self, symbol: str) -> Optional[float]:
@@ -280,7 +340,7 @@ class DMACalculator:
             
             for symbol_format in symbol_formats:
                 try:
-                    print(f"🔍 Trying Type A API for current price: {symbol_format}")
+                    logger.debug("Trying Type A API for current price", extra={'symbol_format': symbol_format})
                     
                     # Try current price endpoint
                     url = f"{self.base_url}/instruments/ltp"
@@ -288,37 +348,36 @@ class DMACalculator:
                         'symbols': [symbol_format]
                     }
                     
-                    response = requests.post(url, headers=headers, json=payload, timeout=10)
+                    response = limited_call('typea_instruments_ltp', requests.post, url, headers=headers, json=payload, timeout=10)
                     
                     if response.status_code == 200:
                         data = response.json()
-                        print(f"✅ Success getting current price for {symbol_format}")
                         
                         if data.get('status') == 'success' and data.get('data'):
                             for item in data['data']:
                                 if item.get('symbol') == symbol_format and item.get('ltp'):
                                     price = float(item['ltp'])
-                                    print(f"💰 Current price for {symbol}: ₹{price}")
+                                    logger.debug("Current price", extra={'symbol': symbol, 'price': price})
                                     return price
                     
-                    print(f"⚠️ Format {symbol_format} failed for current price: {response.status_code}")
+                    logger.debug("Type A format failed for current price", extra={'symbol_format': symbol_format, 'status_code': response.status_code})
                     
                 except Exception as e:
-                    print(f"❌ Error with format {symbol_format} for current price: {str(e)}")
+                    logger.debug("Error with format %s for current price: %s", symbol_format, e)
                     continue
             
-            print(f"❌ Could not get current price for {symbol}")
+            logger.warning("Could not get current price", extra={'symbol': symbol})
             return None
             
         except Exception as e:
-            print(f"❌ Get current price Type A error: {str(e)}")
+            logger.error("Get current price Type A error: %s", e, extra={'symbol': symbol})
             return None
 
     def calculate_dma20(self, historical_data: List) -> Optional[float]:
         """Calculate 20-day moving average from historical data"""
         try:
-            if not historical_data or len(historical_data) < 20:
-                print(f"❌ Insufficient data for DMA calculation. Need at least 20 days, got {len(historical_data)}")
+            if not historical_data or len(historical_data) < DMA_WINDOW:
+                logger.debug("Insufficient data for DMA calculation", extra={'data_points': len(historical_data or [])})
                 return None
             
             # Extract closing prices
@@ -326,7 +385,7 @@ class DMACalculator:
             for item in historical_data:
                 if isinstance(item, dict):
                     # Try different price field names
-                    for price_field in ['close', 'last_price', 'ltp', 'price']:
+                    for price_field in PRICE_FIELDS:
                         if price_field in item and item[price_field]:
                             try:
                                 price = float(item[price_field])
@@ -336,134 +395,150 @@ class DMACalculator:
                             except (ValueError, TypeError):
                                 continue
             
-            if len(prices) < 20:
-                print(f"❌ Insufficient valid prices for DMA calculation. Need at least 20, got {len(prices)}")
+            if len(prices) < DMA_WINDOW:
+                logger.debug("Insufficient valid prices for DMA calculation", extra={'data_points': len(prices)})
                 return None
             
             # Calculate 20-day moving average
-            dma20 = sum(prices[-20:]) / 20
-            print(f"💰 Calculated DMA20: {dma20:.2f} from {len(prices)} price points")
+            dma20 = sum(prices[-DMA_WINDOW:]) / DMA_WINDOW
+            logger.debug("Calculated DMA20", extra={'dma20': round(dma20, 2), 'data_points': len(prices)})
             return dma20
             
         except Exception as e:
-            print(f"❌ DMA calculation error: {str(e)}")
+            logger.warning("DMA calculation error: %s", e)
             return None
 
-    def calculate_fallback_dma20(self, symbol: str, current_price: float) -> Optional[float]:
-        """Calculate fallback DMA20 based on current price and market trends"""
-        try:
-            print(f"📊 Calculating fallback DMA20 for {symbol} with current price ₹{current_price}")
-            
-            # Use a deterministic approach based on symbol hash to ensure consistency
-            # This ensures the same symbol always gets the same DMA20 for the same current price
-            import hashlib
-            
-            # Create a consistent hash from symbol name
-            symbol_hash = hashlib.md5(symbol.encode()).hexdigest()
-            hash_value = int(symbol_hash[:8], 16)  # Use first 8 characters of hash
-            
-            # Use hash to determine variation direction and magnitude
-            # This ensures same symbol always gets same variation
-            variation_percent = (hash_value % 600 - 300) / 10000  # ±3% variation
-            
-            # Add small market trend component (ETF-specific)
-            if 'NIFTY' in symbol.upper():
-                trend_component = 0.005  # NIFTY ETFs slightly bullish
-            elif 'BANK' in symbol.upper():
-                trend_component = 0.003  # Bank ETFs slightly bullish
-            elif 'GOLD' in symbol.upper() or 'SILVER' in symbol.upper():
-                trend_component = 0.002  # Commodity ETFs stable
-            else:
-                trend_component = 0.001  # Other ETFs slight positive trend
-            
-            # Calculate total variation
-            total_variation = variation_percent + trend_component
-            
-            # Calculate DMA20
-            dma20 = current_price * (1 + total_variation)
-            
-            # Ensure DMA20 is reasonable (not negative or too far from current price)
-            max_variation = 0.15  # Maximum 15% variation
-            if dma20 <= 0 or abs(dma20 - current_price) / current_price > max_variation:
-                # If calculated DMA20 is unreasonable, use a simple 2% variation
-                dma20 = current_price * 1.02
-            
-            print(f"✅ Fallback DMA20 for {symbol}: ₹{dma20:.2f} (current: ₹{current_price:.2f}, variation: {total_variation*100:.1f}%)")
-            return dma20
-            
-        except Exception as e:
-            print(f"❌ Fallback DMA20 calculation error: {str(e)}")
-            return None
+    def dma20_from_history(self, symbol: str, history: Optional[Dict] = None) -> Optional[Dict]:
+        """
+        DMA20 from daily history, cached for the day: {'dma20', 'format_used', 'data_points'} or None.
+        Passing `history` (a get_historical_data result) computes and caches it without a fetch.
+        """
+        clean_symbol = symbol.replace('NSE:', '').replace('BSE:', '').strip()
+        today = date.today()
+        if history is None:
+            with self._lock:
+                cached = self._dma_cache.get(clean_symbol)
+                failed_at = self._history_failures.get(clean_symbol)
+            if cached and cached[0] == today:
+                return cached[1]
+            if failed_at is not None and time.monotonic() - failed_at < HISTORY_RETRY_SECONDS:
+                # The format probe failed recently; don't repeat it on every request
+                CACHE_REQUESTS.inc(cache='history_failure', result='hit')
+                return None
+            history = self.get_historical_data(symbol, days=30)
+            if history.get('status') == 'success' and self.history_store is not None:
+                try:
+                    # Known-good closes back the stale estimate if history fails later
+                    self.history_store.add_bars(clean_symbol, history['data'])
+                except Exception as e:
+                    logger.warning("Could not store history bars: %s", e, extra={'symbol': symbol})
+        dma20 = self.calculate_dma20(history['data']) if history.get('status') == 'success' else None
+        with self._lock:
+            if dma20 is None:
+                self._history_failures[clean_symbol] = time.monotonic()
+                return None
+            result = {'dma20': dma20, 'format_used': history.get('format_used'), 'data_points': len(history['data'])}
+            self._dma_cache[clean_symbol] = (today, result)
+            self._history_failures.pop(clean_symbol, None)
+        return result
+
+    def estimate_dma20(self, symbol: str, current_price: Optional[float] = None) -> Optional[Dict]:
+        """
+        Stale DMA20 for when live history is unavailable: the stored daily closes rolled forward
+        with today's price (today's close so far), else the last DMA20 computed from history.
+        None when neither exists; nothing is made up.
+        """
+        clean_symbol = symbol.replace('NSE:', '').replace('BSE:', '').strip()
+        today = date.today()
+        if self.history_store is not None:
+            try:
+                dates, _, closes = self.history_store.closes(
+                    [clean_symbol], (today - timedelta(days=ESTIMATE_LOOKBACK_DAYS)).isoformat(), today.isoformat())
+                stored = [(str(day), float(close)) for day, close in zip(dates, closes[:, 0])
+                          if close == close and str(day) < today.isoformat()]  # close == close skips NaN
+                window = [close for _, close in stored][-(DMA_WINDOW - 1 if current_price else DMA_WINDOW):]
+                if current_price:
+                    window.append(float(current_price))
+                if len(window) == DMA_WINDOW:
+                    return {'dma20': sum(window) / DMA_WINDOW, 'method': 'history_store_estimate',
+                            'as_of': stored[-1][0], 'data_points': len(stored), 'stale': True}
+            except Exception as e:
+                logger.warning("History store estimate failed: %s", e, extra={'symbol': symbol})
+        
+        with self._lock:
+            known = self._dma_cache.get(clean_symbol)
+        if known:
+            return {'dma20': known[1]['dma20'], 'method': 'last_known_dma', 'as_of': known[0].isoformat(),
+                    'data_points': known[1]['data_points'], 'stale': True}
+        return None
     
     def get_dma20_for_symbol(self, symbol: str) -> Dict:
         """Get DMA20 for a specific symbol"""
+        with span('dma.get_dma20', symbol=symbol):
+            result = self._compute_dma20_for_symbol(symbol)
+        DMA_METHOD.inc(method=result.get('method', 'error'))
+        return result
+    
+    def _compute_dma20_for_symbol(self, symbol: str) -> Dict:
         try:
-            print(f"\n📈 Calculating DMA20 for: {symbol}")
+            logger.debug("Calculating DMA20", extra={'symbol': symbol})
             
-            # Use the price fetcher's method to get current price
-            from price_fetcher import MStocksPriceFetcher
-            price_fetcher = MStocksPriceFetcher()
-            price_fetcher.access_token = self.access_token
-            price_fetcher.api_key = self.api_key
-            
-            # Get current price using the working price fetcher method
-            price_result = price_fetcher.get_live_price(symbol)
+            # DMA20 from history first (cached for the day), no live price needed
+            with span('dma.history'):
+                historical = self.dma20_from_history(symbol)
             
-            if price_result.get('status') != 'success':
+            if historical is not None:
                 return {
-                    'status': 'error',
+                    'status': 'success',
                     'symbol': symbol,
-                    'message': f'Could not get current price: {price_result.get("message", "Unknown error")}'
+                    'dma20': round(historical['dma20'], 2),  # Round to 2 decimal places
+                    'format_used': historical['format_used'],
+                    'data_points': historical['data_points'],
+                    'method': 'historical_data'
                 }
             
-            current_price = price_result.get('price')
-            if not current_price:
-                return {
-                    'status': 'error',
-                    'symbol': symbol,
-                    'message': 'No price data received from price fetcher'
-                }
+            # Use the price fetcher's method to get current price
+            price_fetcher = self.price_fetcher
+            if price_fetcher is None:
+                from price_fetcher import MStocksPriceFetcher
+                price_fetcher = MStocksPriceFetcher()
+                price_fetcher.access_token = self.access_token
+                price_fetcher.api_key = self.api_key
             
-            print(f"💰 Current price for {symbol}: ₹{current_price}")
+            # Get current price using the working price fetcher method
+            with span('dma.live_price'):
+                price_result = price_fetcher.get_live_price(symbol)
             
-            # Try to get historical data first
-            historical_result = self.get_historical_data(symbol, days=30)
+            # Today's price rolls the stored closes forward; without it the estimate uses stored closes only
+            current_price = price_result.get('price') if price_result.get('status') == 'success' else None
             
-            if historical_result.get('status') == 'success':
-                # Calculate DMA20 from historical data
-                dma20 = self.calculate_dma20(historical_result['data'])
-                
-                if dma20 is not None:
-                    return {
-                        'status': 'success',
-                        'symbol': symbol,
-                        'dma20': round(dma20, 2),  # Round to 2 decimal places
-                        'format_used': historical_result['format_used'],
-                        'data_points': len(historical_result['data']),
-                        'method': 'historical_data'
-                    }
-            
-            # Fallback: Calculate DMA20 based on current price and market trends
-            print(f"📊 Using fallback DMA20 calculation for {symbol}")
-            dma20 = self.calculate_fallback_dma20(symbol, current_price)
+            # History unavailable: estimate from known-good local data, flagged stale
+            logger.debug("Using stale DMA20 estimate", extra={'symbol': symbol})
+            with span('dma.estimate'):
+                estimate = self.estimate_dma20(symbol, current_price)
             
-            if dma20 is not None:
-                return {
-                    'status': 'success',
-                    'symbol': symbol,
-                    'dma20': round(dma20, 2),  # Round to 2 decimal places
-                    'method': 'fallback_calculation',
-                    'current_price': round(current_price, 2)  # Also round current price
-                }
-            else:
+            if estimate is None:
                 return {
                     'status': 'error',
                     'symbol': symbol,
-                    'message': 'Failed to calculate DMA20 using fallback method'
+                    'message': 'Historical data unavailable and no stored closes to estimate DMA20 from'
                 }
             
+            result = {
+                'status': 'success',
+                'symbol': symbol,
+                'dma20': round(estimate['dma20'], 2),  # Round to 2 decimal places
+                'method': estimate['method'],
+                'stale': True,
+                'as_of': estimate['as_of'],
+                'data_points': estimate['data_points']
+            }
+            if current_price:
+                result['current_price'] = round(current_price, 2)
+            return result
+            
         except Exception as e:
-            print(f"❌ Error getting DMA20 for {symbol}: {str(e)}")
+            logger.error("Error getting DMA20 for %s: %s", symbol, e)
             return {
                 'status': 'error',
                 'symbol': symbol,
@@ -471,16 +546,12 @@ class DMACalculator:
             }
     
     def get_dma20_for_multiple_symbols(self, symbols: List[str]) -> Dict:
-        """Get DMA20 for multiple symbols"""
+        """Get DMA20 for multiple symbols (pacing is handled by the shared rate limiter)"""
         results = {}
         
         for symbol in symbols:
-            print(f"\n{'='*50}")
             result = self.get_dma20_for_symbol(symbol)
             results[symbol] = result
-            
-            # Small delay between requests
-            time.sleep(1)
         
         return results
 
@@ -488,7 +559,7 @@ def main():
     """Example usage"""
     calculator = DMACalculator()
     
-    print("=== 20-Day Moving Average Calculator ===\n")
+    logger.info("20-day moving average calculator")
     
     # Step 1: Login
     username = input("Enter username: ")
@@ -496,7 +567,7 @@ def main():
     
     login_result = calculator.login(username, password)
     if login_result.get('status') != 'success':
-        print("❌ Login failed")
+        logger.error("Login failed: %s", login_result.get('message', 'Unknown error'))
         return
     
     # Step 2: Generate session
@@ -504,27 +575,26 @@ def main():
     request_token = login_result.get('data', {}).get('request_token')
     
     if not request_token:
-        print("❌ No request token received")
+        logger.error("No request token received")
         return
     
     session_result = calculator.generate_session(api_key, request_token)
     if session_result.get('status') != 'success':
-        print("❌ Session generation failed")
+        logger.error("Session generation failed: %s", session_result.get('message', 'Unknown error'))
         return
     
     # Step 3: Calculate DMA20 for test symbols
-    print("\n=== Calculating DMA20 for ETFs ===")
+    logger.info("Calculating DMA20 for ETFs")
     
     test_symbols = ['NSE:CPSEETF', 'NSE:NIFTYBEES', 'NSE:ITBEES']
     
     results = calculator.get_dma20_for_multiple_symbols(test_symbols)
     
-    print("\n=== Results ===")
     for symbol, result in results.items():
         if result.get('status') == 'success':
-            print(f"✅ {symbol}: DMA20 = ₹{result['dma20']:.2f}")
+            logger.info("DMA20", extra={'symbol': symbol, 'dma20': result['dma20'], 'method': result.get('method')})
         else:
-            print(f"❌ {symbol}: {result.get('message', 'Unknown error')}")
+            logger.error("DMA20 failed: %s", result.get('message', 'Unknown error'), extra={'symbol': symbol})
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,109 @@
+from datetime import date, timedelta
+
+import pytest
+
+import dma_calculator
+from dma_calculator import DMA_WINDOW, DMACalculator
+from history_store import HistoryStore
+
+
+def trading_days(count, before=None):
+    """The `count` weekdays before `before` (default today), oldest first"""
+    day, days = (before or date.today()) - timedelta(days=1), []
+    while len(days) < count:
+        if day.weekday() < 5:
+            days.append(day)
+        day -= timedelta(days=1)
+    return days[::-1]
+
+
+def bars(count, start=100.0):
+    return [{'date': day.isoformat(), 'close': start + index} for index, day in enumerate(trading_days(count))]
+
+
+class FakeFetcher:
+    def __init__(self, price=None):
+        self.price = price
+
+    def get_live_price(self, symbol):
+        if self.price:
+            return {'status': 'success', 'price': self.price}
+        return {'status': 'error', 'message': 'No price'}
+
+
+@pytest.fixture
+def history(tmp_path):
+    return HistoryStore(str(tmp_path / 'history.db'))
+
+
+def calculator(history, responses, price=None):
+    """DMACalculator whose history fetches answer from `responses` (the last one repeats)"""
+    calc = DMACalculator(price_fetcher=FakeFetcher(price), history_store=history)
+    calc.history_calls = 0
+
+    def get_historical_data(symbol, days=30):
+        calc.history_calls += 1
+        return responses[min(calc.history_calls, len(responses)) - 1]
+
+    calc.get_historical_data = get_historical_data
+    return calc
+
+
+FAILED = {'status': 'error', 'message': 'No historical data in any format'}
+
+
+def test_nineteen_closes_and_the_live_price_give_a_stale_estimate(history):
+    stored = bars(DMA_WINDOW - 1)
+    history.add_bars('NIFTYBEES', stored + [{'date': date.today().isoformat(), 'close': 999.0}])
+    estimate = calculator(history, [FAILED]).estimate_dma20('NSE:NIFTYBEES', 150.0)
+    closes = [bar['close'] for bar in stored] + [150.0]  # today's stored bar is replaced by the live price
+    assert estimate['dma20'] == pytest.approx(sum(closes) / DMA_WINDOW)
+    assert (estimate['method'], estimate['stale'], estimate['as_of']) == (
+        'history_store_estimate', True, stored[-1]['date'])
+
+
+def test_without_a_live_price_twenty_stored_closes_are_needed(history):
+    history.add_bars('NIFTYBEES', bars(DMA_WINDOW - 1))
+    assert calculator(history, [FAILED]).estimate_dma20('NIFTYBEES') is None
+    history.add_bars('NIFTYBEES', bars(DMA_WINDOW))
+    assert calculator(history, [FAILED]).estimate_dma20('NIFTYBEES')['method'] == 'history_store_estimate'
+
+
+def test_too_few_closes_fall_back_to_the_last_known_dma(history):
+    history.add_bars('NIFTYBEES', bars(10))
+    calc = calculator(history, [FAILED])
+    # Computed from a history result handed in, so nothing more is stored
+    known = calc.dma20_from_history('NIFTYBEES', history={'status': 'success', 'data': bars(DMA_WINDOW, 50.0)})
+    estimate = calc.estimate_dma20('NIFTYBEES', 60.0)
+    assert (estimate['method'], estimate['dma20'], estimate['stale']) == ('last_known_dma', known['dma20'], True)
+    assert estimate['as_of'] == date.today().isoformat()
+    assert calc.estimate_dma20('GOLDBEES', 60.0) is None
+
+
+def test_failed_history_probe_is_not_repeated_within_the_retry_window(history, monkeypatch):
+    calc = calculator(history, [FAILED, {'status': 'success', 'data': bars(DMA_WINDOW)}])
+    assert calc.dma20_from_history('NIFTYBEES') is None
+    assert calc.dma20_from_history('NIFTYBEES') is None
+    assert calc.history_calls == 1
+
+    monkeypatch.setattr(dma_calculator, 'HISTORY_RETRY_SECONDS', 0)
+    assert calc.dma20_from_history('NIFTYBEES')['dma20'] == pytest.approx(sum(range(100, 120)) / DMA_WINDOW)
+    assert calc.history_calls == 2
+    assert 'NIFTYBEES' not in calc._history_failures
+    assert calc.dma20_from_history('NIFTYBEES') is not None
+    assert calc.history_calls == 2  # cached for the day
+
+
+def test_fetched_history_is_stored_for_later_estimates(history):
+    calculator(history, [{'status': 'success', 'data': bars(DMA_WINDOW)}]).dma20_from_history('NIFTYBEES')
+    assert len(history.closes(['NIFTYBEES'])[0]) == DMA_WINDOW
+
+
+def test_get_dma20_flags_the_estimate_stale(history):
+    history.add_bars('NIFTYBEES', bars(DMA_WINDOW - 1))
+    result = calculator(history, [FAILED], price=150.0).get_dma20_for_symbol('NIFTYBEES')
+    assert (result['status'], result['method'], result['stale'], result['current_price']) == (
+        'success', 'history_store_estimate', True, 150.0)
+
+    result = calculator(history, [FAILED]).get_dma20_for_symbol('GOLDBEES')
+    assert result['status'] == 'error'
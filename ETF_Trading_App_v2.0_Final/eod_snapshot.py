@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+End-of-day Snapshot
+After the close: fetch closing OHLC for the whole ETF universe in one batched quote request,
+add the day's bars to the history store, compute the indicator set, ranking and portfolio
+valuation once and write them as one versioned daily snapshot. The snapshot is a numpy
+structured array (.npy, one record per ETF in ranking order) with a JSON metadata file next
+to it, so the next day's API process maps it read-only at start-up and serves reads from it
+"""
+
+import argparse
+import json
+import os
+import time
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from backtester import TRADING_DAYS
+from dma_calculator import DMA_WINDOW, dma_matrix
+from etf_ranking import clean_symbol, rank_order
+from structured_logging import get_logger
+from warmup import IST, MARKET_CLOSE, is_trading_day
+
+logger = get_logger('eod_snapshot')
+
+SNAPSHOT_DIR = os.environ.get('ETF_SNAPSHOT_DIR', 'snapshots')
+SNAPSHOT_VERSION = 1
+SNAPSHOT_KEEP = 30  # daily snapshots kept on disk
+LOOKBACK_DAYS = 400  # calendar days of history read for the indicators (covers 52 weeks)
+SLOW_DMA_WINDOW = 50
+QUOTE_TIME_FIELDS = ('last_trade_time', 'exchange_timestamp', 'timestamp', 'last_update_time')
+
+SNAPSHOT_DTYPE = np.dtype([
+    ('symbol', 'U32'), ('date', 'M8[D]'),
+    ('open', 'f8'), ('high', 'f8'), ('low', 'f8'), ('close', 'f8'), ('change_pct', 'f8'),
+    ('dma20', 'f8'), ('dma50', 'f8'), ('percent_diff', 'f8'), ('high_52w', 'f8'), ('low_52w', 'f8'),
+    ('rank', 'i4'), ('is_holding', '?'),
+    ('qty', 'f8'), ('invested', 'f8'), ('value', 'f8'), ('notional_pl', 'f8'),
+    ('lifo_target_price', 'f8'), ('lifo_sell_ready', '?'),
+])
+
+
+def snapshot_path(day: date, directory: str = SNAPSHOT_DIR) -> str:
+    return os.path.join(directory, f'etf_snapshot_{day.isoformat()}.npy')
+
+
+def _atomic_write(path: str, write):
+    temporary = f'{path}.tmp'
+    with open(temporary, 'wb') as target:
+        write(target)
+    os.replace(temporary, path)
+
+
+def quote_day(quote: Dict) -> Optional[date]:
+    """IST day of a quote's last trade, when the quote carries a readable timestamp"""
+    for field in QUOTE_TIME_FIELDS:
+        value = quote.get(field)
+        if value in (None, ''):
+            continue
+        try:
+            if isinstance(value, (int, float)):
+                return datetime.fromtimestamp(value / 1000 if value > 1e11 else value, IST).date()
+            return date.fromisoformat(str(value)[:10])
+        except (ValueError, OverflowError, OSError):
+            continue
+    return None
+
+
+def indicators(closes: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Latest indicator values per column of a (days x symbols) close matrix, taken at each
+    symbol's last bar: close, 1-day change, DMA20, DMA50, % from DMA20 and the 52-week range
+    """
+    closes = np.asarray(closes, dtype=np.float64)
+    days, count = closes.shape
+    columns = np.arange(count)
+    valid = ~np.isnan(closes)
+    last = days - 1 - np.argmax(valid[::-1], axis=0)  # row of each column's last bar
+    has_bar = valid.any(axis=0)
+    # Previous bar: the last valid row before `last`
+    earlier = valid & (np.arange(days)[:, None] < last)
+    previous = np.where(earlier.any(axis=0), days - 1 - np.argmax(earlier[::-1], axis=0), last)
+
+    def at(matrix, rows):
+        return np.where(has_bar, matrix[rows, columns], np.nan)
+
+    close = at(closes, last)
+    prior = np.where(previous < last, at(closes, previous), np.nan)
+    dma20 = at(dma_matrix(closes, DMA_WINDOW), last)
+    year = closes[max(days - TRADING_DAYS, 0):]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return {
+            'last_row': last,
+            'close': close,
+            'change_pct': (close - prior) / prior * 100,
+            'dma20': dma20,
+            'dma50': at(dma_matrix(closes, SLOW_DMA_WINDOW), last),
+            'percent_diff': (close - dma20) / dma20 * 100,
+            'high_52w': np.fmax.reduce(year, axis=0) if len(year) else np.full(count, np.nan),
+            'low_52w': np.fmin.reduce(year, axis=0) if len(year) else np.full(count, np.nan),
+        }
+
+
+class Snapshot:
+    """One daily snapshot, mapped read-only; records are read from the file on access"""
+
+    def __init__(self, path: str):
+        with open(path[:-len('.npy')] + '.json') as source:
+            self.meta = json.load(source)
+        if self.meta.get('version') != SNAPSHOT_VERSION:
+            raise ValueError(f"Snapshot version {self.meta.get('version')} is not {SNAPSHOT_VERSION}: {path}")
+        self.path = path
+        self.rows = np.load(path, mmap_mode='r')
+        self._index = {str(symbol): position for position, symbol in enumerate(self.rows['symbol'])}
+
+    def __len__(self):
+        return len(self.rows)
+
+    @classmethod
+    def latest(cls, directory: str = SNAPSHOT_DIR) -> Optional['Snapshot']:
+        """Newest readable snapshot in `directory`, or None"""
+        if not os.path.isdir(directory):
+            return None
+        names = sorted((name for name in os.listdir(directory)
+                        if name.startswith('etf_snapshot_') and name.endswith('.npy')), reverse=True)
+        for name in names:
+            try:
+                return cls(os.path.join(directory, name))
+            except (OSError, ValueError) as e:
+                logger.warning("Skipping snapshot %s: %s", name, e)
+        return None
+
+    @staticmethod
+    def _record(row) -> Dict:
+        item = {}
+        for name in SNAPSHOT_DTYPE.names:
+            value = row[name]
+            if name == 'date':
+                item[name] = None if np.isnat(value) else str(value)
+            elif name == 'symbol':
+                item[name] = str(value)
+            elif isinstance(value, np.bool_):
+                item[name] = bool(value)
+            elif isinstance(value, np.integer):
+                item[name] = int(value) or None  # rank 0 = unranked
+            else:
+                item[name] = None if np.isnan(value) else round(float(value), 4)
+        return item
+
+    def get(self, symbol: str) -> Optional[Dict]:
+        position = self._index.get(clean_symbol(symbol))
+        return None if position is None else self._record(self.rows[position])
+
+    def records(self, limit: Optional[int] = None) -> List[Dict]:
+        """Records in ranking order (unranked last)"""
+        return [self._record(row) for row in self.rows[:limit]]
+
+
+class EODPipeline:
+    def __init__(self, history, client_factory: Optional[Callable] = None, portfolio=None,
+                 directory: str = SNAPSHOT_DIR):
+        """client_factory: returns an MConnect for the batched OHLC quote (None = bars already in the store)"""
+        self.history = history
+        self.client_factory = client_factory
+        self.portfolio = portfolio
+        self.directory = directory
+        self.snapshot: Optional[Snapshot] = None
+
+    def load_latest(self) -> Optional[Snapshot]:
+        self.snapshot = Snapshot.latest(self.directory)
+        if self.snapshot is not None:
+            logger.info("Snapshot mapped", extra={'path': self.snapshot.path, 'etfs': len(self.snapshot)})
+        return self.snapshot
+
+    def universe(self) -> List[str]:
+        holdings = self.portfolio.symbols() if self.portfolio is not None and self.portfolio.ensure_loaded() else []
+        return list(dict.fromkeys(holdings + self.history.symbols()))
+
+    def fetch_bars(self, symbols: List[str], day: date) -> Dict:
+        """
+        Closing OHLC for every symbol in one batched quote request, stored as the day's bars.
+        A quote whose last trade was on another day is skipped: its price is an older close.
+        """
+        data = self.client_factory().get_ohlc([f"NSE:{symbol}" for symbol in symbols]).json().get('data') or {}
+        stored, not_traded = [], []
+        for key, quote in data.items():
+            if not isinstance(quote, dict) or not quote.get('last_price'):
+                continue
+            traded = quote_day(quote)
+            if traded is not None and traded != day:
+                not_traded.append(clean_symbol(key))
+                continue
+            ohlc = quote.get('ohlc') or {}
+            # After the close last_price is the day's close; ohlc.close is the previous close
+            bar = {'date': day.isoformat(), 'open': ohlc.get('open'), 'high': ohlc.get('high'),
+                   'low': ohlc.get('low'), 'close': quote['last_price'], 'volume': quote.get('volume')}
+            if self.history.add_bars(clean_symbol(key), [bar]):
+                stored.append(clean_symbol(key))
+        return {'fetched': len(stored), 'missing': sorted(set(symbols) - set(stored)), 'not_traded': sorted(not_traded)}
+
+    def run(self, symbols: Optional[List[str]] = None, day: Optional[date] = None, force: bool = False) -> Dict:
+        """
+        Fetch the day's bars, compute every figure once and write (and map) the day's snapshot.
+        Weekends and exchange holidays are skipped: there is no session to take closing bars from.
+        """
+        started = time.perf_counter()
+        now = datetime.now(IST)
+        day = day or now.date()
+        if not is_trading_day(day):
+            return {'status': 'skipped', 'message': f'{day.isoformat()} is not a trading day'}
+        if not force and day == now.date() and now < now.replace(hour=MARKET_CLOSE[0], minute=MARKET_CLOSE[1]):
+            return {'status': 'error', 'message': 'Market is still open; the day has no closing bars yet'}
+        symbols = list(dict.fromkeys(clean_symbol(symbol) for symbol in symbols or self.universe()))
+        if not symbols:
+            return {'status': 'error', 'message': 'No ETFs to snapshot'}
+
+        fetched = None
+        if self.client_factory is not None:
+            try:
+                fetched = self.fetch_bars(symbols, day)
+            except Exception as e:
+                logger.warning("EOD OHLC fetch failed, using stored bars: %s", e)
+                fetched = {'error': str(e)}
+
+        dates, _, closes = self.history.closes(symbols, (day - timedelta(days=LOOKBACK_DAYS)).isoformat(),
+                                               day.isoformat())
+        if not len(dates):
+            return {'status': 'error', 'message': 'No bars in the history store for these ETFs'}
+        figures = indicators(closes)
+        rows = np.zeros(len(symbols), dtype=SNAPSHOT_DTYPE)
+        for name in SNAPSHOT_DTYPE.names:
+            if SNAPSHOT_DTYPE[name] == np.float64:
+                rows[name] = np.nan
+        rows['symbol'] = symbols
+        rows['date'] = np.where(~np.isnan(figures['close']), dates[figures['last_row']], np.datetime64('NaT'))
+        for name in ('close', 'change_pct', 'dma20', 'dma50', 'percent_diff', 'high_52w', 'low_52w'):
+            rows[name] = figures[name]
+        self._add_bar_fields(rows, day)
+        summary = self._add_portfolio(rows)
+
+        order = rank_order(rows['percent_diff'], rows['is_holding'])
+        rows = rows[order]
+        ranked = ~np.isnan(rows['percent_diff'])
+        rows['rank'] = np.where(ranked, np.arange(1, len(rows) + 1), 0)
+
+        path = snapshot_path(day, self.directory)
+        meta = {
+            'version': SNAPSHOT_VERSION,
+            'date': day.isoformat(),
+            'created_at': datetime.now(IST).isoformat(),
+            'etfs': len(rows),
+            'ranked': int(ranked.sum()),
+            'portfolio': summary,
+        }
+        os.makedirs(self.directory, exist_ok=True)
+        _atomic_write(path, lambda target: np.save(target, rows))
+        _atomic_write(path[:-len('.npy')] + '.json',
+                      lambda target: target.write(json.dumps(meta, indent=2).encode('utf-8')))
+        self._prune()
+        self.snapshot = Snapshot(path)
+
+        duration_ms = round((time.perf_counter() - started) * 1000, 1)
+        logger.info("EOD snapshot written", extra={'path': path, 'etfs': len(rows), 'duration_ms': duration_ms})
+        return {'status': 'success', 'path': path, 'fetch': fetched, 'duration_ms': duration_ms, **meta}
+
+    def _add_bar_fields(self, rows: np.ndarray, day: date):
+        """Open/high/low of each ETF's bar for `day`"""
+        for position, symbol in enumerate(rows['symbol']):
+            if rows['date'][position] != np.datetime64(day):
+                continue
+            bar = self.history.bar(str(symbol), day.isoformat())
+            if bar:
+                for name in ('open', 'high', 'low'):
+                    rows[name][position] = np.nan if bar[name] is None else bar[name]
+
+    def _add_portfolio(self, rows: np.ndarray) -> Optional[Dict]:
+        """Value the holdings at the snapshot closes (the live valuation is not touched); returns the summary"""
+        if self.portfolio is None or not self.portfolio.ensure_loaded():
+            return None
+        valuation = self.portfolio.valuation_at({str(symbol): float(close) for symbol, close
+                                                 in zip(rows['symbol'], rows['close']) if not np.isnan(close)})
+        positions = {item['symbol']: item for item in valuation['positions']}
+        for position, symbol in enumerate(rows['symbol']):
+            held = positions.get(str(symbol))
+            if held is None:
+                continue
+            rows['is_holding'][position] = True
+            rows['qty'][position] = held['total_qty']
+            rows['invested'][position] = held['total_invested']
+            rows['value'][position] = held.get('current_value', np.nan)
+            rows['notional_pl'][position] = held.get('notional_pl', np.nan)
+            rows['lifo_target_price'][position] = held['lifo_target_price']
+            rows['lifo_sell_ready'][position] = held.get('lifo_sell_ready', False)
+        return valuation['summary']
+
+    def _prune(self):
+        names = sorted(name for name in os.listdir(self.directory)
+                       if name.startswith('etf_snapshot_') and name.endswith('.npy'))
+        for name in names[:-SNAPSHOT_KEEP]:
+            for path in (name, name[:-len('.npy')] + '.json'):
+                try:
+                    os.remove(os.path.join(self.directory, path))
+                except OSError:
+                    pass
+
+
+def main():
+    from history_store import HistoryStore, HISTORY_DB
+    from portfolio_valuation import PortfolioValuation, HOLDINGS_PATH
+
+    parser = argparse.ArgumentParser(description='Build the end-of-day ETF snapshot')
+    parser.add_argument('--db', default=HISTORY_DB)
+    parser.add_argument('--holdings', default=HOLDINGS_PATH)
+    parser.add_argument('--symbols', help='comma separated, default holdings plus every symbol in the store')
+    parser.add_argument('--date', help='trading day (YYYY-MM-DD), default today')
+    parser.add_argument('--output', default=SNAPSHOT_DIR)
+    parser.add_argument('--no-fetch', action='store_true', help='use the bars already in the store')
+    parser.add_argument('--force', action='store_true', help='snapshot today even before the close')
+    args = parser.parse_args()
+
+    client_factory = None
+    if not args.no_fetch:
+        from price_fetcher import MStocksPriceFetcher
+        from tradingapi_a.mconnect import MConnect
+        fetcher = MStocksPriceFetcher()
+        if not fetcher.access_token:
+            parser.error('No saved session; log in through the API server first or use --no-fetch')
+        client_factory = lambda: MConnect(api_key=fetcher.api_key, access_Token=fetcher.access_token, debug=False)
+
+    pipeline = EODPipeline(HistoryStore(args.db), client_factory, PortfolioValuation(args.holdings), args.output)
+    result = pipeline.run(args.symbols.split(',') if args.symbols else None,
+                          date.fromisoformat(args.date) if args.date else None, force=args.force)
+    for name, value in result.items():
+        print(f"{name}: {value}")
+
+
+if __name__ == "__main__":
+    main()
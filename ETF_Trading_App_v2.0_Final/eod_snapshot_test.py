@@ -0,0 +1,116 @@
+import os
+from datetime import date, timedelta
+
+import pytest
+
+import warmup
+from eod_snapshot import EODPipeline, Snapshot, quote_day
+from history_store import HistoryStore
+from lifo_ledger import Ledger, LotBook
+from portfolio_valuation import PortfolioValuation
+
+FRIDAY = date(2024, 1, 5)
+SATURDAY = date(2024, 1, 6)
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return {'status': 'success', 'data': self.data}
+
+
+class FakeClient:
+    """MConnect stand-in answering get_ohlc with fixed quotes"""
+
+    def __init__(self, quotes):
+        self.quotes = quotes
+        self.calls = 0
+
+    def get_ohlc(self, instruments):
+        self.calls += 1
+        return FakeResponse({key: self.quotes[key] for key in instruments if key in self.quotes})
+
+
+def quote(price, traded=None):
+    item = {'last_price': price, 'ohlc': {'open': price - 1, 'high': price + 1, 'low': price - 2, 'close': price - 0.5}}
+    if traded:
+        item['last_trade_time'] = f'{traded.isoformat()} 15:29:59'
+    return item
+
+
+@pytest.fixture
+def history(tmp_path):
+    store = HistoryStore(str(tmp_path / 'history.db'))
+    # 30 trading days of bars up to the Thursday before FRIDAY
+    day, bars = FRIDAY - timedelta(days=1), []
+    while len(bars) < 30:
+        if day.weekday() < 5:
+            bars.append({'date': day.isoformat(), 'close': 100.0 + len(bars)})
+        day -= timedelta(days=1)
+    store.add_bars('NIFTYBEES', bars)
+    return store
+
+
+@pytest.fixture
+def portfolio():
+    portfolio = PortfolioValuation(target=0.06)
+    portfolio.load(Ledger(LotBook(['NIFTYBEES'], [''], ['2024-01-02'], [100.0], [10]), target=0.06))
+    return portfolio
+
+
+def pipeline(history, tmp_path, client=None, portfolio=None):
+    return EODPipeline(history, client_factory=(lambda: client) if client else None, portfolio=portfolio,
+                       directory=str(tmp_path / 'snapshots'))
+
+
+def test_weekend_is_skipped_without_fetching_or_writing(history, tmp_path):
+    client = FakeClient({'NSE:NIFTYBEES': quote(140.0)})
+    result = pipeline(history, tmp_path, client).run(['NIFTYBEES'], SATURDAY, force=True)
+    assert result['status'] == 'skipped'
+    assert client.calls == 0
+    assert history.bar('NIFTYBEES', SATURDAY.isoformat()) is None
+    assert not os.path.exists(tmp_path / 'snapshots')
+
+
+def test_exchange_holiday_is_skipped(history, tmp_path, monkeypatch):
+    monkeypatch.setattr(warmup, 'MARKET_HOLIDAYS', {FRIDAY.isoformat()})
+    client = FakeClient({'NSE:NIFTYBEES': quote(140.0)})
+    result = pipeline(history, tmp_path, client).run(['NIFTYBEES'], FRIDAY)
+    assert result['status'] == 'skipped'
+    assert client.calls == 0
+
+
+def test_trading_day_stores_the_bar_and_writes_a_snapshot(history, tmp_path):
+    client = FakeClient({'NSE:NIFTYBEES': quote(140.0, FRIDAY)})
+    result = pipeline(history, tmp_path, client).run(['NIFTYBEES'], FRIDAY)
+    assert result['status'] == 'success'
+    assert history.bar('NIFTYBEES', FRIDAY.isoformat())['close'] == 140.0
+    record = Snapshot(result['path']).get('NIFTYBEES')
+    assert record['date'] == FRIDAY.isoformat()
+    assert record['close'] == 140.0
+
+
+def test_quote_from_an_earlier_session_is_not_stored(history, tmp_path):
+    client = FakeClient({'NSE:NIFTYBEES': quote(129.0, FRIDAY - timedelta(days=1))})
+    result = pipeline(history, tmp_path, client).run(['NIFTYBEES'], FRIDAY)
+    assert result['fetch']['not_traded'] == ['NIFTYBEES']
+    assert history.bar('NIFTYBEES', FRIDAY.isoformat()) is None
+
+
+def test_snapshot_valuation_leaves_live_prices_alone(history, tmp_path, portfolio):
+    portfolio.on_price('NIFTYBEES', 150.0)
+    client = FakeClient({'NSE:NIFTYBEES': quote(140.0, FRIDAY)})
+    result = pipeline(history, tmp_path, client, portfolio).run(['NIFTYBEES'], FRIDAY)
+    assert result['portfolio']['current_value'] == 1400.0
+    assert Snapshot(result['path']).get('NIFTYBEES')['value'] == 1400.0
+    assert portfolio.position('NIFTYBEES')['cmp'] == 150.0
+    assert portfolio.summary()['current_value'] == 1500.0
+
+
+def test_quote_day():
+    assert quote_day({'last_trade_time': '2024-01-05 15:29:59'}) == FRIDAY
+    assert quote_day({'timestamp': 1704448799}) == FRIDAY  # 2024-01-05 15:29:59 IST
+    assert quote_day({'last_trade_time': 'not a time'}) is None
+    assert quote_day({}) is None
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+ETF Ranking
+Ranks the ETF universe by distance from its 20-day moving average in one pass:
+prices come from one batched LTP request, DMA20 from a per-day cache (history is only
+fetched for symbols not yet seen today), and the ranking itself is a single numpy sort.
+Between full rankings a sorted index follows the price ticks for top-K and rank lookups
+"""
+
+import bisect
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from metrics import CACHE_REQUESTS
+from structured_logging import get_logger
+
+logger = get_logger('etf_ranking')
+
+
+def clean_symbol(symbol: str) -> str:
+    return str(symbol).strip().replace('NSE:', '').replace('BSE:', '')
+
+
+def rank_order(percent_diff: np.ndarray, is_holding: np.ndarray) -> np.ndarray:
+    """Row order of a ranking: not held before held, most fallen first, unpriced (NaN) last"""
+    missing = np.isnan(percent_diff)
+    return np.lexsort((np.where(missing, np.inf, percent_diff), is_holding, missing))
+
+
+class DMACache:
+    """DMA20 per symbol, valid for the trading day it was computed on"""
+
+    def __init__(self, dma_calculator, max_workers: int = 8):
+        self.dma_calculator = dma_calculator
+        self.max_workers = max_workers
+        self._values: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def _compute(self, symbol: str) -> Optional[float]:
+        result = self.dma_calculator.dma20_from_history(symbol)
+        return result['dma20'] if result else None
+
+    def get_many(self, symbols: List[str]) -> Dict[str, Optional[float]]:
+        """DMA20 for every symbol (None where history is unavailable); misses are fetched concurrently"""
+        today = date.today()
+        with self._lock:
+            cached = {symbol: self._values[symbol][0] for symbol in symbols
+                      if symbol in self._values and self._values[symbol][1] == today}
+        missing = [symbol for symbol in symbols if symbol not in cached]
+        CACHE_REQUESTS.inc(len(cached), cache='dma20', result='hit')
+        CACHE_REQUESTS.inc(len(missing), cache='dma20', result='miss')
+        if missing:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                computed = dict(zip(missing, executor.map(self._compute, missing)))
+            with self._lock:
+                for symbol, value in computed.items():
+                    if value is not None:
+                        self._values[symbol] = (value, today)
+            cached.update(computed)
+        return cached
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class RankingIndex:
+    """
+    ETFs kept sorted by (held, % from DMA20) so price ticks re-position one entry
+    (binary search to find and re-insert it) and top-K / rank queries never re-sort.
+    Symbols without a DMA20 or price are tracked but not ranked.
+    """
+
+    def __init__(self):
+        self._keys: List[tuple] = []          # sorted (is_holding, percent_diff, symbol)
+        self._entries: Dict[str, Dict] = {}   # symbol -> cmp, dma20, is_holding, key
+        self._lock = threading.Lock()
+        self.updated_at = None
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _reposition(self, symbol: str, entry: Dict):
+        """Caller holds the lock"""
+        key = entry.get('key')
+        if key is not None:
+            del self._keys[bisect.bisect_left(self._keys, key)]
+            entry['key'] = None
+        if entry.get('cmp') and entry.get('dma20'):
+            entry['key'] = (entry['is_holding'], (entry['cmp'] - entry['dma20']) / entry['dma20'] * 100, symbol)
+            bisect.insort(self._keys, entry['key'])
+        self.updated_at = time.time()
+
+    def set(self, symbol: str, dma20: Optional[float] = None, cmp: Optional[float] = None,
+            is_holding: Optional[bool] = None):
+        """Add or update a symbol; arguments left as None keep their current value"""
+        symbol = clean_symbol(symbol)
+        with self._lock:
+            entry = self._entries.setdefault(symbol, {'cmp': None, 'dma20': None, 'is_holding': False, 'key': None})
+            for field, value in (('dma20', dma20), ('cmp', cmp), ('is_holding', is_holding)):
+                if value is not None:
+                    entry[field] = value
+            self._reposition(symbol, entry)
+
+    def on_price(self, symbol: str, price: float):
+        """Price listener: re-position a tracked symbol; unknown symbols are ignored"""
+        symbol = clean_symbol(symbol)
+        with self._lock:
+            entry = self._entries.get(symbol)
+            if entry is None or not price or entry['cmp'] == price:
+                return
+            entry['cmp'] = float(price)
+            self._reposition(symbol, entry)
+
+    def remove(self, symbol: str):
+        with self._lock:
+            entry = self._entries.pop(clean_symbol(symbol), None)
+            if entry and entry['key'] is not None:
+                del self._keys[bisect.bisect_left(self._keys, entry['key'])]
+
+    @staticmethod
+    def _item(rank: int, key: tuple, entry: Dict) -> Dict:
+        return {
+            'rank': rank,
+            'symbol': key[2],
+            'cmp': entry['cmp'],
+            'dma20': round(entry['dma20'], 2),
+            'percent_diff': round(key[1], 4),
+            'is_holding': key[0],
+        }
+
+    def top(self, k: int = 5, include_holdings: bool = False) -> List[Dict]:
+        """The k most fallen ETFs (not held, unless include_holdings)"""
+        with self._lock:
+            keys = self._keys if include_holdings else self._keys[:bisect.bisect_left(self._keys, (True,))]
+            return [self._item(rank, key, self._entries[key[2]]) for rank, key in enumerate(keys[:k], start=1)]
+
+    def rank_of(self, symbol: str) -> Optional[Dict]:
+        """Rank of one symbol in the full ordering, or None if it is not tracked"""
+        symbol = clean_symbol(symbol)
+        with self._lock:
+            entry = self._entries.get(symbol)
+            if entry is None:
+                return None
+            if entry['key'] is None:
+                return {'rank': None, 'symbol': symbol, 'cmp': entry['cmp'], 'dma20': entry['dma20'],
+                        'percent_diff': None, 'is_holding': entry['is_holding']}
+            item = self._item(bisect.bisect_left(self._keys, entry['key']) + 1, entry['key'], entry)
+            item['of'] = len(self._keys)
+            return item
+
+
+class RankingEngine:
+    def __init__(self, fetcher, dma_calculator, client_factory: Optional[Callable] = None, max_workers: int = 8):
+        """client_factory: returns an MConnect for batched LTP (None = per-symbol live prices)"""
+        self.fetcher = fetcher
+        self.dma_calculator = dma_calculator
+        self.client_factory = client_factory
+        self.max_workers = max_workers
+        self.dma = DMACache(dma_calculator, max_workers)
+        self.index = RankingIndex()  # kept current by price ticks between full rankings
+        self.last_symbols: List[str] = []  # universe of the latest ranking request
+
+    def prices(self, symbols: List[str]) -> Dict[str, Optional[float]]:
+        """LTP for every symbol: one batched quote request, per-symbol live prices for whatever it missed"""
+        prices = {}
+        if self.client_factory is not None:
+            try:
+                data = self.client_factory().get_ltp([f"NSE:{symbol}" for symbol in symbols]).json().get('data') or {}
+                for key, quote in data.items():
+                    price = quote.get('last_price') if isinstance(quote, dict) else None
+                    if price:
+                        prices[clean_symbol(key)] = float(price)
+            except Exception as e:
+                logger.warning("Batched LTP failed, using live prices: %s", e)
+        for symbol, price in prices.items():
+            self.fetcher.publish_price(symbol, price)
+
+        missing = [symbol for symbol in symbols if symbol not in prices]
+        if missing:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                results = executor.map(self.fetcher.get_live_price, missing)
+                for symbol, result in zip(missing, results):
+                    prices[symbol] = result.get('price') if result.get('status') == 'success' else None
+        return prices
+
+    def rank(self, symbols: List[str], holdings: Optional[List[str]] = None) -> Dict:
+        """
+        Rank symbols by (cmp - dma20) / dma20, most fallen first.
+        Held symbols sort after the rest, as on the ranking page; unpriced ones come last.
+        """
+        symbols = list(dict.fromkeys(clean_symbol(symbol) for symbol in symbols if str(symbol).strip()))
+        held = {clean_symbol(symbol) for symbol in holdings or []}
+        self.last_symbols = symbols
+        self.dma_calculator.access_token = self.fetcher.access_token
+        self.dma_calculator.api_key = self.fetcher.api_key
+
+        prices = self.prices(symbols)
+        dmas = self.dma.get_many(symbols)
+        stale = set()
+        for symbol in symbols:
+            if dmas.get(symbol) is None and prices.get(symbol):
+                # No history today: stored closes rolled forward with the live price, flagged stale
+                estimate = self.dma_calculator.estimate_dma20(symbol, prices[symbol])
+                if estimate is not None:
+                    dmas[symbol] = estimate['dma20']
+                    stale.add(symbol)
+        cmp = np.array([prices.get(symbol) or np.nan for symbol in symbols], dtype=np.float64)
+        dma20 = np.array([dmas.get(symbol) or np.nan for symbol in symbols], dtype=np.float64)
+        is_holding = np.array([symbol in held for symbol in symbols], dtype=bool)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            percent_diff = (cmp - dma20) / dma20 * 100
+        for position, symbol in enumerate(symbols):
+            self.index.set(symbol, dma20=dmas.get(symbol), cmp=prices.get(symbol),
+                           is_holding=bool(is_holding[position]))
+        missing = np.isnan(percent_diff)
+        order = rank_order(percent_diff, is_holding)
+
+        ranked = []
+        for rank, position in enumerate(order, start=1):
+            ranked.append({
+                'rank': rank,
+                'symbol': symbols[position],
+                'cmp': None if np.isnan(cmp[position]) else float(cmp[position]),
+                'dma20': None if np.isnan(dma20[position]) else round(float(dma20[position]), 2),
+                'percent_diff': None if missing[position] else round(float(percent_diff[position]), 4),
+                'is_holding': bool(is_holding[position]),
+                'dma_stale': symbols[position] in stale,
+            })
+        return {
+            'status': 'success',
+            'count': len(ranked),
+            'ranked': int((~missing).sum()),
+            'unranked': [symbols[position] for position in np.flatnonzero(missing)],
+            'results': ranked,
+        }
@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+
+from etf_ranking import RankingEngine, RankingIndex, rank_order
+
+
+class FakeFetcher:
+    """Live prices from a dict; published prices are recorded"""
+
+    def __init__(self, prices):
+        self.prices = prices
+        self.access_token = 'TOKEN'
+        self.api_key = 'KEY'
+        self.published = {}
+
+    def get_live_price(self, symbol):
+        if self.prices.get(symbol):
+            return {'status': 'success', 'price': self.prices[symbol]}
+        return {'status': 'error', 'message': 'No price'}
+
+    def publish_price(self, symbol, price):
+        self.published[symbol] = price
+
+
+class FakeDMA:
+    """DMA20 from a dict; `estimates` answer estimate_dma20 for symbols without history"""
+
+    def __init__(self, dmas, estimates=None):
+        self.dmas = dmas
+        self.estimates = estimates or {}
+        self.history_calls = []
+
+    def dma20_from_history(self, symbol):
+        self.history_calls.append(symbol)
+        return {'dma20': self.dmas[symbol]} if symbol in self.dmas else None
+
+    def estimate_dma20(self, symbol, live_price):
+        return {'dma20': self.estimates[symbol], 'stale': True} if symbol in self.estimates else None
+
+
+def test_rank_order_puts_unheld_first_and_nan_last():
+    percent = np.array([-1.0, np.nan, -5.0, 2.0, -3.0])
+    held = np.array([False, False, True, False, True])
+    assert list(rank_order(percent, held)) == [0, 3, 2, 4, 1]
+
+
+def test_rank_results():
+    fetcher = FakeFetcher({'A': 95.0, 'B': 110.0, 'C': 90.0, 'D': 100.0, 'E': None})
+    dma = FakeDMA({'A': 100.0, 'B': 100.0, 'C': 100.0, 'E': 100.0}, estimates={'D': 125.0})
+    result = RankingEngine(fetcher, dma).rank(['NSE:A', 'B', 'C', 'D', 'E', 'A'], holdings=['C'])
+    assert [item['symbol'] for item in result['results']] == ['D', 'A', 'B', 'C', 'E']
+    assert result['unranked'] == ['E']
+    assert (result['count'], result['ranked']) == (5, 4)
+    stale = {item['symbol']: item['dma_stale'] for item in result['results']}
+    assert stale == {'A': False, 'B': False, 'C': False, 'D': True, 'E': False}
+    assert result['results'][1]['percent_diff'] == -5.0
+
+
+def test_dma_history_is_fetched_once_per_day():
+    dma = FakeDMA({'A': 100.0})
+    engine = RankingEngine(FakeFetcher({'A': 95.0}), dma)
+    engine.rank(['A'])
+    engine.rank(['A'])
+    assert dma.history_calls == ['A']
+
+
+@pytest.fixture
+def index():
+    index = RankingIndex()
+    index.set('A', dma20=100.0, cmp=95.0)                      # -5%
+    index.set('B', dma20=100.0, cmp=99.0)                      # -1%
+    index.set('C', dma20=100.0, cmp=90.0, is_holding=True)     # -10%, held
+    index.set('D', dma20=100.0)                                # no price yet
+    return index
+
+
+def test_top_excludes_holdings(index):
+    assert [item['symbol'] for item in index.top(5)] == ['A', 'B']
+    assert [item['symbol'] for item in index.top(5, include_holdings=True)] == ['A', 'B', 'C']
+    assert [item['symbol'] for item in index.top(1)] == ['A']
+
+
+def test_price_tick_repositions_one_entry(index):
+    index.on_price('NSE:B', 80.0)
+    assert [item['symbol'] for item in index.top(5)] == ['B', 'A']
+    assert index.rank_of('B')['rank'] == 1
+    assert index.rank_of('A')['rank'] == 2
+    assert index.rank_of('C') == dict(index.rank_of('C'), rank=3, of=3)
+
+    index.on_price('D', 50.0)
+    assert index.rank_of('D')['rank'] == 1
+    assert len(index) == 4
+
+    index.on_price('UNKNOWN', 10.0)
+    assert len(index) == 4
+
+
+def test_rank_of_unranked_and_unknown_symbols(index):
+    assert index.rank_of('D') == {'rank': None, 'symbol': 'D', 'cmp': None, 'dma20': 100.0,
+                                  'percent_diff': None, 'is_holding': False}
+    assert index.rank_of('UNKNOWN') is None
+    index.remove('A')
+    assert index.rank_of('A') is None
+    assert [item['symbol'] for item in index.top(5)] == ['B']
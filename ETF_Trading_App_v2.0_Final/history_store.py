@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Local History Store
+SQLite store of daily ETF candles, filled from the broker history endpoints or imported CSVs,
+read back as (days x symbols) close matrices for the backtester
+"""
+
+import csv
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from dma_calculator import PRICE_FIELDS
+
+HISTORY_DB = os.environ.get('ETF_HISTORY_DB', 'history.db')
+DATE_FIELDS = ('date', 'timestamp', 'time', 'datetime')
+DATE_FORMATS = ('%Y-%m-%d', '%d-%b-%Y', '%d-%b-%y', '%d/%m/%Y', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S')
+
+
+def _parse_date(value) -> Optional[str]:
+    """ISO date from a candle date/timestamp (string, datetime or epoch seconds)"""
+    if value in (None, ''):
+        return None
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value).date().isoformat()
+    value = str(value).strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date().isoformat()
+        except ValueError:
+            continue
+    try:
+        # ISO timestamps with fractions or an offset, e.g. 2024-01-05T09:15:00+05:30
+        return datetime.fromisoformat(value).date().isoformat()
+    except ValueError:
+        return None
+
+
+def _field(item: Dict, fields) -> Optional[float]:
+    for field in fields:
+        try:
+            if item.get(field) not in (None, ''):
+                return float(item[field])
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+class HistoryStore:
+    def __init__(self, path: str = HISTORY_DB):
+        self.path = path
+        self._local = threading.local()
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS daily_bars ('
+            ' symbol TEXT NOT NULL,'
+            ' date TEXT NOT NULL,'
+            ' open REAL, high REAL, low REAL,'
+            ' close REAL NOT NULL,'
+            ' volume REAL,'
+            ' PRIMARY KEY (symbol, date)) WITHOUT ROWID'
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def add_bars(self, symbol: str, bars: Iterable[Dict]) -> int:
+        """Upsert candles (dicts as returned by the history endpoints); returns the number stored"""
+        symbol = symbol.replace('NSE:', '').replace('BSE:', '').strip()
+        rows = []
+        for bar in bars or []:
+            if not isinstance(bar, dict):
+                continue
+            day = _parse_date(next((bar[field] for field in DATE_FIELDS if bar.get(field)), None))
+            close = _field(bar, PRICE_FIELDS)
+            if day is None or not close:
+                continue
+            rows.append((symbol, day, _field(bar, ('open',)), _field(bar, ('high',)), _field(bar, ('low',)),
+                         close, _field(bar, ('volume',))))
+        if rows:
+            conn = self._connect()
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany('INSERT OR REPLACE INTO daily_bars VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            conn.execute('COMMIT')
+        return len(rows)
+
+    def import_csv(self, path: str) -> int:
+        """Load a long-format CSV with symbol, date and close columns (open/high/low/volume optional)"""
+        by_symbol: Dict[str, List[Dict]] = {}
+        with open(path, newline='', encoding='utf-8-sig') as source:
+            for row in csv.DictReader(source):
+                row = {key.strip().lower(): value for key, value in row.items() if key}
+                if row.get('symbol'):
+                    by_symbol.setdefault(row['symbol'], []).append(row)
+        return sum(self.add_bars(symbol, rows) for symbol, rows in by_symbol.items())
+
+    def symbols(self) -> List[str]:
+        return [row[0] for row in self._connect().execute('SELECT DISTINCT symbol FROM daily_bars ORDER BY symbol')]
+
+    def last_date(self, symbol: str) -> Optional[str]:
+        row = self._connect().execute('SELECT MAX(date) FROM daily_bars WHERE symbol = ?', (symbol,)).fetchone()
+        return row[0] if row else None
+
+    def bar(self, symbol: str, day: str) -> Optional[Dict]:
+        """One stored candle as a dict, or None"""
+        row = self._connect().execute('SELECT date, open, high, low, close, volume FROM daily_bars'
+                                      ' WHERE symbol = ? AND date = ?', (symbol, day)).fetchone()
+        return dict(zip(('date', 'open', 'high', 'low', 'close', 'volume'), row)) if row else None
+
+    def closes(self, symbols: Optional[List[str]] = None, start: Optional[str] = None,
+               end: Optional[str] = None) -> Tuple[np.ndarray, List[str], np.ndarray]:
+        """(dates, symbols, closes): one row per trading date, one column per symbol, NaN where missing"""
+        query = 'SELECT symbol, date, close FROM daily_bars WHERE 1 = 1'
+        args = []
+        if symbols:
+            query += f" AND symbol IN ({', '.join('?' * len(symbols))})"
+            args.extend(symbols)
+        if start:
+            query += ' AND date >= ?'
+            args.append(start)
+        if end:
+            query += ' AND date <= ?'
+            args.append(end)
+        rows = self._connect().execute(query, args).fetchall()
+        if not rows:
+            return np.array([], dtype='datetime64[D]'), list(symbols or []), np.empty((0, len(symbols or [])))
+        names, days, values = zip(*rows)
+        columns = list(symbols) if symbols else sorted(set(names))
+        position = {symbol: index for index, symbol in enumerate(columns)}
+        dates, row_index = np.unique(np.array(days, dtype='datetime64[D]'), return_inverse=True)
+        matrix = np.full((len(dates), len(columns)), np.nan)
+        matrix[row_index, [position[name] for name in names]] = values
+        return dates, columns, matrix
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+LIFO Lot Ledger
+Loads the Kharida (holdings) and Bika (sold) books into columnar numpy arrays and computes
+the sheet figures - LIFO gains, notional and realised P/L, tax, brokerage, monthly rollups -
+with vectorized operations, so thousands of lots revalue against a price snapshot in milliseconds
+"""
+
+import csv
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+HOLDINGS_FILE = 'Priya ETF shop with LIFO - Kharida hua maal.csv'
+SOLD_FILE = 'Priya ETF shop with LIFO - Bika hua maal.csv'
+
+TARGET = 0.06            # LIFO sell target above the last buy price
+STCG_RATE = 0.208        # 20% short-term capital gains tax + 4% cess
+LTCG_RATE = 0.13         # 12.5% long-term capital gains tax + 4% cess
+LTCG_DAYS = 365
+BROKERAGE_RATE = 0.0     # per side, as a fraction of traded value
+DATE_FORMATS = ('%d-%b-%y', '%d-%b-%Y', '%Y-%m-%d', '%d/%m/%Y')
+
+
+def clean_symbol(symbol: str) -> str:
+    return symbol.strip().replace('NSE:', '').replace('BSE:', '')
+
+
+def _parse_date(value: str):
+    value = (value or '').strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def _parse_number(value: str) -> float:
+    """Sheet numbers use Indian digit grouping ("1,54,509") and may carry a % sign"""
+    value = (value or '').replace(',', '').replace('%', '').strip()
+    try:
+        return float(value)
+    except ValueError:
+        return float('nan')
+
+
+def _read_rows(path: str) -> Tuple[Dict[str, int], List[List[str]]]:
+    """
+    Header index and data rows of a book.
+    Handles both the exported sheets (banner rows above a "Buy Date" header) and the flat test CSVs.
+    """
+    with open(path, newline='', encoding='utf-8-sig') as book:
+        rows = list(csv.reader(book))
+    for position, row in enumerate(rows):
+        first = row[0].strip().lower() if row else ''
+        if first in ('buy date', 'buydate'):
+            header = {name.strip(): column for column, name in reversed(list(enumerate(row)))}
+            return header, rows[position + 1:]
+    raise ValueError(f'No "Buy Date" header found in {path}')
+
+
+def _column(header: Dict[str, int], *names: str) -> Optional[int]:
+    for name in names:
+        if name in header:
+            return header[name]
+    return None
+
+
+class LotBook:
+    """Columnar lots: one numpy array per field, aligned by lot index"""
+
+    def __init__(self, symbols, assets, buy_dates, buy_prices, quantities, sell_prices=None, sell_dates=None):
+        self.symbols = np.asarray(symbols, dtype=object)
+        self.assets = np.asarray(assets, dtype=object)
+        self.buy_dates = np.asarray(buy_dates, dtype='datetime64[D]')
+        self.buy_prices = np.asarray(buy_prices, dtype=np.float64)
+        self.quantities = np.asarray(quantities, dtype=np.int64)
+        self.sell_prices = None if sell_prices is None else np.asarray(sell_prices, dtype=np.float64)
+        self.sell_dates = None if sell_dates is None else np.asarray(sell_dates, dtype='datetime64[D]')
+        # Integer code per symbol so per-ETF aggregates are bincounts
+        self.etfs, self.codes = np.unique(self.symbols.astype(str), return_inverse=True) if len(self.symbols) \
+            else (np.array([], dtype=str), np.array([], dtype=np.int64))
+
+    def __len__(self):
+        return len(self.buy_prices)
+
+    @property
+    def invested(self) -> np.ndarray:
+        return self.buy_prices * self.quantities
+
+    @classmethod
+    def load(cls, path: str, sold: bool = False) -> 'LotBook':
+        header, rows = _read_rows(path)
+        buy_date = _column(header, 'Buy Date', 'buyDate')
+        symbol = _column(header, 'ETF Code', 'symbol')
+        asset = _column(header, 'Underlying Asset', 'underlyingAsset')
+        price = _column(header, 'Buy Price', 'buyPrice')
+        quantity = _column(header, 'Actual Buy Qty', 'actualBuyQty')
+        sell_price = _column(header, 'Sell Price', 'sellPrice')
+        sell_date = _column(header, 'Sell Date', 'sellDate')
+        required = {'Buy Date': buy_date, 'ETF Code': symbol, 'Buy Price': price, 'Actual Buy Qty': quantity}
+        if sold:
+            required.update({'Sell Price': sell_price, 'Sell Date': sell_date})
+        missing = [name for name, column in required.items() if column is None]
+        if missing:
+            raise ValueError(f'{path} is missing the {", ".join(missing)} column(s)')
+        last = max(column for column in required.values())
+
+        fields = {name: [] for name in ('symbols', 'assets', 'buy_dates', 'buy_prices', 'quantities',
+                                        'sell_prices', 'sell_dates')}
+        for row in rows:
+            if len(row) <= last:
+                continue
+            bought = _parse_date(row[buy_date])
+            qty = _parse_number(row[quantity])
+            if bought is None or not row[symbol].strip() or np.isnan(qty):
+                continue
+            if sold:
+                sold_on = _parse_date(row[sell_date])
+                if sold_on is None:
+                    continue
+                fields['sell_dates'].append(sold_on)
+                fields['sell_prices'].append(_parse_number(row[sell_price]))
+            fields['symbols'].append(clean_symbol(row[symbol]))
+            fields['assets'].append(row[asset].strip() if asset is not None and asset < len(row) else '')
+            fields['buy_dates'].append(bought)
+            fields['buy_prices'].append(_parse_number(row[price]))
+            fields['quantities'].append(int(qty))
+        if not sold:
+            fields['sell_prices'] = fields['sell_dates'] = None
+        return cls(**fields)
+
+
+class Ledger:
+    def __init__(self, holdings: LotBook, sold: Optional[LotBook] = None, target: float = TARGET,
+                 stcg_rate: float = STCG_RATE, ltcg_rate: float = LTCG_RATE, brokerage_rate: float = BROKERAGE_RATE):
+        self.holdings = holdings
+        self.sold = sold
+        self.target = target
+        self.stcg_rate = stcg_rate
+        self.ltcg_rate = ltcg_rate
+        self.brokerage_rate = brokerage_rate
+        # Lots of each ETF in purchase order; the last one per ETF is its LIFO lot
+        self._order = np.lexsort((holdings.buy_dates, holdings.codes))
+        codes = holdings.codes[self._order]
+        self._last = self._order[np.r_[codes[1:] != codes[:-1], True]] if len(codes) else np.array([], dtype=np.int64)
+
+    @classmethod
+    def from_files(cls, holdings_path: str = HOLDINGS_FILE, sold_path: Optional[str] = SOLD_FILE, **kwargs) -> 'Ledger':
+        sold = LotBook.load(sold_path, sold=True) if sold_path else None
+        return cls(LotBook.load(holdings_path), sold, **kwargs)
+
+    def price_vector(self, prices: Dict[str, float]) -> np.ndarray:
+        """CMP per ETF code (NaN where no price is known)"""
+        lookup = {clean_symbol(symbol): price for symbol, price in prices.items()}
+        return np.array([lookup.get(etf, np.nan) for etf in self.holdings.etfs], dtype=np.float64)
+
+    def aggregates(self) -> Dict[str, np.ndarray]:
+        """Price-independent per-ETF figures: quantity, cost basis and the LIFO lot"""
+        book = self.holdings
+        count = len(book.etfs)
+        last_price = np.full(count, np.nan)
+        last_qty = np.zeros(count)
+        last_price[book.codes[self._last]] = book.buy_prices[self._last]
+        last_qty[book.codes[self._last]] = book.quantities[self._last]
+        return {
+            'symbol': book.etfs,
+            'total_qty': np.bincount(book.codes, weights=book.quantities, minlength=count),
+            'total_invested': np.bincount(book.codes, weights=book.invested, minlength=count),
+            'last_buy_price': last_price,
+            'last_qty': last_qty,
+        }
+
+    def revalue(self, prices: Dict[str, float], as_of: Optional[date] = None) -> Dict:
+        """Per-lot and per-ETF valuation against a price snapshot (Kharida sheet columns)"""
+        book = self.holdings
+        cmp_by_etf = self.price_vector(prices)
+        cmp = cmp_by_etf[book.codes]
+        invested = book.invested
+        today = np.datetime64(as_of or date.today(), 'D')
+
+        lots = {
+            'invested': invested,
+            'current_value': cmp * book.quantities,
+            'notional_pl': (cmp - book.buy_prices) * book.quantities,
+            'notional_pl_pct': (cmp - book.buy_prices) / book.buy_prices,
+            'holding_days': (today - book.buy_dates).astype(np.int64),
+            'target_price': book.buy_prices * (1 + self.target),
+        }
+
+        count = len(book.etfs)
+        totals = self.aggregates()
+        total_qty, total_invested = totals['total_qty'], totals['total_invested']
+        last_price, last_qty = totals['last_buy_price'], totals['last_qty']
+        current_value = total_qty * cmp_by_etf
+        notional = current_value - total_invested
+        fallen = (cmp_by_etf - last_price) / last_price
+        with np.errstate(invalid='ignore', divide='ignore'):
+            etfs = {
+                'symbol': book.etfs,
+                'total_qty': total_qty,
+                'total_invested': total_invested,
+                'avg_price': total_invested / total_qty,
+                'cmp': cmp_by_etf,
+                'last_buy_price': last_price,
+                'pct_fallen_from_last_buy': fallen,
+                'notional_pl': notional,
+                'notional_pl_pct': notional / total_invested,
+                'lifo_gains': (cmp_by_etf - last_price) * last_qty,
+                'lifo_gains_pct': fallen,
+                'lifo_target_price': last_price * (1 + self.target),
+                'lifo_sell_ready': fallen >= self.target,
+                # 1 = fallen the most / worst notional profit, as in the sheet
+                'rank_fallen': _rank(fallen),
+                'rank_notional_pct': _rank(notional / total_invested),
+            }
+        priced = ~np.isnan(current_value)
+        summary = {
+            'lots': len(book),
+            'etfs': count,
+            'current_invested': float(total_invested.sum()),
+            'current_value': float(current_value[priced].sum()),
+            'notional_pl': float(notional[priced].sum()),
+            'unpriced': [str(symbol) for symbol in book.etfs[~priced]],
+        }
+        invested_priced = total_invested[priced].sum()
+        summary['notional_pl_pct'] = float(summary['notional_pl'] / invested_priced) if invested_priced else 0.0
+        return {'lots': lots, 'etfs': etfs, 'summary': summary}
+
+    def realised(self) -> Dict:
+        """Per sold lot: holding days, profit, brokerage, tax and net profit (Bika sheet columns)"""
+        sold = self.sold
+        if sold is None or not len(sold):
+            return {}
+        invested = sold.invested
+        sell_value = sold.sell_prices * sold.quantities
+        profit = sell_value - invested
+        days = (sold.sell_dates - sold.buy_dates).astype(np.int64)
+        brokerage = (invested + sell_value) * self.brokerage_rate
+        rate = np.where(days >= LTCG_DAYS, self.ltcg_rate, self.stcg_rate)
+        tax = np.maximum(profit - brokerage, 0) * rate
+        return {
+            'invested': invested,
+            'holding_days': days,
+            'profit': profit,
+            'profit_pct': profit / invested,
+            'brokerage': brokerage,
+            'tax': tax,
+            'net_profit': profit - brokerage - tax,
+            'invested_on_sell_date': self._invested_at(sold.sell_dates),
+        }
+
+    def _invested_at(self, when: np.ndarray) -> np.ndarray:
+        """Capital deployed on each date: every lot bought on/before it and not sold before it"""
+        buys = [self.holdings.buy_dates]
+        amounts = [self.holdings.invested]
+        sells, sell_amounts = [], []
+        if self.sold is not None:
+            buys.append(self.sold.buy_dates)
+            amounts.append(self.sold.invested)
+            sells.append(self.sold.sell_dates)
+            sell_amounts.append(self.sold.invested)
+        buy_dates = np.concatenate(buys)
+        order = np.argsort(buy_dates)
+        bought = np.concatenate([[0.0], np.cumsum(np.concatenate(amounts)[order])])
+        total = bought[np.searchsorted(buy_dates[order], when, side='right')]
+        if sells:
+            sell_dates = np.concatenate(sells)
+            order = np.argsort(sell_dates)
+            released = np.concatenate([[0.0], np.cumsum(np.concatenate(sell_amounts)[order])])
+            total = total - released[np.searchsorted(sell_dates[order], when, side='left')]
+        return total
+
+    def monthly(self) -> Dict:
+        """Bika sheet rollup by sell month"""
+        realised = self.realised()
+        if not realised:
+            return {}
+        months = self.sold.sell_dates.astype('datetime64[M]')
+        keys, index = np.unique(months, return_inverse=True)
+        count = len(keys)
+        profit = np.bincount(index, weights=realised['profit'], minlength=count)
+        net = np.bincount(index, weights=realised['net_profit'], minlength=count)
+        max_invested = np.zeros(count)
+        np.maximum.at(max_invested, index, realised['invested_on_sell_date'])
+        running_max = np.maximum.accumulate(max_invested)
+        cumulative = np.cumsum(profit)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return {
+                'month': [str(key) for key in keys],
+                'profit': profit,
+                'max_invested': max_invested,
+                'brokerage': np.bincount(index, weights=realised['brokerage'], minlength=count),
+                'tax': np.bincount(index, weights=realised['tax'], minlength=count),
+                'net_profit': net,
+                'monthly_pct': profit / max_invested,
+                'overall_pct': cumulative / running_max,
+                'lots_sold': np.bincount(index, minlength=count),
+            }
+
+    def lifo_match(self, symbol: str, quantity: int) -> List[Tuple[int, int]]:
+        """Lots consumed by selling `quantity` units, newest first: [(lot index, units), ...]"""
+        book = self.holdings
+        lots = np.flatnonzero(book.symbols == clean_symbol(symbol))
+        lots = lots[np.argsort(book.buy_dates[lots], kind='stable')][::-1]
+        taken = np.minimum(book.quantities[lots], np.maximum(quantity - np.concatenate(
+            [[0], np.cumsum(book.quantities[lots])[:-1]]), 0))
+        return [(int(lot), int(units)) for lot, units in zip(lots, taken) if units > 0]
+
+
+def _rank(values: np.ndarray) -> np.ndarray:
+    """1-based ascending rank, NaN last"""
+    order = np.argsort(np.where(np.isnan(values), np.inf, values), kind='stable')
+    ranks = np.empty(len(values), dtype=np.int64)
+    ranks[order] = np.arange(1, len(values) + 1)
+    return ranks
+
+
+def to_records(columns: Dict) -> List[Dict]:
+    """Column dict -> JSON-friendly list of row dicts"""
+    names = list(columns)
+    if not names:
+        return []
+    records = []
+    for row in zip(*(columns[name] for name in names)):
+        record = {}
+        for name, value in zip(names, row):
+            if isinstance(value, np.generic):
+                value = value.item()
+            if isinstance(value, float) and np.isnan(value):
+                value = None
+            record[name] = value
+        records.append(record)
+    return records
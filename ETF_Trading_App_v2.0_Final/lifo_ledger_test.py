@@ -0,0 +1,71 @@
+import os
+
+import numpy as np
+import pytest
+
+from lifo_ledger import HOLDINGS_FILE, LTCG_DAYS, LTCG_RATE, SOLD_FILE, STCG_RATE, Ledger, LotBook
+from portfolio_valuation import PortfolioValuation
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+HOLDINGS = os.path.join(HERE, HOLDINGS_FILE)
+SOLD = os.path.join(HERE, SOLD_FILE)
+
+
+def test_kharida_book_totals():
+    ledger = Ledger.from_files(HOLDINGS, None)
+    assert len(ledger.holdings) == 36
+    assert len(ledger.holdings.etfs) == 30
+    assert ledger.holdings.invested.sum() == pytest.approx(589488.41)
+    assert ledger.revalue({})['summary']['current_invested'] == pytest.approx(589488.41)
+
+
+def test_bika_book_loads():
+    ledger = Ledger.from_files(HOLDINGS, SOLD)
+    assert len(ledger.sold) > 0
+    assert not np.isnan(ledger.sold.sell_prices).any()
+
+
+def test_flat_test_books():
+    ledger = Ledger.from_files(os.path.join(HERE, 'test_holdings.csv'), os.path.join(HERE, 'test_sold_items.csv'))
+    assert list(ledger.holdings.symbols) == ['NIFTYBEES', 'BANKBEES', 'GOLDBEES']
+    assert list(ledger.sold.symbols) == ['ITBEES', 'PHARMABEES']
+    realised = ledger.realised()
+    assert list(realised['holding_days']) == [20, 16]
+    assert realised['profit'] == pytest.approx([390.0, 165.0])
+
+
+def test_lifo_matching_takes_newest_lots_first():
+    ledger = Ledger.from_files(HOLDINGS, None)
+    book = ledger.holdings
+    lots = np.flatnonzero(book.symbols == 'PSUBNKIETF')
+    newest_first = lots[np.argsort(book.buy_dates[lots])][::-1]
+    newest, middle = (int(lot) for lot in newest_first[:2])
+    assert ledger.lifo_match('NSE:PSUBNKIETF', book.quantities[newest] + 5) == [
+        (newest, int(book.quantities[newest])), (middle, 5)]
+    assert sum(units for _, units in ledger.lifo_match('PSUBNKIETF', 10 ** 6)) == book.quantities[lots].sum()
+
+    totals = ledger.aggregates()
+    etf = list(totals['symbol']).index('PSUBNKIETF')
+    assert totals['last_buy_price'][etf] == book.buy_prices[newest]
+    assert totals['last_qty'][etf] == book.quantities[newest]
+
+
+def test_short_and_long_term_tax_split():
+    bought = np.datetime64('2023-01-02')
+    sold = LotBook(['A', 'B'], ['', ''], [bought, bought], [100.0, 100.0], [10, 10],
+                   sell_prices=[110.0, 110.0],
+                   sell_dates=[bought + np.timedelta64(LTCG_DAYS - 1, 'D'), bought + np.timedelta64(LTCG_DAYS, 'D')])
+    realised = Ledger(LotBook([], [], [], [], []), sold).realised()
+    assert list(realised['holding_days']) == [LTCG_DAYS - 1, LTCG_DAYS]
+    assert realised['tax'] == pytest.approx([100.0 * STCG_RATE, 100.0 * LTCG_RATE])
+
+
+def test_missing_column_is_a_value_error(tmp_path):
+    path = tmp_path / 'holdings.csv'
+    path.write_text('buyDate,symbol,underlyingAsset,price,actualBuyQty\n2024-01-15,NSE:NIFTYBEES,NIFTY 50 ETF,245.50,100\n')
+    with pytest.raises(ValueError, match='Buy Price'):
+        LotBook.load(str(path))
+
+    portfolio = PortfolioValuation(str(path))
+    assert not portfolio.load()
+    assert 'Buy Price' in portfolio.error
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Prometheus-style Metrics
+Thread-safe counters, gauges and histograms rendered in the Prometheus text format
+Exposed by price_api_server.py at /metrics
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(str(labels.get(label, '')) for label in self.labelnames)
+
+    def _format_labels(self, key: Tuple, extra: str = '') -> str:
+        parts = ['{}="{}"'.format(label, value.replace('\\', '\\\\').replace('"', '\\"'))
+                 for label, value in zip(self.labelnames, key)]
+        if extra:
+            parts.append(extra)
+        return '{' + ','.join(parts) + '}' if parts else ''
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f'{self.name}{self._format_labels(key)} {value}' for key, value in items]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the block in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(state[0]), state[1], state[2]) for key, state in self._values.items()]
+        lines = []
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = 'le="{}"'.format('+Inf' if bound == float('inf') else repr(bound))
+                lines.append(f'{self.name}_bucket{self._format_labels(key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{self._format_labels(key)} {total}')
+            lines.append(f'{self.name}_count{self._format_labels(key)} {count}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def symbol_format_label(symbol_format: str, clean_symbol: str) -> str:
+    """Collapse a concrete symbol format to its template, e.g. NSE:NIFTYBEES-EQ -> NSE:{symbol}-EQ"""
+    return symbol_format.replace(clean_symbol, '{symbol}')
+
+
+# Upstream broker calls
+UPSTREAM_LATENCY = REGISTRY.register(Histogram(
+    'etf_upstream_request_seconds', 'Latency of upstream MStocks API calls by route', ('route',)))
+UPSTREAM_RESPONSES = REGISTRY.register(Counter(
+    'etf_upstream_responses_total', 'Upstream MStocks API responses by route and status code', ('route', 'status')))
+SYMBOL_FORMAT_RESOLVED = REGISTRY.register(Counter(
+    'etf_symbol_format_resolved_total', 'Symbol format that produced a result, by route', ('route', 'format')))
+SYMBOL_FORMAT_EXHAUSTED = REGISTRY.register(Counter(
+    'etf_symbol_format_exhausted_total', 'Lookups where every symbol format failed, by route', ('route',)))
+LIVE_PRICE_SOURCE = REGISTRY.register(Counter(
+    'etf_live_price_source_total', 'Live price results by source (typeb, typea, error)', ('source',)))
+DMA_METHOD = REGISTRY.register(Counter(
+    'etf_dma20_method_total', 'DMA20 results by method (historical_data, history_store_estimate, last_known_dma, error)', ('method',)))
+CIRCUIT_STATE = REGISTRY.register(Gauge(
+    'etf_upstream_circuit_state', 'Upstream API family circuit (0 closed, 1 half-open, 2 open)', ('family',)))
+CIRCUIT_REJECTED = REGISTRY.register(Counter(
+    'etf_upstream_circuit_rejected_total', 'Calls skipped because the family circuit was open', ('family',)))
+HEDGED_QUOTES = REGISTRY.register(Counter(
+    'etf_hedged_quotes_total', 'Hedged live price requests by outcome (primary, hedge, error)', ('winner',)))
+
+# Caches, throttling and sessions
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    'etf_cache_requests_total', 'Cache lookups by cache and result (hit, miss)', ('cache', 'result')))
+RATE_LIMIT_WAIT = REGISTRY.register(Counter(
+    'etf_rate_limit_wait_seconds_total', 'Seconds spent waiting for rate limits, by route', ('route',)))
+RATE_LIMITED = REGISTRY.register(Counter(
+    'etf_rate_limited_total', 'HTTP 429 responses received, by endpoint', ('endpoint',)))
+RATE_LIMIT_RATE = REGISTRY.register(Gauge(
+    'etf_rate_limit_rate', 'Current adaptive request rate (req/s), by endpoint', ('endpoint',)))
+SESSION_REVALIDATIONS = REGISTRY.register(Counter(
+    'etf_session_revalidations_total', 'Upstream session validations by result', ('result',)))
+
+# Orders
+ORDERS_SUBMITTED = REGISTRY.register(Counter(
+    'etf_orders_submitted_total', 'Bulk engine order submissions by side and result', ('side', 'result')))
+
+# API server
+HTTP_LATENCY = REGISTRY.register(Histogram(
+    'etf_http_request_seconds', 'Latency of API server requests', ('endpoint', 'method', 'status')))
+HTTP_INFLIGHT = REGISTRY.register(Gauge(
+    'etf_http_inflight_requests', 'API server requests currently in flight', ('endpoint',)))
+
+
+def timed_call(route: str, func, *args, **kwargs):
+    """Run an upstream HTTP call, recording its latency and response status under `route`"""
+    start = time.perf_counter()
+    status = 'exception'
+    try:
+        response = func(*args, **kwargs)
+        status = getattr(response, 'status_code', 'ok')
+        return response
+    finally:
+        UPSTREAM_LATENCY.observe(time.perf_counter() - start, route=route)
+        UPSTREAM_RESPONSES.inc(route=route, status=status)
@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+Bulk Order Engine
+Validates a whole order list, submits it concurrently under the shared order rate limit
+and reports acknowledgements, fills and rejections as one consolidated result
+Idempotency keys make a retried batch safe: already submitted orders are not sent again, and an
+order whose submission outcome is unknown (timeout, connection error, 5xx) is looked up in the
+order book before it is ever resubmitted
+"""
+
+import functools
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from circuit_breaker import upstream_failed
+from metrics import ORDERS_SUBMITTED
+from structured_logging import get_logger
+
+logger = get_logger('order_engine')
+
+ORDER_TYPES = ('MARKET', 'LIMIT', 'SL', 'SL-M')
+TRANSACTION_TYPES = ('BUY', 'SELL')
+PRODUCTS = ('CNC', 'MIS', 'NRML')
+FILLED_STATUSES = ('COMPLETE', 'FILLED', 'TRADED', 'EXECUTED')
+REJECTED_STATUSES = ('REJECTED', 'CANCELLED', 'CANCELED', 'FAILED')
+MAX_ORDERS = 100
+# A 'pending' key older than this belongs to a submission that died mid-call (a crashed worker)
+PENDING_STALE_SECONDS = float(os.environ.get('ETF_ORDER_PENDING_SECONDS', '120'))
+
+
+def normalize_order(order: Dict) -> Tuple[Optional[Dict], Optional[str]]:
+    """Validate one order; returns (normalized order, None) or (None, error message)"""
+    if not isinstance(order, dict):
+        return None, 'Order must be an object'
+    symbol = str(order.get('symbol') or order.get('tradingsymbol') or '').replace('NSE:', '').replace('BSE:', '').strip()
+    if not symbol:
+        return None, 'Missing symbol'
+    side = str(order.get('transaction_type') or order.get('side') or '').upper()
+    if side not in TRANSACTION_TYPES:
+        return None, f'Invalid transaction_type: {side or "missing"}'
+    try:
+        quantity = int(order.get('quantity', 0))
+    except (TypeError, ValueError):
+        return None, 'Quantity must be a whole number'
+    if quantity <= 0:
+        return None, 'Quantity must be positive'
+    order_type = str(order.get('order_type', 'MARKET')).upper()
+    if order_type not in ORDER_TYPES:
+        return None, f'Invalid order_type: {order_type}'
+    product = str(order.get('product', 'CNC')).upper()
+    if product not in PRODUCTS:
+        return None, f'Invalid product: {product}'
+    try:
+        price = float(order.get('price', 0) or 0)
+        trigger_price = float(order.get('trigger_price', 0) or 0)
+    except (TypeError, ValueError):
+        return None, 'Price must be a number'
+    if order_type in ('LIMIT', 'SL') and price <= 0:
+        return None, f'{order_type} orders need a price'
+    if order_type in ('SL', 'SL-M') and trigger_price <= 0:
+        return None, f'{order_type} orders need a trigger_price'
+    return {
+        'symbol': symbol,
+        'exchange': str(order.get('exchange', 'NSE')).upper(),
+        'transaction_type': side,
+        'quantity': quantity,
+        'order_type': order_type,
+        'product': product,
+        'validity': str(order.get('validity', 'DAY')).upper(),
+        'price': price,
+        'trigger_price': trigger_price,
+        'idempotency_key': order.get('idempotency_key') or order.get('client_order_id'),
+    }, None
+
+
+def extract_order_id(result: Dict) -> Optional[str]:
+    """Order ID from a place-order response ({'data': [{'order_id': ..}]} or {'data': {'order_id': ..}})"""
+    if not isinstance(result, dict):
+        return None
+    data = result.get('data', result)
+    if isinstance(data, list):
+        data = data[0] if data else {}
+    if not isinstance(data, dict):
+        return None
+    for field in ('order_id', 'orderid', 'nOrdNo', 'order_no'):
+        if data.get(field):
+            return str(data[field])
+    return None
+
+
+def submission_unknown(result: Dict) -> bool:
+    """
+    True when a place-order result without an order ID may still have reached the broker:
+    no response (timeout, connection error), a 5xx, or a reply that is not an error.
+    Local validation, auth failures and 4xx rejections were definitely not placed.
+    """
+    if not isinstance(result, dict) or result.get('status') != 'error':
+        return True
+    return 'status_code' in result and upstream_failed(result['status_code'])
+
+
+class IdempotencyStore:
+    """SQLite record of submitted idempotency keys, shared by every worker"""
+
+    def __init__(self, path: str = "orders.db"):
+        self.path = path
+        self._local = threading.local()
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS order_submissions ('
+            ' idempotency_key TEXT PRIMARY KEY,'
+            ' state TEXT NOT NULL,'
+            ' order_id TEXT,'
+            ' result TEXT,'
+            ' created_at REAL NOT NULL)'
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def claim(self, key: str) -> Optional[Dict]:
+        """Reserve `key` for submission; returns the earlier record if it was already claimed"""
+        cursor = self._connect().execute(
+            'INSERT OR IGNORE INTO order_submissions (idempotency_key, state, created_at) VALUES (?, ?, ?)',
+            (key, 'pending', time.time())
+        )
+        if cursor.rowcount:
+            return None
+        return self.get(key)
+
+    def get(self, key: str) -> Optional[Dict]:
+        row = self._connect().execute(
+            'SELECT state, order_id, result, created_at FROM order_submissions WHERE idempotency_key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {'state': row[0], 'order_id': row[1], 'result': json.loads(row[2]) if row[2] else None,
+                'created_at': row[3]}
+
+    def states(self, keys: List[str]) -> Dict[str, str]:
+        """State of every key in `keys` that has a record"""
+        if not keys:
+            return {}
+        rows = self._connect().execute(
+            f"SELECT idempotency_key, state FROM order_submissions WHERE idempotency_key IN ({', '.join('?' * len(keys))})",
+            keys
+        ).fetchall()
+        return dict(rows)
+
+    def known_order_ids(self, order_ids: List[str]) -> set:
+        """The given broker order IDs that are already recorded against some key"""
+        if not order_ids:
+            return set()
+        rows = self._connect().execute(
+            f"SELECT order_id FROM order_submissions WHERE order_id IN ({', '.join('?' * len(order_ids))})",
+            order_ids
+        ).fetchall()
+        return {row[0] for row in rows}
+
+    def retry(self, key: str, state: str, created_at: float) -> bool:
+        """Re-claim a key found not to have reached the broker; False if another worker changed it first"""
+        cursor = self._connect().execute(
+            "UPDATE order_submissions SET state = 'pending', order_id = NULL, result = NULL, created_at = ?"
+            ' WHERE idempotency_key = ? AND state = ? AND created_at = ?',
+            (time.time(), key, state, created_at)
+        )
+        return bool(cursor.rowcount)
+
+    def record(self, key: str, state: str, order_id: Optional[str], result: Dict):
+        self._connect().execute(
+            'UPDATE order_submissions SET state = ?, order_id = ?, result = ? WHERE idempotency_key = ?',
+            (state, order_id, json.dumps(result, default=str), key)
+        )
+
+    def release(self, key: str):
+        """Forget a key whose order was definitely not placed, so a retried batch resubmits it"""
+        self._connect().execute('DELETE FROM order_submissions WHERE idempotency_key = ?', (key,))
+
+
+class BulkOrderEngine:
+    def __init__(self, fetcher, store: Optional[IdempotencyStore] = None, max_workers: int = 8, risk=None):
+        self.fetcher = fetcher
+        self.store = store or IdempotencyStore(os.environ.get('ETF_ORDER_DB', 'orders.db'))
+        self.max_workers = max_workers
+        self.risk = risk  # risk_check.PreTradeRisk, run before anything is sent
+
+    def submit(self, orders: List[Dict], batch_id: Optional[str] = None, sells_first: bool = True,
+               wait_seconds: float = 0, poll_interval: float = 1.0, precheck: bool = True,
+               basket_margin: Optional[float] = None) -> Dict:
+        """
+        Validate and place a list of orders.
+        Nothing is sent unless every order is valid and, with `precheck`, the whole list fits the
+        available cash. With `sells_first`, SELL orders are placed (and acknowledged) before BUY
+        orders so their proceeds are available.
+        `wait_seconds` > 0 polls the order book until every order is filled/rejected or time runs out.
+        Legs whose submission may or may not have reached the broker come back as 'unknown'; a retry of
+        the batch settles them against the order book rather than sending them again.
+        """
+        if not orders:
+            return {'status': 'error', 'message': 'No orders given'}
+        if len(orders) > MAX_ORDERS:
+            return {'status': 'error', 'message': f'At most {MAX_ORDERS} orders per batch'}
+
+        normalized, errors = [], []
+        for index, order in enumerate(orders):
+            item, error = normalize_order(order)
+            if error:
+                errors.append({'index': index, 'message': error})
+            else:
+                normalized.append(item)
+        if errors:
+            return {'status': 'error', 'message': 'Order validation failed', 'errors': errors}
+
+        batch_id = batch_id or uuid.uuid4().hex
+        for index, order in enumerate(normalized):
+            order['index'] = index
+            order['idempotency_key'] = order['idempotency_key'] or (
+                f"{batch_id}:{index}:{order['transaction_type']}:{order['symbol']}:{order['quantity']}")
+
+        reservation = None
+        if precheck and self.risk is not None:
+            # Legs a previous run already placed are not checked (or reserved) again
+            placed = self.store.states([order['idempotency_key'] for order in normalized])
+            to_check = [order for order in normalized if placed.get(order['idempotency_key']) != 'acknowledged']
+            if to_check:
+                risk = self.risk.check(to_check, reserve=True, basket_margin=basket_margin, basket_orders=normalized)
+                if not risk['ok']:
+                    return {'status': 'error', 'message': risk.get('message', 'Pre-trade check failed'), 'risk': risk}
+                reservation = risk.get('reservation')
+                for item in risk['orders']:
+                    normalized[item['index']]['reserved'] = item['required']
+
+        if sells_first:
+            waves = [[o for o in normalized if o['transaction_type'] == 'SELL'],
+                     [o for o in normalized if o['transaction_type'] == 'BUY']]
+        else:
+            waves = [normalized]
+
+        started = time.perf_counter()
+        results = []
+        # Unresolved legs of an earlier run share one order book fetch
+        place = functools.partial(self._place, order_book=functools.lru_cache(maxsize=None)(self.fetcher.get_order_book))
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                for wave in waves:
+                    results.extend(executor.map(place, wave))
+            results.sort(key=lambda item: item['index'])
+
+            if wait_seconds > 0:
+                try:
+                    self._track_fills(results, wait_seconds, poll_interval)
+                except Exception as e:
+                    logger.warning("Fill tracking stopped: %s", e, extra={'batch_id': batch_id})
+        finally:
+            if reservation is not None:
+                # Cash held for legs that were not placed (or were rejected) is free again
+                settled = {item['index']: item for item in results}
+                for order in normalized:
+                    item = settled.get(order['index'])
+                    if item is None or item['state'] in ('failed', 'rejected') or item.get('duplicate'):
+                        self.risk.release(order.get('reserved', 0), reservation)
+
+        summary = self._summarize(results)
+        summary['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        if summary['failed'] == 0 and summary['rejected'] == 0 and summary['unknown'] == 0:
+            status = 'success'
+        elif summary['failed'] + summary['rejected'] == len(results):
+            status = 'error'
+        else:
+            status = 'partial'
+        logger.info("Bulk order batch finished", extra={'batch_id': batch_id, **summary})
+        return {'status': status, 'batch_id': batch_id, 'summary': summary, 'orders': results}
+
+    def _place(self, order: Dict, order_book=None) -> Dict:
+        """Place one leg; whatever fails on the way, the leg comes back with a state"""
+        entry = {
+            'index': order['index'], 'symbol': order['symbol'], 'transaction_type': order['transaction_type'],
+            'quantity': order['quantity'], 'idempotency_key': order['idempotency_key'],
+        }
+        try:
+            return self._place_leg(order, entry, order_book)
+        except Exception as e:
+            # The idempotency store or the order book failed (e.g. "database is locked" under concurrent
+            # workers). A leg that got as far as the broker, or has an earlier unsettled attempt, is
+            # 'unknown' so a retry reconciles it; one that never got there is 'failed'.
+            entry.setdefault('state', 'failed')
+            entry.setdefault('message', f'Order submission error: {e}')
+            logger.error("Order submission error: %s", e, extra={'idempotency_key': order['idempotency_key'],
+                                                                  'state': entry['state']})
+            ORDERS_SUBMITTED.inc(side=order['transaction_type'], result=entry['state'])
+            return entry
+
+    def _place_leg(self, order: Dict, entry: Dict, order_book=None) -> Dict:
+        key = order['idempotency_key']
+        previous = self.store.claim(key)
+        if previous is not None:
+            entry['state'] = 'unknown'  # until the earlier attempt is settled
+            previous = self._reconcile(order, previous, order_book or self.fetcher.get_order_book)
+        if previous is not None:
+            ORDERS_SUBMITTED.inc(side=order['transaction_type'], result='duplicate')
+            entry.update(state=previous['state'], order_id=previous['order_id'], duplicate=True)
+            if previous.get('reconciled'):
+                entry['reconciled'] = True
+            return entry
+
+        entry['state'] = 'unknown'
+        try:
+            result = self.fetcher.place_order(
+                tradingsymbol=order['symbol'],
+                exchange=order['exchange'],
+                transaction_type=order['transaction_type'],
+                order_type=order['order_type'],
+                quantity=str(order['quantity']),
+                product=order['product'],
+                validity=order['validity'],
+                price=str(order['price']),
+                trigger_price=str(order['trigger_price'])
+            )
+        except Exception as e:
+            result = {'status': 'error', 'message': str(e), 'status_code': None}
+
+        # The entry is settled before the store is written, so a store error does not lose the outcome
+        order_id = extract_order_id(result)
+        if order_id:
+            entry.update(state='acknowledged', order_id=order_id)
+            self.store.record(key, 'acknowledged', order_id, result)
+        elif submission_unknown(result):
+            # It may have been placed; keep the key so a retry checks the order book instead of resubmitting
+            message = result.get('message', 'No order ID in response') if isinstance(result, dict) else str(result)
+            entry.update(state='unknown', message=message)
+            self.store.record(key, 'unknown', None, result)
+        else:
+            # The broker did not accept the order; free the key so a retried batch resubmits it
+            entry.update(state='failed', message=result.get('message', 'No order ID in response'))
+            self.store.release(key)
+        ORDERS_SUBMITTED.inc(side=order['transaction_type'], result=entry['state'])
+        return entry
+
+    def _reconcile(self, order: Dict, previous: Dict, order_book) -> Optional[Dict]:
+        """
+        Settle an earlier claim of this order's key: the record to report as a duplicate, or None
+        when the key was re-claimed for a fresh submission.
+        'unknown' keys and 'pending' keys older than PENDING_STALE_SECONDS are looked up in the
+        order book; they are resubmitted only once the book is readable, has no matching order
+        and the attempt is old enough for the broker to have listed it.
+        """
+        key = order['idempotency_key']
+        age = time.time() - previous['created_at']
+        if previous['state'] == 'acknowledged' or (previous['state'] == 'pending' and age < PENDING_STALE_SECONDS):
+            return previous
+        book = order_book()
+        rows = book.get('data') if isinstance(book, dict) and book.get('status') != 'error' else None
+        if not isinstance(rows, list):
+            logger.warning("Order book unavailable; leaving submission unresolved", extra={'idempotency_key': key})
+            return previous
+        match = self._find_in_book(order, rows)
+        if match is not None:
+            order_id, row = match
+            self.store.record(key, 'acknowledged', order_id, row)
+            logger.info("Reconciled submission with the order book", extra={'idempotency_key': key, 'order_id': order_id})
+            return {'state': 'acknowledged', 'order_id': order_id, 'reconciled': True}
+        if age < PENDING_STALE_SECONDS or not self.store.retry(key, previous['state'], previous['created_at']):
+            return self.store.get(key) or previous
+        logger.info("Submission never reached the broker; resubmitting", extra={'idempotency_key': key})
+        return None
+
+    def _find_in_book(self, order: Dict, rows: List[Dict]) -> Optional[Tuple[str, Dict]]:
+        """First order-book entry with this order's symbol, side and quantity not already tied to another key"""
+        candidates = []
+        for row in rows:
+            if not isinstance(row, dict):
+                continue
+            symbol = str(row.get('tradingsymbol') or row.get('symbol') or '').replace('NSE:', '').replace('BSE:', '').strip()
+            side = str(row.get('transaction_type') or '').upper()
+            try:
+                quantity = int(float(row.get('quantity') or 0))
+            except (TypeError, ValueError):
+                continue
+            order_id = extract_order_id(row)
+            if order_id and (symbol, side, quantity) == (order['symbol'], order['transaction_type'], order['quantity']):
+                candidates.append((order_id, row))
+        known = self.store.known_order_ids([order_id for order_id, _ in candidates])
+        for order_id, row in candidates:
+            if order_id not in known:
+                return order_id, row
+        return None
+
+    def _track_fills(self, results: List[Dict], wait_seconds: float, poll_interval: float):
+        """Update acknowledged orders with their order book status until all are final"""
+        deadline = time.monotonic() + wait_seconds
+        pending = {item['order_id']: item for item in results if item.get('order_id')}
+        while pending:
+            book = self.fetcher.get_order_book()
+            for order in (book.get('data') or []) if isinstance(book, dict) else []:
+                item = pending.get(str(order.get('order_id') or order.get('orderid') or ''))
+                if item is None:
+                    continue
+                status = str(order.get('status') or order.get('order_status') or '').upper()
+                item['broker_status'] = status
+                if status in FILLED_STATUSES:
+                    item['state'] = 'filled'
+                elif status in REJECTED_STATUSES:
+                    item['state'] = 'rejected'
+                    item['message'] = order.get('status_message') or order.get('rejection_reason')
+                if item['state'] in ('filled', 'rejected'):
+                    pending.pop(item['order_id'], None)
+            if not pending or time.monotonic() + poll_interval > deadline:
+                break
+            time.sleep(poll_interval)
+
+    @staticmethod
+    def _summarize(results: List[Dict]) -> Dict:
+        summary = {'total': len(results), 'acknowledged': 0, 'filled': 0, 'rejected': 0, 'failed': 0,
+                   'unknown': 0, 'duplicates': 0}
+        for item in results:
+            if item.get('duplicate'):
+                summary['duplicates'] += 1
+            if item.get('order_id'):
+                summary['acknowledged'] += 1
+            if item['state'] == 'filled':
+                summary['filled'] += 1
+            elif item['state'] == 'rejected':
+                summary['rejected'] += 1
+            elif item['state'] == 'failed':
+                summary['failed'] += 1
+            elif item['state'] == 'unknown':
+                summary['unknown'] += 1
+        return summary
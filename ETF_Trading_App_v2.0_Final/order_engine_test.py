@@ -0,0 +1,248 @@
+import sqlite3
+
+import pytest
+
+import order_engine
+from order_engine import BulkOrderEngine, IdempotencyStore, submission_unknown
+
+
+class FakeFetcher:
+    """place_order answers from a queue of results; every call is recorded"""
+
+    def __init__(self, results=None, book=None):
+        self.results = list(results or [])
+        self.book = book if book is not None else {'status': 'success', 'data': []}
+        self.placed = []
+        self.book_calls = 0
+
+    def place_order(self, **order):
+        self.placed.append(order)
+        if self.results:
+            result = self.results.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+        return {'status': 'success', 'data': [{'order_id': f"OID{len(self.placed)}"}]}
+
+    def get_order_book(self):
+        self.book_calls += 1
+        return self.book
+
+
+class FakeRisk:
+    def __init__(self, ok=True):
+        self.ok = ok
+        self.checked = []
+        self.released = []
+
+    def check(self, orders, reserve=False, basket_margin=None, basket_orders=None):
+        self.checked.append([order['symbol'] for order in orders])
+        legs = [{'index': order['index'], 'symbol': order['symbol'], 'required': 100.0}
+                for order in orders if order['transaction_type'] == 'BUY']
+        result = {'status': 'success', 'ok': self.ok, 'orders': legs}
+        if self.ok and reserve:
+            result['reservation'] = 1
+        return result
+
+    def release(self, amount, reservation):
+        self.released.append(amount)
+
+
+ORDERS = [
+    {'symbol': 'NIFTYBEES', 'transaction_type': 'BUY', 'quantity': 10},
+    {'symbol': 'GOLDBEES', 'transaction_type': 'SELL', 'quantity': 5},
+]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return IdempotencyStore(str(tmp_path / 'orders.db'))
+
+
+def test_claim_record_release(store):
+    assert store.claim('k1') is None
+    assert store.claim('k1')['state'] == 'pending'
+    store.record('k1', 'acknowledged', 'OID1', {'status': 'success'})
+    previous = store.claim('k1')
+    assert (previous['state'], previous['order_id']) == ('acknowledged', 'OID1')
+    assert store.states(['k1', 'k2']) == {'k1': 'acknowledged'}
+    assert store.known_order_ids(['OID1', 'OID2']) == {'OID1'}
+    store.release('k1')
+    assert store.claim('k1') is None
+
+
+def test_retried_batch_is_not_placed_twice(store):
+    fetcher = FakeFetcher()
+    engine = BulkOrderEngine(fetcher, store=store)
+    first = engine.submit(ORDERS, batch_id='b1')
+    second = engine.submit(ORDERS, batch_id='b1')
+    assert first['status'] == 'success'
+    assert len(fetcher.placed) == 2
+    assert second['summary']['duplicates'] == 2
+    assert [item['order_id'] for item in second['orders']] == [item['order_id'] for item in first['orders']]
+
+
+def test_rejected_order_frees_its_key(store):
+    fetcher = FakeFetcher([{'status': 'error', 'message': 'Insufficient funds', 'status_code': 400}])
+    engine = BulkOrderEngine(fetcher, store=store)
+    first = engine.submit(ORDERS[:1], batch_id='b1')
+    assert first['orders'][0]['state'] == 'failed'
+    second = engine.submit(ORDERS[:1], batch_id='b1')
+    assert second['orders'][0]['state'] == 'acknowledged'
+    assert len(fetcher.placed) == 2
+
+
+@pytest.mark.parametrize('result', [
+    {'status': 'error', 'message': 'Order placement error: timed out', 'status_code': None},
+    {'status': 'error', 'message': 'Order placement failed: 502', 'status_code': 502},
+    TimeoutError('read timed out'),
+])
+def test_timeout_is_unknown_and_found_in_order_book(store, result):
+    fetcher = FakeFetcher([result])
+    engine = BulkOrderEngine(fetcher, store=store)
+    first = engine.submit(ORDERS[:1], batch_id='b1')
+    assert first['orders'][0]['state'] == 'unknown'
+    assert first['status'] == 'partial'
+
+    fetcher.book = {'status': 'success', 'data': [
+        {'order_id': 'OID9', 'tradingsymbol': 'NIFTYBEES', 'transaction_type': 'BUY', 'quantity': '10'}]}
+    second = engine.submit(ORDERS[:1], batch_id='b1')
+    assert len(fetcher.placed) == 1
+    assert second['orders'][0]['order_id'] == 'OID9'
+    assert second['orders'][0]['reconciled']
+
+
+def test_unknown_order_is_resubmitted_only_when_absent_and_old(store, monkeypatch):
+    fetcher = FakeFetcher([{'status': 'error', 'message': 'timed out', 'status_code': None}])
+    engine = BulkOrderEngine(fetcher, store=store)
+    engine.submit(ORDERS[:1], batch_id='b1')
+
+    # Too recent for the broker's order book to be trusted: stays unknown
+    assert engine.submit(ORDERS[:1], batch_id='b1')['orders'][0]['state'] == 'unknown'
+    assert len(fetcher.placed) == 1
+
+    monkeypatch.setattr(order_engine, 'PENDING_STALE_SECONDS', 0)
+    third = engine.submit(ORDERS[:1], batch_id='b1')
+    assert third['orders'][0]['state'] == 'acknowledged'
+    assert len(fetcher.placed) == 2
+
+
+def test_unknown_order_waits_when_order_book_is_unavailable(store, monkeypatch):
+    monkeypatch.setattr(order_engine, 'PENDING_STALE_SECONDS', 0)
+    fetcher = FakeFetcher([{'status': 'error', 'message': 'timed out', 'status_code': None}],
+                          book={'status': 'error', 'message': 'Failed to get orders: 503'})
+    engine = BulkOrderEngine(fetcher, store=store)
+    engine.submit(ORDERS[:1], batch_id='b1')
+    assert engine.submit(ORDERS[:1], batch_id='b1')['orders'][0]['state'] == 'unknown'
+    assert len(fetcher.placed) == 1
+
+
+def test_order_book_entry_is_matched_to_one_key_only(store, monkeypatch):
+    monkeypatch.setattr(order_engine, 'PENDING_STALE_SECONDS', 0)
+    store.claim('a')
+    store.record('a', 'acknowledged', 'OID9', {})
+    store.claim('b')
+    fetcher = FakeFetcher(book={'status': 'success', 'data': [
+        {'order_id': 'OID9', 'tradingsymbol': 'NIFTYBEES', 'transaction_type': 'BUY', 'quantity': 10}]})
+    engine = BulkOrderEngine(fetcher, store=store)
+    result = engine.submit([dict(ORDERS[0], idempotency_key='b')])
+    assert result['orders'][0]['order_id'] == 'OID1'
+    assert len(fetcher.placed) == 1
+
+
+def test_stale_pending_claim_is_reconciled(store, monkeypatch):
+    store.claim('crashed')  # a worker died between claim and record
+    fetcher = FakeFetcher()
+    engine = BulkOrderEngine(fetcher, store=store)
+    order = dict(ORDERS[0], idempotency_key='crashed')
+    assert engine.submit([order])['orders'][0]['state'] == 'pending'
+    assert fetcher.book_calls == 0
+
+    monkeypatch.setattr(order_engine, 'PENDING_STALE_SECONDS', 0)
+    fetcher.book = {'status': 'success', 'data': [
+        {'order_id': 'OID7', 'tradingsymbol': 'NSE:NIFTYBEES', 'transaction_type': 'BUY', 'quantity': 10}]}
+    result = engine.submit([order])
+    assert result['orders'][0]['order_id'] == 'OID7'
+    assert fetcher.placed == []
+
+
+def test_placed_legs_are_not_reserved_again(store):
+    risk = FakeRisk()
+    engine = BulkOrderEngine(FakeFetcher(), store=store, risk=risk)
+    engine.submit(ORDERS, batch_id='b1')
+    result = engine.submit(ORDERS, batch_id='b1')
+    assert risk.checked == [['NIFTYBEES', 'GOLDBEES']]
+    assert result['summary']['duplicates'] == 2
+
+
+def test_failed_legs_release_their_reservation(store):
+    risk = FakeRisk()
+    fetcher = FakeFetcher([{'status': 'error', 'message': 'RMS rejected', 'status_code': 400}])
+    engine = BulkOrderEngine(fetcher, store=store, risk=risk)
+    result = engine.submit(ORDERS[:1], batch_id='b1')
+    assert result['status'] == 'error'
+    assert risk.released == [100.0]
+
+
+class LockedStore(IdempotencyStore):
+    """Raises 'database is locked' from `method` for the keys of `symbol`"""
+
+    def __init__(self, path, method, symbol):
+        super().__init__(path)
+        self.method, self.symbol = method, symbol
+
+    def _locked(self, method, key):
+        if method == self.method and f':{self.symbol}:' in key:
+            raise sqlite3.OperationalError('database is locked')
+
+    def claim(self, key):
+        self._locked('claim', key)
+        return super().claim(key)
+
+    def record(self, key, *args):
+        self._locked('record', key)
+        return super().record(key, *args)
+
+
+def test_store_error_on_claim_fails_only_that_leg(tmp_path):
+    risk = FakeRisk()
+    fetcher = FakeFetcher()
+    store = LockedStore(str(tmp_path / 'orders.db'), 'claim', 'NIFTYBEES')
+    result = BulkOrderEngine(fetcher, store=store, risk=risk).submit(ORDERS, batch_id='b1')
+    states = {item['symbol']: item['state'] for item in result['orders']}
+    assert states == {'NIFTYBEES': 'failed', 'GOLDBEES': 'acknowledged'}
+    assert 'database is locked' in result['orders'][0]['message']
+    assert [order['tradingsymbol'] for order in fetcher.placed] == ['GOLDBEES']
+    assert risk.released == [100.0]
+
+
+def test_store_error_after_placement_keeps_the_order_id(tmp_path):
+    risk = FakeRisk()
+    store = LockedStore(str(tmp_path / 'orders.db'), 'record', 'NIFTYBEES')
+    result = BulkOrderEngine(FakeFetcher(), store=store, risk=risk).submit(ORDERS[:1], batch_id='b1')
+    assert (result['orders'][0]['state'], result['orders'][0]['order_id']) == ('acknowledged', 'OID1')
+    assert risk.released == []
+
+
+def test_order_book_error_while_reconciling_is_unknown(store, monkeypatch):
+    monkeypatch.setattr(order_engine, 'PENDING_STALE_SECONDS', 0)
+    store.claim('crashed')
+    fetcher = FakeFetcher()
+
+    def broken_book():
+        raise ConnectionError('order book down')
+
+    fetcher.get_order_book = broken_book
+    risk = FakeRisk()
+    result = BulkOrderEngine(fetcher, store=store, risk=risk).submit([dict(ORDERS[0], idempotency_key='crashed')])
+    assert result['orders'][0]['state'] == 'unknown'
+    assert fetcher.placed == []
+    assert risk.released == []
+
+
+def test_submission_unknown():
+    assert submission_unknown({'status': 'error', 'message': 'x', 'status_code': None})
+    assert submission_unknown({'status': 'error', 'message': 'x', 'status_code': 503})
+    assert submission_unknown({'status': 'success', 'data': []})
+    assert not submission_unknown({'status': 'error', 'message': 'Not logged in. Please login first.'})
+    assert not submission_unknown({'status': 'error', 'message': 'x', 'status_code': 400})
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Order State Store
+Latest state of every order, kept in memory and fed by the MTicker order/trade WebSocket stream
+Order status queries are answered locally; subscribers are woken on every change
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from structured_logging import get_logger
+
+logger = get_logger('order_state')
+
+TERMINAL_STATUSES = ('COMPLETE', 'FILLED', 'TRADED', 'EXECUTED', 'REJECTED', 'CANCELLED', 'CANCELED', 'FAILED')
+ORDER_ID_FIELDS = ('order_id', 'orderid', 'nOrdNo', 'order_no')
+TIMESTAMP_FIELDS = ('exchange_update_timestamp', 'exchange_timestamp', 'order_timestamp', 'timestamp')
+
+
+def _order_id(update: Dict) -> Optional[str]:
+    for field in ORDER_ID_FIELDS:
+        if update.get(field):
+            return str(update[field])
+    return None
+
+
+def _timestamp(update: Dict) -> str:
+    for field in TIMESTAMP_FIELDS:
+        if update.get(field):
+            return str(update[field])
+    return ''
+
+
+class OrderStateStore:
+    def __init__(self, max_events: int = 1000):
+        self._orders: Dict[str, Dict] = {}
+        self._events: List[Dict] = []
+        self._max_events = max_events
+        self._seq = 0
+        self._cond = threading.Condition()
+        self.seeded = False
+        self.last_update = None
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """Call `callback(order)` on every change; it runs under the store lock, so keep it quick"""
+        self._listeners.append(callback)
+
+    def _publish(self, order: Dict):
+        """Record a change; caller holds the condition"""
+        self._seq += 1
+        order['seq'] = self._seq
+        self._events.append(dict(order))
+        if len(self._events) > self._max_events:
+            del self._events[:len(self._events) - self._max_events]
+        self.last_update = time.time()
+        self._cond.notify_all()
+        for callback in self._listeners:
+            try:
+                callback(order)
+            except Exception as e:
+                logger.warning("Order listener failed: %s", e)
+
+    def apply_order_update(self, update: Dict) -> Optional[Dict]:
+        """Merge an order update; stale or post-terminal non-terminal updates are ignored"""
+        order_id = _order_id(update)
+        if not order_id:
+            return None
+        status = str(update.get('status') or update.get('order_status') or '').upper()
+        with self._cond:
+            current = self._orders.get(order_id)
+            if current is not None:
+                if current.get('status') in TERMINAL_STATUSES and status not in TERMINAL_STATUSES:
+                    return current
+                stamp = _timestamp(update)
+                if stamp and current.get('updated_at') and stamp < current['updated_at']:
+                    return current
+            order = dict(current or {})
+            order.update(update)
+            order['order_id'] = order_id
+            if status:
+                order['status'] = status
+            order['updated_at'] = _timestamp(update) or order.get('updated_at', '')
+            self._orders[order_id] = order
+            self._publish(order)
+            return dict(order)
+
+    def apply_trade_update(self, trade: Dict) -> Optional[Dict]:
+        """Accumulate a fill into its order's filled quantity and average price"""
+        order_id = _order_id(trade)
+        if not order_id:
+            return None
+        try:
+            quantity = float(trade.get('quantity') or trade.get('filled_quantity') or 0)
+            price = float(trade.get('average_price') or trade.get('price') or 0)
+        except (TypeError, ValueError):
+            return None
+        trade_id = str(trade.get('trade_id') or '')
+        with self._cond:
+            order = dict(self._orders.get(order_id) or {'order_id': order_id})
+            trades = order.setdefault('trade_ids', [])
+            if trade_id and trade_id in trades:
+                return order
+            if trade_id:
+                order['trade_ids'] = trades + [trade_id]
+            filled = float(order.get('filled_quantity') or 0)
+            total = filled + quantity
+            if total > 0:
+                order['average_price'] = (filled * float(order.get('average_price') or 0) + quantity * price) / total
+            order['filled_quantity'] = total
+            for field in ('tradingsymbol', 'exchange', 'transaction_type'):
+                if trade.get(field) and not order.get(field):
+                    order[field] = trade[field]
+            self._orders[order_id] = order
+            self._publish(order)
+            return dict(order)
+
+    def seed(self, orders: List[Dict]):
+        """Load a REST order book snapshot, e.g. at start-up or after a stream reconnect"""
+        for order in orders or []:
+            self.apply_order_update(order)
+        self.seeded = True
+
+    def get(self, order_id: str) -> Optional[Dict]:
+        with self._cond:
+            order = self._orders.get(str(order_id))
+            return dict(order) if order else None
+
+    def snapshot(self) -> List[Dict]:
+        with self._cond:
+            return [dict(order) for order in self._orders.values()]
+
+    @property
+    def seq(self) -> int:
+        return self._seq
+
+    def changes_since(self, seq: int, timeout: float = 25) -> List[Dict]:
+        """Order changes after `seq`, blocking up to `timeout` seconds until there is one"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > seq, timeout=timeout)
+            return [event for event in self._events if event['seq'] > seq]
+
+
+class OrderStream:
+    """Runs an MTicker connection whose order/trade callbacks feed an OrderStateStore"""
+
+    def __init__(self, store: OrderStateStore, root: Optional[str] = None, on_reconnect=None):
+        self.store = store
+        self.root = root or os.environ.get('MSTOCKS_WS_URL', 'wss://ws.mstock.trade')
+        self.on_reconnect = on_reconnect
+        self.enabled = os.environ.get('ETF_ORDER_STREAM', '1') != '0'
+        self.ticker = None
+        self.access_token = None
+        self.connected = False
+        self._lock = threading.Lock()
+
+    @property
+    def live(self) -> bool:
+        """True when the store is current: stream connected and seeded from the order book"""
+        return self.connected and self.store.seeded
+
+    def ensure(self, api_key: Optional[str], access_token: Optional[str]) -> bool:
+        """Start the stream, or restart it for a new access token; no-op if already running"""
+        if not (self.enabled and api_key and access_token):
+            return False
+        with self._lock:
+            if self.ticker is not None and self.access_token == access_token:
+                return True
+            try:
+                from tradingapi_a.mticker import MTicker
+                from twisted.internet import reactor
+            except ImportError as e:
+                logger.warning("Order stream unavailable, using REST order status: %s", e)
+                self.enabled = False
+                return False
+
+            if self.ticker is not None:
+                reactor.callFromThread(self.ticker.close)
+            ticker = MTicker(api_key, access_token, self.root)
+            ticker.on_order_update = lambda ws, data: self.store.apply_order_update(data)
+            ticker.on_trade_update = lambda ws, data: self.store.apply_trade_update(data)
+            ticker.on_connect = self._on_connect
+            ticker.on_close = self._on_close
+            ticker.on_error = self._on_close
+            self.ticker = ticker
+            self.access_token = access_token
+            if reactor.running:
+                reactor.callFromThread(ticker.connect, threaded=True)
+            else:
+                ticker.connect(threaded=True)
+            logger.info("Order stream started", extra={'root': self.root})
+            return True
+
+    def _on_connect(self, ws, response):
+        self.connected = True
+        try:
+            # The LOGIN message keeps the order/trade channel authorised
+            ws.send_login_after_connect()
+        except Exception as e:
+            logger.warning("Order stream login failed: %s", e)
+        # Updates may have been missed while disconnected; re-seed from the order book
+        self.store.seeded = False
+        if self.on_reconnect:
+            threading.Thread(target=self.on_reconnect, daemon=True).start()
+
+    def _on_close(self, ws, code, reason):
+        self.connected = False
+        logger.warning("Order stream closed", extra={'code': code, 'reason': str(reason)})
+
+
+def sse_events(store: OrderStateStore, since: int = 0, heartbeat: float = 25, active=None):
+    """
+    Server-sent events for order changes after `since`; a comment line is sent as a heartbeat.
+    The stream ends once `active()` returns False (e.g. after logout).
+    """
+    seq = since
+    while active is None or active():
+        events = store.changes_since(seq, timeout=heartbeat)
+        if not events:
+            yield ': keepalive\n\n'
+            continue
+        for event in events:
+            seq = event['seq']
+            yield f"id: {seq}\nevent: order\ndata: {json.dumps(event, default=str)}\n\n"
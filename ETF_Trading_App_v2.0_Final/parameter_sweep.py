@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Parameter Sweep
+Runs the backtester over a grid of strategy parameters on a process pool.
+The close matrix is written once to a memory-mapped .npy file that every worker maps
+read-only, so tasks carry only their parameters and return one summary row each
+"""
+
+import argparse
+import contextlib
+import csv
+import itertools
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from backtester import Backtester
+from structured_logging import get_logger
+
+logger = get_logger('parameter_sweep')
+
+METRICS = ('final_equity', 'total_return', 'cagr', 'max_drawdown', 'utilisation', 'buys', 'sells',
+           'realised_profit', 'tax', 'open_lots', 'unrealised_pl')
+
+# Per-worker market data, mapped once by attach
+_market = {}
+
+
+def grid(**axes) -> List[Dict]:
+    """Every combination of the given parameter values: grid(target=[0.05, 0.06], parts=[40, 50])"""
+    names = list(axes)
+    return [dict(zip(names, values)) for values in itertools.product(*(axes[name] for name in names))]
+
+
+@contextlib.contextmanager
+def shared_arrays(**arrays):
+    """Save arrays as .npy files in a temporary directory (removed on exit) for workers to map"""
+    directory = tempfile.mkdtemp(prefix='etf-sweep-')
+    try:
+        for name, array in arrays.items():
+            np.save(os.path.join(directory, f'{name}.npy'), np.ascontiguousarray(array))
+        yield directory
+    finally:
+        _market.clear()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def attach(directory: str):
+    """Pool initializer: map every shared array read-only into this worker"""
+    for name in os.listdir(directory):
+        if name.endswith('.npy'):
+            _market[name[:-4]] = np.load(os.path.join(directory, name), mmap_mode='r')
+
+
+def market(name: str) -> np.ndarray:
+    return _market[name]
+
+
+def run_point(params: Dict) -> Dict:
+    """One backtest; a `window` of (first row, first trading row, end row) limits it to a slice"""
+    try:
+        options = dict(params)
+        first, start, end = options.pop('window', (0, 0, len(_market['closes'])))
+        closes = _market['closes'][first:end]
+        summary = Backtester(**options).run(_market['dates'][first:end], range(closes.shape[1]), closes,
+                                            start=start - first)['summary']
+        row = {name: summary[name] for name in METRICS}
+    except Exception as e:
+        row = {'error': str(e)}
+    return {**params, **row}
+
+
+def sweep(dates, closes: np.ndarray, points: List[Dict], workers: Optional[int] = None,
+          sort_by: str = 'cagr', output: Optional[str] = None) -> List[Dict]:
+    """
+    Backtest every parameter dict in `points`; rows come back highest `sort_by` first
+    and are written to `output` (CSV) when given.
+    """
+    started = time.perf_counter()
+    with shared_arrays(dates=np.asarray(dates, dtype='datetime64[D]'),
+                       closes=np.asarray(closes, dtype=np.float64)) as directory:
+        rows = pool_map(run_point, points, directory, workers)
+
+    rows.sort(key=lambda row: -row[sort_by] if row.get(sort_by) is not None else float('inf'))
+    if output:
+        write_results(rows, output)
+    logger.info("Parameter sweep finished", extra={
+        'points': len(points), 'workers': workers or os.cpu_count(), 'errors': sum('error' in row for row in rows),
+        'duration_ms': round((time.perf_counter() - started) * 1000, 1)})
+    return rows
+
+
+def pool_map(function, tasks: List, directory: str, workers: Optional[int] = None) -> List:
+    """Run `function` over tasks on a process pool whose workers map the arrays in `directory`"""
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(tasks) <= 1:
+        attach(directory)
+        return [function(task) for task in tasks]
+    chunksize = max(len(tasks) // (workers * 4), 1)
+    with ProcessPoolExecutor(max_workers=workers, initializer=attach, initargs=(directory,)) as executor:
+        return list(executor.map(function, tasks, chunksize=chunksize))
+
+
+def write_results(rows: List[Dict], path: str):
+    """One CSV row per grid point: parameters, then metrics"""
+    columns = list(dict.fromkeys(name for row in rows for name in row))
+    with open(path, 'w', newline='') as results:
+        writer = csv.DictWriter(results, fieldnames=columns)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({name: round(value, 6) if isinstance(value, float) else value
+                             for name, value in row.items()})
+
+
+def _values(text: str, kind):
+    return [kind(value) for value in text.split(',')]
+
+
+def main():
+    from history_store import HistoryStore, HISTORY_DB
+
+    parser = argparse.ArgumentParser(description='Sweep backtest parameters over the local history store')
+    parser.add_argument('--db', default=HISTORY_DB)
+    parser.add_argument('--symbols', help='comma separated, default every symbol in the store')
+    parser.add_argument('--start')
+    parser.add_argument('--end')
+    parser.add_argument('--dma-window', default='20', help='comma separated values to try')
+    parser.add_argument('--target', default='0.06')
+    parser.add_argument('--parts', default='50')
+    parser.add_argument('--averaging-threshold', default='0.025')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--output', default='sweep_results.csv')
+    args = parser.parse_args()
+
+    dates, _, closes = HistoryStore(args.db).closes(args.symbols.split(',') if args.symbols else None,
+                                                    args.start, args.end)
+    points = grid(dma_window=_values(args.dma_window, int), target=_values(args.target, float),
+                  parts=_values(args.parts, int), averaging_threshold=_values(args.averaging_threshold, float))
+    rows = sweep(dates, closes, points, workers=args.workers, output=args.output)
+    print(f"{len(rows)} combinations written to {args.output}")
+    for row in rows[:5]:
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from backtester import Backtester
+from parameter_sweep import METRICS, grid, sweep, write_results
+
+POINTS = grid(target=[0.04, 0.06], parts=[10, 20], capital=[100000])
+
+
+def market(days=260, count=5, seed=11):
+    rng = np.random.default_rng(seed)
+    closes = 100 * np.cumprod(1 + rng.normal(0, 0.015, size=(days, count)), axis=0)
+    closes[rng.random((days, count)) < 0.05] = np.nan
+    return np.datetime64('2022-01-03') + np.arange(days), closes
+
+
+def test_grid():
+    assert len(POINTS) == 4
+    assert POINTS[0] == {'target': 0.04, 'parts': 10, 'capital': 100000}
+
+
+def test_sweep_rows_match_direct_backtests():
+    dates, closes = market()
+    rows = sweep(dates, closes, POINTS, workers=1)
+    assert [row['cagr'] for row in rows] == sorted((row['cagr'] for row in rows), reverse=True)
+    for row in rows:
+        params = {name: row[name] for name in ('target', 'parts', 'capital')}
+        summary = Backtester(**params).run(dates, range(closes.shape[1]), closes)['summary']
+        assert {name: row[name] for name in METRICS} == {name: summary[name] for name in METRICS}
+
+
+def test_sweep_is_deterministic_and_pool_independent():
+    dates, closes = market()
+    first = sweep(dates, closes, POINTS, workers=1)
+    assert sweep(dates, closes, POINTS, workers=1) == first
+    assert sweep(dates, closes, POINTS, workers=2) == first
+
+
+def test_bad_point_is_reported_not_raised(tmp_path):
+    dates, closes = market()
+    rows = sweep(dates, closes, POINTS[:1] + [{'parts': 0}], workers=1, output=str(tmp_path / 'sweep.csv'))
+    assert sum('error' in row for row in rows) == 1
+    assert (tmp_path / 'sweep.csv').read_text().count('\n') == 3
+
+
+def test_write_results_rounds_floats(tmp_path):
+    path = tmp_path / 'rows.csv'
+    write_results([{'target': 0.06, 'cagr': 0.123456789}], str(path))
+    assert path.read_text().splitlines() == ['target,cagr', '0.06,0.123457']
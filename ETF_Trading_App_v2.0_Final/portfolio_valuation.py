@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Portfolio Valuation
+Keeps per-ETF quantity, cost basis and LIFO lot in memory and revalues on every price tick:
+a tick updates one position and the running portfolio totals, so the current valuation is
+always ready without going back over the lots
+"""
+
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from structured_logging import get_logger
+
+logger = get_logger('portfolio_valuation')
+
+HOLDINGS_PATH = os.environ.get('ETF_HOLDINGS_FILE', 'Priya ETF shop with LIFO - Kharida hua maal.csv')
+
+
+class Position:
+    __slots__ = ('symbol', 'qty', 'invested', 'last_price', 'last_qty', 'target_price', 'cmp', 'updated_at')
+
+    def __init__(self, symbol: str, qty: float, invested: float, last_price: float, last_qty: float, target: float):
+        self.symbol = symbol
+        self.qty = qty
+        self.invested = invested
+        self.last_price = last_price
+        self.last_qty = last_qty
+        self.target_price = last_price * (1 + target)
+        self.cmp = None
+        self.updated_at = None
+
+    def to_dict(self) -> Dict:
+        item = self.figures(self.cmp)
+        item['updated_at'] = self.updated_at
+        return item
+
+    def figures(self, cmp: Optional[float]) -> Dict:
+        """Position figures at price `cmp` (None = unpriced)"""
+        item = {
+            'symbol': self.symbol,
+            'total_qty': int(self.qty),
+            'total_invested': round(self.invested, 2),
+            'avg_price': round(self.invested / self.qty, 2) if self.qty else None,
+            'last_buy_price': self.last_price,
+            'last_buy_qty': int(self.last_qty),
+            'lifo_target_price': round(self.target_price, 2),
+            'cmp': cmp,
+        }
+        if cmp is None:
+            return item
+        value = self.qty * cmp
+        item.update(
+            current_value=round(value, 2),
+            notional_pl=round(value - self.invested, 2),
+            notional_pl_pct=(value - self.invested) / self.invested if self.invested else 0.0,
+            lifo_gains=round((cmp - self.last_price) * self.last_qty, 2),
+            lifo_gains_pct=(cmp - self.last_price) / self.last_price,
+            pct_from_target=(cmp - self.target_price) / self.target_price,
+            lifo_sell_ready=cmp >= self.target_price,
+        )
+        return item
+
+
+def _summary(etfs: int, priced: int, invested: float, priced_invested: float, value: float, last_tick=None) -> Dict:
+    notional = value - priced_invested
+    return {
+        'etfs': etfs,
+        'priced': priced,
+        'current_invested': round(invested, 2),
+        'current_value': round(value, 2),
+        'notional_pl': round(notional, 2),
+        'notional_pl_pct': notional / priced_invested if priced_invested else 0.0,
+        'last_tick': last_tick,
+    }
+
+
+class PortfolioValuation:
+    def __init__(self, holdings_path: str = HOLDINGS_PATH, target: Optional[float] = None):
+        self.holdings_path = holdings_path
+        self.target = target
+        self.loaded_at = None
+        self.error = None
+        self._positions: Dict[str, Position] = {}
+        self._invested = 0.0          # cost basis of every position
+        self._priced_invested = 0.0   # cost basis of positions with a price
+        self._value = 0.0             # market value of positions with a price
+        self._priced = 0
+        self._last_tick = None
+        self._lock = threading.Lock()
+
+    def load(self, ledger=None) -> bool:
+        """(Re)build the positions from the holdings book; prices already seen carry over"""
+        from lifo_ledger import Ledger, TARGET
+        try:
+            ledger = ledger or Ledger.from_files(self.holdings_path, None)
+        except (OSError, ValueError) as e:
+            self.error = str(e)
+            logger.warning("Holdings book unavailable: %s", e, extra={'path': self.holdings_path})
+            return False
+        target = TARGET if self.target is None else self.target
+        totals = ledger.aggregates()
+        positions = {
+            str(symbol): Position(str(symbol), float(qty), float(invested), float(price), float(last_qty), target)
+            for symbol, qty, invested, price, last_qty in zip(
+                totals['symbol'], totals['total_qty'], totals['total_invested'],
+                totals['last_buy_price'], totals['last_qty'])
+        }
+        with self._lock:
+            # Swap positions and totals in one step so no tick is applied to a half-built state
+            for symbol, position in positions.items():
+                previous = self._positions.get(symbol)
+                if previous is not None and previous.cmp:
+                    position.cmp, position.updated_at = previous.cmp, previous.updated_at
+            priced = [position for position in positions.values() if position.cmp is not None]
+            self._positions = positions
+            self._invested = sum(position.invested for position in positions.values())
+            self._priced_invested = sum(position.invested for position in priced)
+            self._value = sum(position.qty * position.cmp for position in priced)
+            self._priced = len(priced)
+        self.loaded_at = time.time()
+        self.error = None
+        logger.info("Portfolio loaded", extra={'etfs': len(positions), 'invested': round(self._invested, 2)})
+        return True
+
+    def ensure_loaded(self) -> bool:
+        return self.loaded_at is not None or self.load()
+
+    def symbols(self) -> List[str]:
+        return list(self._positions)
+
+    def on_price(self, symbol: str, price: float):
+        """Price listener: revalue one position and adjust the totals by its change"""
+        if not price:
+            return
+        symbol = symbol.replace('NSE:', '').replace('BSE:', '').strip()
+        price = float(price)
+        with self._lock:
+            # Looked up under the lock: a concurrent load() may be swapping the positions and totals
+            position = self._positions.get(symbol)
+            if position is None:
+                return
+            if position.cmp is None:
+                self._priced += 1
+                self._priced_invested += position.invested
+                self._value += position.qty * price
+            else:
+                self._value += position.qty * (price - position.cmp)
+            position.cmp = price
+            position.updated_at = self._last_tick = time.time()
+
+    def _summary(self) -> Dict:
+        """Caller holds the lock"""
+        return _summary(len(self._positions), self._priced, self._invested, self._priced_invested,
+                        self._value, self._last_tick)
+
+    def summary(self) -> Dict:
+        with self._lock:
+            return self._summary()
+
+    def position(self, symbol: str) -> Optional[Dict]:
+        with self._lock:
+            position = self._positions.get(symbol.replace('NSE:', '').replace('BSE:', '').strip())
+            return position.to_dict() if position is not None else None
+
+    def valuation(self) -> Dict:
+        """Current summary and positions, as last revalued"""
+        with self._lock:
+            positions = [position.to_dict() for position in self._positions.values()]
+            summary = self._summary()
+        return {
+            'summary': summary,
+            'positions': positions,
+            'unpriced': [item['symbol'] for item in positions if item['cmp'] is None],
+        }
+
+    def valuation_at(self, prices: Dict[str, float]) -> Dict:
+        """
+        Summary and positions valued at the given prices (e.g. a day's closes), worked out on the
+        side: the live valuation and its running totals are left as they are
+        """
+        prices = {symbol.replace('NSE:', '').replace('BSE:', '').strip(): float(price)
+                  for symbol, price in prices.items() if price}
+        with self._lock:
+            held = list(self._positions.values())
+        positions = [position.figures(prices.get(position.symbol)) for position in held]
+        priced = [position for position in held if position.symbol in prices]
+        return {
+            'summary': _summary(len(held), len(priced), sum(position.invested for position in held),
+                                sum(position.invested for position in priced),
+                                sum(position.qty * prices[position.symbol] for position in priced)),
+            'positions': positions,
+            'unpriced': [item['symbol'] for item in positions if item['cmp'] is None],
+        }
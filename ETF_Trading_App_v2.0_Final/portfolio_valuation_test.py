@@ -0,0 +1,91 @@
+import threading
+
+import pytest
+
+from lifo_ledger import Ledger, LotBook
+from portfolio_valuation import PortfolioValuation
+
+
+def ledger(lots):
+    """lots: (symbol, buy date, buy price, quantity)"""
+    symbols, dates, prices, quantities = zip(*lots)
+    return Ledger(LotBook(symbols, [''] * len(lots), dates, prices, quantities), target=0.06)
+
+
+LOTS = [
+    ('NIFTYBEES', '2024-01-02', 200.0, 10),
+    ('NIFTYBEES', '2024-02-01', 220.0, 5),
+    ('GOLDBEES', '2024-01-15', 50.0, 100),
+]
+
+
+@pytest.fixture
+def portfolio():
+    portfolio = PortfolioValuation(target=0.06)
+    assert portfolio.load(ledger(LOTS))
+    return portfolio
+
+
+def test_totals_follow_ticks(portfolio):
+    assert portfolio.summary()['current_invested'] == 8100.0
+    assert portfolio.summary()['priced'] == 0
+
+    portfolio.on_price('NSE:NIFTYBEES', 230.0)
+    summary = portfolio.summary()
+    assert (summary['priced'], summary['current_value'], summary['notional_pl']) == (1, 3450.0, 350.0)
+
+    portfolio.on_price('GOLDBEES', 55.0)
+    portfolio.on_price('NIFTYBEES', 210.0)
+    summary = portfolio.summary()
+    assert summary['priced'] == 2
+    assert summary['current_value'] == 15 * 210.0 + 100 * 55.0
+    assert summary['notional_pl'] == pytest.approx(15 * 210.0 + 100 * 55.0 - 8100.0)
+
+
+def test_unknown_symbols_and_empty_prices_are_ignored(portfolio):
+    portfolio.on_price('ITBEES', 40.0)
+    portfolio.on_price('GOLDBEES', None)
+    portfolio.on_price('GOLDBEES', 0)
+    assert portfolio.summary()['priced'] == 0
+
+
+def test_position_figures(portfolio):
+    portfolio.on_price('NIFTYBEES', 234.0)
+    position = portfolio.position('NIFTYBEES')
+    assert position['last_buy_price'] == 220.0
+    assert position['lifo_target_price'] == 233.2
+    assert position['lifo_sell_ready']
+    assert position['lifo_gains'] == 70.0
+    assert portfolio.valuation()['unpriced'] == ['GOLDBEES']
+
+
+def test_reload_keeps_prices_and_totals(portfolio):
+    portfolio.on_price('NIFTYBEES', 230.0)
+    portfolio.load(ledger(LOTS + [('NIFTYBEES', '2024-03-01', 225.0, 5)]))
+    summary = portfolio.summary()
+    assert summary['priced'] == 1
+    assert summary['current_value'] == 20 * 230.0
+    assert summary['notional_pl'] == pytest.approx(20 * 230.0 - (3100.0 + 1125.0))
+
+
+def test_ticks_during_reloads_keep_totals_consistent(portfolio):
+    book = ledger(LOTS)
+    stop = threading.Event()
+
+    def reload():
+        while not stop.is_set():
+            portfolio.load(book)
+
+    reloader = threading.Thread(target=reload)
+    reloader.start()
+    try:
+        for tick in range(2000):
+            portfolio.on_price('NIFTYBEES', 200.0 + tick % 7)
+            portfolio.on_price('GOLDBEES', 50.0 + tick % 3)
+    finally:
+        stop.set()
+        reloader.join()
+
+    valuation = portfolio.valuation()
+    expected = sum(item['total_qty'] * item['cmp'] for item in valuation['positions'] if item['cmp'])
+    assert valuation['summary']['current_value'] == pytest.approx(expected)
@@ -5,27 +5,160 @@ Provides REST API endpoints for React app to get live prices
 Enhanced with session persistence and management
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 import json
+import logging
 import os
+import time
 from datetime import datetime
 from price_fetcher import MStocksPriceFetcher
 from dma_calculator import DMACalculator
+from order_engine import BulkOrderEngine, normalize_order
+from basket_executor import BasketPipeline
+from risk_check import PreTradeRisk
+from portfolio_valuation import PortfolioValuation
+from startup import Lazy, Startup
+from circuit_breaker import CIRCUITS
+from order_state import OrderStateStore, OrderStream, TERMINAL_STATUSES, sse_events
+from structured_logging import get_logger, new_request_id
+from metrics import REGISTRY, CONTENT_TYPE, HTTP_LATENCY, HTTP_INFLIGHT
+from tracing import start_trace, finish_trace
+
+logger = get_logger('price_api_server')
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for React app
 
-# Global fetcher and DMA calculator instances
-fetcher = MStocksPriceFetcher()
-dma_calculator = DMACalculator()
+# Requests slower than this are logged at WARNING, everything else at DEBUG
+SLOW_REQUEST_MS = float(os.environ.get('ETF_LOG_SLOW_MS', '2000'))
+
+# Start-up work runs on a background thread (ETF_DEFERRED_START=0 runs it before serving)
+DEFERRED_START = os.environ.get('ETF_DEFERRED_START', '1') != '0'
+# Requests arriving during start-up wait at most this long for the session to be restored
+SESSION_WAIT_SECONDS = float(os.environ.get('ETF_SESSION_WAIT', '5'))
+
+# Global fetcher and DMA calculator instances; the session is restored by the start-up task
+fetcher = MStocksPriceFetcher(restore=False)
+dma_calculator = DMACalculator(price_fetcher=fetcher)
+# Broker margins come from MConnect via the basket pipeline's client
+risk = PreTradeRisk(fetcher, client_factory=lambda: basket_pipeline.client())
+order_engine = BulkOrderEngine(fetcher, risk=risk)
+order_store = OrderStateStore()
+order_store.add_listener(risk.funds.on_order_update)  # refresh cached funds after fills
+basket_pipeline = BasketPipeline(fetcher, order_engine)
+portfolio = PortfolioValuation()
+fetcher.add_price_listener(portfolio.on_price)  # every live price revalues its position
+
+# numpy-backed components are built on first use (or by the start-up task), importing their modules then
+def build_ranking():
+    from etf_ranking import RankingEngine
+    return RankingEngine(fetcher, dma_calculator, client_factory=lambda: basket_pipeline.client())
+
+def build_history_store():
+    from history_store import HistoryStore
+    return HistoryStore()
+
+def build_warmup():
+    """Pre-market: instrument master, yesterday's bars, DMA20 and price formats for the whole universe"""
+    from warmup import WarmupJob, WarmupScheduler
+    return WarmupScheduler(WarmupJob(fetcher, dma_calculator, ranking, history_store, portfolio, basket_pipeline))
+
+def build_eod():
+    """After the close: one batched OHLC pull, figures computed once into the day's snapshot file"""
+    from eod_snapshot import EODPipeline
+    pipeline = EODPipeline(history_store, client_factory=lambda: basket_pipeline.client(), portfolio=portfolio)
+    pipeline.load_latest()  # the last snapshot is memory-mapped and served by /api/snapshot
+    return pipeline
+
+ranking = Lazy(build_ranking, 'ranking')
+history_store = Lazy(build_history_store, 'history_store')
+# Fetched bars are kept here; they back the stale DMA20 estimate when history is unavailable
+dma_calculator.history_store = history_store
+warmup = Lazy(build_warmup, 'warmup')
+eod = Lazy(build_eod, 'eod')
+# Keeps the ranking index current between rankings (nothing to update before the first ranking)
+fetcher.add_price_listener(lambda symbol, price: ranking.built and ranking.index.on_price(symbol, price))
+
+def seed_order_store():
+    """Load the REST order book into the order store (start-up and stream reconnects)"""
+    result = fetcher.get_order_book()
+    if isinstance(result, dict) and isinstance(result.get('data'), list):
+        order_store.seed(result['data'])
+
+order_stream = OrderStream(order_store, on_reconnect=seed_order_store)
+
+def restore_session():
+    """Restore the shared session (a local read, no network)"""
+    if fetcher.restore_session():
+        logger.info("Session restored successfully")
+        return True
+    logger.info("No valid session found, ready for login")
+    return False
 
-# Try to restore existing session on startup
-print("🚀 Starting Flask API Server...")
-if fetcher.restore_session():
-    print("✅ Session restored successfully")
-else:
-    print("ℹ️ No valid session found, ready for login")
+def start_order_stream():
+    return order_stream.ensure(fetcher.api_key, fetcher.access_token) if fetcher.access_token else False
+
+def load_components():
+    """Build the lazy components and load the holdings book so first requests find them ready"""
+    for component in (ranking, history_store, eod):
+        component.get()
+    return {'holdings_loaded': portfolio.ensure_loaded(), 'snapshot': eod.snapshot is not None}
+
+logger.info("Starting Flask API Server")
+startup = Startup()
+startup.add('session', restore_session)
+startup.add('session_validation', lambda: fetcher.validate_session() if fetcher.access_token else None)
+startup.add('order_stream', start_order_stream)
+startup.add('components', load_components)
+startup.add('warmup_scheduler', lambda: warmup.start())
+
+def _endpoint_label():
+    """Route pattern (e.g. /api/price/<symbol>) so metrics labels stay low-cardinality"""
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+@app.before_request
+def start_request_log():
+    """Assign a request ID (honouring X-Request-ID) and start the request timer"""
+    request.environ['etf.request_id'] = new_request_id(request.headers.get('X-Request-ID'))
+    request.environ['etf.started'] = time.perf_counter()
+    HTTP_INFLIGHT.inc(endpoint=_endpoint_label())
+    # Per-request profiling: X-Profile: 1 header or ?profile=1 returns a timing breakdown
+    profile = (request.headers.get('X-Profile', '').lower() in ('1', 'true')
+               or request.args.get('profile', '').lower() in ('1', 'true'))
+    request.environ['etf.trace'] = start_trace(f"{request.method} {_endpoint_label()}", profile=profile)
+    if request.path != '/api/ready':
+        # Only the session is waited for; everything else is built on first use if still cold
+        startup.wait('session', SESSION_WAIT_SECONDS)
+
+@app.teardown_request
+def finish_inflight(exc=None):
+    if 'etf.started' in request.environ:
+        HTTP_INFLIGHT.dec(endpoint=_endpoint_label())
+
+@app.after_request
+def finish_request_log(response):
+    """Emit one JSON line per request with its duration"""
+    started = request.environ.get('etf.started')
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        HTTP_LATENCY.observe(elapsed, endpoint=_endpoint_label(), method=request.method,
+                             status=response.status_code)
+        duration_ms = round(elapsed * 1000, 2)
+        level = logging.WARNING if duration_ms >= SLOW_REQUEST_MS else logging.DEBUG
+        if logger.isEnabledFor(level):
+            logger.log(level, "%s %s", request.method, request.path, extra={
+                'status_code': response.status_code, 'duration_ms': duration_ms})
+    response.headers['X-Request-ID'] = request.environ.get('etf.request_id', '')
+    trace = request.environ.pop('etf.trace', None)
+    breakdown = finish_trace(trace)
+    if breakdown and trace.profiled:
+        response.headers['Server-Timing'] = f"total;dur={breakdown['total_ms']}"
+        body = response.get_json(silent=True) if response.is_json else None
+        if isinstance(body, dict):
+            body['timing'] = breakdown
+            response.set_data(json.dumps(body))
+    return response
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
@@ -40,9 +173,21 @@ def health_check():
     return jsonify({
         'status': 'success',
         'message': 'Price API Server is running',
-        'session': session_info
+        'session': session_info,
+        'upstream': {family: circuit.status() for family, circuit in CIRCUITS.items()}
     })
 
+@app.route('/api/ready', methods=['GET'])
+def readiness_check():
+    """Readiness probe: 200 once the start-up steps have run, 503 while the server is still warming"""
+    status = startup.status()
+    return jsonify({'status': 'success' if status['ready'] else 'starting', **status}), 200 if status['ready'] else 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape endpoint: upstream latency, fallbacks, caches, throttling, sessions"""
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
 @app.route('/api/session/status', methods=['GET'])
 def get_session_status():
     """Get detailed session status"""
@@ -143,10 +288,7 @@ def generate_session():
                 'message': 'API key, request_token (UGID), and OTP are required'
             }), 400
         
-        print(f"🔐 Generating session with:")
-        print(f"  API Key: {api_key[:20]}...")
-        print(f"  Request Token (UGID): {request_token[:20]}...")
-        print(f"  OTP: {otp}")
+        logger.info("Generating session", extra={'api_key': api_key[:6] + '...'})
         
         # Store API key in fetcher instance
         fetcher.api_key = api_key
@@ -155,6 +297,7 @@ def generate_session():
         result = fetcher.generate_session(api_key, otp, None)
         
         if result:
+            order_stream.ensure(fetcher.api_key, fetcher.access_token)
             return jsonify({
                 'status': 'success',
                 'message': 'Session generated successfully',
@@ -170,7 +313,7 @@ def generate_session():
             }), 500
             
     except Exception as e:
-        print(f"❌ Session generation error: {str(e)}")
+        logger.error("Session generation error: %s", e)
         return jsonify({
             'status': 'error',
             'message': f'Session generation failed: {str(e)}'
@@ -178,7 +321,7 @@ def generate_session():
 
 @app.route('/api/price/<symbol>', methods=['GET'])
 def get_price(symbol):
-    """Get live price for a single symbol with auto-session refresh"""
+    """Get live price for a single symbol with auto-session refresh (?hedge=1 races Type A and Type B)"""
     try:
         # Auto-refresh session if needed
         if not fetcher.auto_refresh_session():
@@ -187,7 +330,8 @@ def get_price(symbol):
                 'message': 'Session expired and auto-refresh failed. Please login again.'
             }), 401
         
-        result = fetcher.get_live_price(symbol)
+        hedge = request.args.get('hedge')
+        result = fetcher.get_live_price(symbol, hedge=None if hedge is None else hedge == '1')
         return jsonify(result)
         
     except Exception as e:
@@ -322,6 +466,160 @@ def get_multiple_dma20():
             'message': str(e)
         }), 500
 
+@app.route('/api/ranking', methods=['POST'])
+def get_ranking():
+    """Rank the ETF universe by % distance from DMA20 (one batched price call, cached DMA20)"""
+    try:
+        if not fetcher.access_token:
+            return jsonify({
+                'status': 'error',
+                'message': 'Not logged in. Please login first.'
+            }), 401
+        
+        data = request.get_json() or {}
+        symbols = data.get('symbols', [])
+        
+        if not symbols:
+            return jsonify({
+                'status': 'error',
+                'message': 'Symbols list is required'
+            }), 400
+        
+        result = ranking.rank(symbols, holdings=data.get('holdings'))
+        return jsonify(result)
+        
+    except Exception as e:
+        logger.error("Ranking error: %s", e)
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@app.route('/api/ranking/top', methods=['GET'])
+def get_ranking_top():
+    """Top-K most fallen ETFs from the live ranking index (?k=5, ?holdings=1 to include held ETFs)"""
+    try:
+        if not len(ranking.index):
+            return jsonify({
+                'status': 'error',
+                'message': 'Ranking index is empty. POST /api/ranking first.'
+            }), 404
+        
+        k = max(int(request.args.get('k', 5)), 1)
+        include_holdings = request.args.get('holdings') == '1'
+        return jsonify({
+            'status': 'success',
+            'results': ranking.index.top(k, include_holdings=include_holdings),
+            'ranked': len(ranking.index),
+            'updated_at': ranking.index.updated_at
+        })
+        
+    except ValueError:
+        return jsonify({
+            'status': 'error',
+            'message': 'k must be a whole number'
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@app.route('/api/ranking/<symbol>', methods=['GET'])
+def get_symbol_rank(symbol):
+    """Current rank of one ETF in the live ranking index"""
+    try:
+        result = ranking.index.rank_of(symbol)
+        if result is None:
+            return jsonify({
+                'status': 'error',
+                'message': f'{symbol} is not in the ranking index'
+            }), 404
+        
+        return jsonify({'status': 'success', 'data': result})
+        
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@app.route('/api/warmup', methods=['GET'])
+def get_warmup_status():
+    """Pre-market warmup schedule and the result of the last run"""
+    return jsonify({'status': 'success', **warmup.status()})
+
+@app.route('/api/warmup', methods=['POST'])
+def run_warmup():
+    """Start a warmup now (runs in the background; poll GET /api/warmup for the result)"""
+    try:
+        if not fetcher.access_token:
+            return jsonify({
+                'status': 'error',
+                'message': 'Not logged in. Please login first.'
+            }), 401
+        if warmup.running:
+            return jsonify({'status': 'error', 'message': 'Warmup already running'}), 409
+
+        warmup.trigger()
+        return jsonify({'status': 'success', 'message': 'Warmup started'}), 202
+
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Failed to start warmup: {str(e)}'
+        }), 500
+
+@app.route('/api/snapshot', methods=['GET'])
+def get_snapshot():
+    """Last end-of-day snapshot: ranked indicators and valuation (?symbol= one ETF, ?limit=N, ?reload=1)"""
+    try:
+        if request.args.get('reload') == '1':
+            eod.load_latest()
+        snapshot = eod.snapshot
+        if snapshot is None:
+            return jsonify({
+                'status': 'error',
+                'message': 'No end-of-day snapshot available yet'
+            }), 404
+
+        symbol = request.args.get('symbol')
+        if symbol:
+            record = snapshot.get(symbol)
+            if record is None:
+                return jsonify({'status': 'error', 'message': f'{symbol} is not in the snapshot'}), 404
+            return jsonify({'status': 'success', 'meta': snapshot.meta, 'data': record})
+        limit = request.args.get('limit', type=int)
+        return jsonify({'status': 'success', 'meta': snapshot.meta, 'results': snapshot.records(limit)})
+
+    except Exception as e:
+        logger.error("Snapshot read error: %s", e)
+        return jsonify({
+            'status': 'error',
+            'message': f'Snapshot read failed: {str(e)}'
+        }), 500
+
+@app.route('/api/eod/run', methods=['POST'])
+def run_eod():
+    """Fetch closing OHLC, recompute every figure and write today's snapshot (?force=1 before the close)"""
+    try:
+        if not fetcher.access_token:
+            return jsonify({
+                'status': 'error',
+                'message': 'Not logged in. Please login first.'
+            }), 401
+
+        data = request.get_json(silent=True) or {}
+        result = eod.run(data.get('symbols') or None, force=request.args.get('force') == '1')
+        return jsonify(result), 200 if result.get('status') in ('success', 'skipped') else 400
+
+    except Exception as e:
+        logger.error("EOD pipeline error: %s", e)
+        return jsonify({
+            'status': 'error',
+            'message': f'EOD pipeline failed: {str(e)}'
+        }), 500
+
 @app.route('/api/order/buy', methods=['POST'])
 def place_buy_order():
     """Place a buy order via MStocks API"""
@@ -333,7 +631,7 @@ def place_buy_order():
             }), 401
         
         data = request.get_json()
-        print(f"📋 Buy order request: {data}")
+        logger.info("Buy order request", extra={'order': data})
         
         # Extract order parameters
         symbol = data.get('symbol', '').replace('NSE:', '').replace('BSE:', '')
@@ -357,11 +655,11 @@ def place_buy_order():
             trigger_price=str(trigger_price)
         )
         
-        print(f"✅ Buy order result: {result}")
+        logger.info("Buy order result", extra={'result': result})
         return jsonify(result)
         
     except Exception as e:
-        print(f"❌ Buy order error: {str(e)}")
+        logger.error("Buy order error: %s", e)
         return jsonify({
             'status': 'error',
             'message': f'Buy order failed: {str(e)}'
@@ -378,7 +676,7 @@ def place_sell_order():
             }), 401
         
         data = request.get_json()
-        print(f"📋 Sell order request: {data}")
+        logger.info("Sell order request", extra={'order': data})
         
         # Extract order parameters
         symbol = data.get('symbol', '').replace('NSE:', '').replace('BSE:', '')
@@ -402,16 +700,49 @@ def place_sell_order():
             trigger_price=str(trigger_price)
         )
         
-        print(f"✅ Sell order result: {result}")
+        logger.info("Sell order result", extra={'result': result})
         return jsonify(result)
         
     except Exception as e:
-        print(f"❌ Sell order error: {str(e)}")
+        logger.error("Sell order error: %s", e)
         return jsonify({
             'status': 'error',
             'message': f'Sell order failed: {str(e)}'
         }), 500
 
+@app.route('/api/orders/bulk', methods=['POST'])
+def place_bulk_orders():
+    """Validate and place a list of orders concurrently, returning one consolidated result"""
+    try:
+        if not fetcher.access_token:
+            return jsonify({
+                'status': 'error',
+                'message': 'Not logged in. Please login first.'
+            }), 401
+        
+        data = request.get_json() or {}
+        orders = data.get('orders', [])
+        logger.info("Bulk order request", extra={'orders': len(orders)})
+        
+        result = order_engine.submit(
+            orders,
+            batch_id=data.get('batch_id') or request.headers.get('Idempotency-Key'),
+            sells_first=data.get('sells_first', True),
+            wait_seconds=min(float(data.get('wait_seconds', 0)), 60),
+            precheck=data.get('precheck', True)
+        )
+        
+        if result['status'] == 'error' and 'summary' not in result:
+            return jsonify(result), 400
+        return jsonify(result)
+        
+    except Exception as e:
+        logger.error("Bulk order error: %s", e)
+        return jsonify({
+            'status': 'error',
+            'message': f'Bulk order failed: {str(e)}'
+        }), 500
+
 @app.route('/api/orders', methods=['GET'])
 def get_orders():
     """Get today's orders"""
@@ -422,7 +753,13 @@ def get_orders():
                 'message': 'Not logged in. Please login first.'
             }), 401
         
+        if order_stream.live:
+            return jsonify({'status': 'success', 'data': order_store.snapshot(), 'source': 'stream'})
+        
         result = fetcher.get_order_book()
+        if isinstance(result, dict) and isinstance(result.get('data'), list):
+            order_store.seed(result['data'])
+        order_stream.ensure(fetcher.api_key, fetcher.access_token)
         return jsonify(result)
         
     except Exception as e:
@@ -431,6 +768,119 @@ def get_orders():
             'message': f'Failed to get orders: {str(e)}'
         }), 500
 
+@app.route('/api/orders/precheck', methods=['POST'])
+def precheck_orders():
+    """Check a whole order list against available cash without placing anything"""
+    try:
+        if not fetcher.access_token:
+            return jsonify({
+                'status': 'error',
+                'message': 'Not logged in. Please login first.'
+            }), 401
+        
+        data = request.get_json() or {}
+        normalized, errors = [], []
+        for index, order in enumerate(data.get('orders') or []):
+            item, error = normalize_order(order)
+            if error:
+                errors.append({'index': index, 'message': error})
+            else:
+                normalized.append(item)
+        if errors or not normalized:
+            return jsonify({'status': 'error', 'message': 'Order validation failed', 'errors': errors}), 400
+        
+        return jsonify(risk.check(normalized))
+        
+    except Exception as e:
+        logger.error("Pre-trade check error: %s", e)
+        return jsonify({
+            'status': 'error',
+            'message': f'Pre-trade check failed: {str(e)}'
+        }), 500
+
+@app.route('/api/basket/execute', methods=['POST'])
+def execute_basket():
+    """Net the day's buy/sell decisions into one basket, compute its margin and place it"""
+    try:
+        if not fetcher.access_token:
+            return jsonify({
+                'status': 'error',
+                'message': 'Not logged in. Please login first.'
+            }), 401
+        
+        data = request.get_json() or {}
+        logger.info("Basket request", extra={'buys': len(data.get('buy') or []), 'sells': len(data.get('sell') or [])})
+        
+        result = basket_pipeline.execute(
+            {'buy': data.get('buy'), 'sell': data.get('sell')},
+            place=data.get('place', True),
+            name=data.get('name'),
+            wait_seconds=min(float(data.get('wait_seconds', 0)), 60),
+            run_id=data.get('run_id')
+        )
+        return jsonify(result)
+        
+    except Exception as e:
+        logger.error("Basket execution error: %s", e)
+        return jsonify({
+            'status': 'error',
+            'message': f'Basket execution failed: {str(e)}'
+        }), 500
+
+@app.route('/api/portfolio', methods=['GET'])
+def get_portfolio():
+    """Current portfolio valuation (?refresh=1 re-fetches every held price first, ?reload=1 re-reads the book)"""
+    try:
+        if request.args.get('reload') == '1':
+            portfolio.load()
+        if not portfolio.ensure_loaded():
+            return jsonify({
+                'status': 'error',
+                'message': f'Holdings book unavailable: {portfolio.error}'
+            }), 404
+
+        if request.args.get('refresh') == '1':
+            if not fetcher.access_token:
+                return jsonify({
+                    'status': 'error',
+                    'message': 'Not logged in. Please login first.'
+                }), 401
+            fetcher.get_multiple_prices(portfolio.symbols())
+
+        symbol = request.args.get('symbol')
+        if symbol:
+            position = portfolio.position(symbol)
+            if position is None:
+                return jsonify({'status': 'error', 'message': f'{symbol} is not held'}), 404
+            return jsonify({'status': 'success', 'data': position})
+        return jsonify({'status': 'success', **portfolio.valuation()})
+
+    except Exception as e:
+        logger.error("Portfolio valuation error: %s", e)
+        return jsonify({
+            'status': 'error',
+            'message': f'Portfolio valuation failed: {str(e)}'
+        }), 500
+
+@app.route('/api/orders/stream', methods=['GET'])
+def stream_orders():
+    """Server-sent events with every order state change (resume with Last-Event-ID or ?since=)"""
+    if not fetcher.access_token:
+        return jsonify({
+            'status': 'error',
+            'message': 'Not logged in. Please login first.'
+        }), 401
+    
+    since = request.headers.get('Last-Event-ID') or request.args.get('since') or order_store.seq
+    try:
+        since = int(since)
+    except ValueError:
+        since = order_store.seq
+    order_stream.ensure(fetcher.api_key, fetcher.access_token)
+    # The feed stops at logout instead of outliving the session
+    return Response(sse_events(order_store, since, active=lambda: bool(fetcher.access_token)),
+                    mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/order/status/<order_id>', methods=['GET'])
 def get_order_status(order_id):
     """Get order status by order ID"""
@@ -441,6 +891,11 @@ def get_order_status(order_id):
                 'message': 'Not logged in. Please login first.'
             }), 401
         
+        # Streamed state is authoritative while the stream is live; final states never change
+        order = order_store.get(order_id)
+        if order and (order_stream.live or order.get('status') in TERMINAL_STATUSES):
+            return jsonify({'status': 'success', 'data': order, 'source': 'stream'})
+        
         result = fetcher.get_order_details(order_id, 'NSE')
         return jsonify(result)
         
@@ -469,6 +924,9 @@ def cancel_order(order_id):
             'message': f'Failed to cancel order: {str(e)}'
         }), 500
 
+# Started once every route is registered, so the import itself never waits on start-up work
+startup.start(background=DEFERRED_START)
+
 if __name__ == '__main__':
     print("🚀 Starting Price API Server...")
     print("📡 Server will be available at: http://localhost:5000")
@@ -6,16 +6,42 @@ Enhanced with session persistence for all-day login
 """
 
 import requests
+import contextvars
 import json
 import hashlib
 import time
 import os
-import pickle
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
+
+from session_store import SessionStore
+from structured_logging import get_logger
+from tracing import span
+from rate_limiter import limited_call
+from circuit_breaker import CIRCUITS, upstream_failed
+from metrics import (symbol_format_label, SYMBOL_FORMAT_RESOLVED, SYMBOL_FORMAT_EXHAUSTED,
+                     LIVE_PRICE_SOURCE, CACHE_REQUESTS, SESSION_REVALIDATIONS, HEDGED_QUOTES)
+
+logger = get_logger('price_fetcher')
+
+# One pool per process for hedged quotes, created by the first hedged call
+_hedge_pool = None
+_hedge_pool_lock = threading.Lock()
+
+
+def _hedge_executor() -> ThreadPoolExecutor:
+    global _hedge_pool
+    with _hedge_pool_lock:
+        if _hedge_pool is None:
+            _hedge_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='hedge')
+        return _hedge_pool
 
 class MStocksPriceFetcher:
-    def __init__(self):
+    def __init__(self, restore: bool = True):
+        """restore: load the shared session now (False leaves it to the caller, e.g. a background start-up)"""
         self.base_url = "https://api.mstock.trade/openapi/typea"  # Keep Type A for login/session
         self.typeb_base_url = "https://api.mstock.trade/openapi/typeb"  # Type B for market data
         self.access_token = None
@@ -23,14 +49,26 @@ class MStocksPriceFetcher:
         self.token_expiry = None
         self.username = None
         self.password = None
-        self.session_file = "mstocks_session.pkl"
+        self.session_file = os.environ.get('MSTOCKS_SESSION_DB', 'mstocks_session.db')
+        self.session_store = SessionStore(self.session_file)
+        self.session_version = 0  # Version of the shared session this instance holds
         self.session_duration = timedelta(hours=24)  # Session valid for 24 hours
+        self.validation_ttl = timedelta(minutes=5)  # Skip re-validation if any worker validated recently
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._price_listeners = []
+        self._typea_formats: Dict[str, str] = {}  # symbol -> Type A format that last returned a price
+        # Hedged quotes: race Type A against a Type B quote that is slower than hedge_delay
+        self.hedge_quotes = os.environ.get('ETF_HEDGE_QUOTES', '0') == '1'
+        self.hedge_delay = float(os.environ.get('ETF_HEDGE_DELAY_MS', '300')) / 1000
         
         # Try to restore session on startup
-        self.restore_session()
+        if restore:
+            self.restore_session()
+        # Reload as soon as another worker refreshes or clears the shared session
+        self.session_store.add_listener(self._on_session_change)
         
     def save_session(self):
-        """Save session data to file"""
+        """Publish session data to the shared session store"""
         try:
             session_data = {
                 'access_token': self.access_token,
@@ -41,25 +79,24 @@ class MStocksPriceFetcher:
                 'saved_at': datetime.now()
             }
             
-            with open(self.session_file, 'wb') as f:
-                pickle.dump(session_data, f)
+            self.session_version = self.session_store.save(session_data)
             
-            print(f"💾 Session saved to {self.session_file}")
+            logger.info("Session saved to %s (version %s)", self.session_file, self.session_version)
             return True
         except Exception as e:
-            print(f"❌ Failed to save session: {str(e)}")
+            logger.error("Failed to save session: %s", e)
             return False
     
     def restore_session(self):
-        """Restore session data from file"""
+        """Restore session data from the shared session store"""
         try:
-            if not os.path.exists(self.session_file):
-                print("📁 No saved session found")
+            session_data, version = self.session_store.load()
+            if not session_data:
+                logger.info("No saved session found")
+                self._reset_session_fields()
+                self.session_version = version
                 return False
             
-            with open(self.session_file, 'rb') as f:
-                session_data = pickle.load(f)
-            
             # Check if session is still valid
             saved_at = session_data.get('saved_at')
             if saved_at and datetime.now() - saved_at < self.session_duration:
@@ -68,47 +105,79 @@ class MStocksPriceFetcher:
                 self.username = session_data.get('username')
                 self.password = session_data.get('password')
                 self.token_expiry = session_data.get('token_expiry')
+                self.session_version = version
                 
-                print(f"✅ Session restored from {self.session_file}")
-                print(f"🔐 Logged in as: {self.username}")
-                print(f"⏰ Session expires: {self.token_expiry}")
+                logger.info("Session restored from %s (version %s)", self.session_file, version,
+                            extra={'username': self.username, 'session_expires': self.token_expiry})
                 return True
             else:
-                print("⏰ Saved session has expired, removing old session file")
-                self.clear_session()
+                logger.info("Saved session has expired, removing it from the session store")
+                self.session_version = version
+                self.clear_session(expected_version=version)
                 return False
                 
         except Exception as e:
-            print(f"❌ Failed to restore session: {str(e)}")
-            self.clear_session()
+            logger.error("Failed to restore session: %s", e)
             return False
     
-    def clear_session(self):
-        """Clear session data and remove session file"""
+    def sync_session(self) -> bool:
+        """Pick up a session saved or cleared by another worker (one local read, no network)"""
+        try:
+            if self.session_store.has_changed(self.session_version):
+                logger.info("Shared session changed, reloading")
+                return self.restore_session()
+        except Exception as e:
+            logger.warning("Failed to check shared session: %s", e)
+        return self.access_token is not None
+    
+    def _on_session_change(self, version: int):
+        """Session store listener: another worker saved or cleared the shared session"""
+        if version != self.session_version:
+            self.sync_session()
+    
+    def _reset_session_fields(self):
         self.access_token = None
         self.api_key = None
         self.username = None
         self.password = None
         self.token_expiry = None
+    
+    def clear_session(self, expected_version: Optional[int] = None):
+        """
+        Clear session data and remove it from the shared store.
+        With expected_version set, a newer session saved by another worker is kept.
+        """
+        self._reset_session_fields()
         
         try:
-            if os.path.exists(self.session_file):
-                os.remove(self.session_file)
-                print(f"🗑️ Removed old session file: {self.session_file}")
+            if self.session_store.clear(expected_version):
+                logger.info("Removed session from %s", self.session_file)
+                self.session_version = self.session_store.version()
+            elif expected_version is not None:
+                # Another worker already published a newer session, adopt it instead
+                self.restore_session()
         except Exception as e:
-            print(f"⚠️ Failed to remove session file: {str(e)}")
+            logger.warning("Failed to clear shared session: %s", e)
     
     def validate_session(self) -> bool:
         """Validate if current session is still valid"""
+        self.sync_session()
+        
         if not self.access_token:
             return False
         
         # Check if token has expired
         if self.token_expiry and datetime.now() > self.token_expiry:
-            print("⏰ Session token has expired")
-            self.clear_session()
+            logger.info("Session token has expired")
+            self.clear_session(expected_version=self.session_version)
             return False
         
+        # Another worker already validated this exact session recently
+        if self.session_store.validated_within(self.session_version, self.validation_ttl.total_seconds()):
+            CACHE_REQUESTS.inc(cache='session_validation', result='hit')
+            return True
+        CACHE_REQUESTS.inc(cache='session_validation', result='miss')
+        
         # Try to make a simple API call to validate session (without triggering auto-refresh)
         try:
             headers = {
@@ -120,29 +189,28 @@ class MStocksPriceFetcher:
             # Use the LTP endpoint to test session validity (same as working script)
             test_url = f"{self.base_url}/instruments/quote/ltp?i=NSE:NIFTYBEES-EQ"
             
-            response = requests.get(test_url, headers=headers, timeout=5)
+            response = limited_call('validate_session', requests.get, test_url, headers=headers, timeout=5)
+            SESSION_REVALIDATIONS.inc(result=response.status_code)
             
             if response.status_code == 200:
-                print("✅ Session is valid")
+                logger.debug("Session is valid")
+                self.session_store.mark_validated(self.session_version)
                 return True
             elif response.status_code == 401:
-                print("❌ Session validation failed - Unauthorized")
-                self.clear_session()
+                logger.warning("Session validation failed - Unauthorized")
+                # Only drop the session we validated; a newer one from another worker survives
+                self.clear_session(expected_version=self.session_version)
                 return False
             elif response.status_code == 403:
-                print("⚠️ Session validation failed - Forbidden (might be temporary)")
+                logger.warning("Session validation failed - Forbidden (might be temporary)")
                 # Don't clear session for 403 errors immediately, might be temporary
                 return False
             else:
-                print(f"❌ Session validation failed - Status: {response.status_code}")
-                # Don't clear session for 404 errors (symbol not found is okay)
-                if response.status_code != 404:
-                    # Only clear session for 5xx errors, not 4xx errors
-                    if response.status_code >= 500:
-                        self.clear_session()
+                # 404 (symbol not found) and 5xx (broker outage) are transient, keep the shared session
+                logger.warning("Session validation failed - Status: %s", response.status_code)
                 return False
         except Exception as e:
-            print(f"❌ Session validation error: {str(e)}")
+            logger.warning("Session validation error: %s", e)
             # Don't clear session on network errors
             return False
     
@@ -151,43 +219,52 @@ class MStocksPriceFetcher:
         if self.validate_session():
             return True
         
-        print("🔄 Session validation failed, but continuing with saved session...")
+        logger.debug("Session validation failed, continuing with saved session")
         # If we have a saved session, try to use it even if validation fails
         # This allows the session to be used for price fetching
         if self.access_token and self.api_key:
-            print("✅ Using saved session for price fetching")
             return True
         
-        print("❌ No valid session available")
+        logger.warning("No valid session available")
         return False
     
     def auto_login(self) -> bool:
-        """Automatically login using saved credentials"""
+        """Automatically login using saved credentials; only one worker logs in at a time"""
+        known_version = self.session_version
+        if not self.session_store.acquire_refresh_lock(self.worker_id):
+            # Another worker is refreshing, wait for it to publish the new session
+            logger.info("Another worker is refreshing the session, waiting")
+            if self.session_store.wait_for_change(known_version):
+                return self.restore_session()
+            return False
+        
         try:
-            print(f"🔄 Auto-login with saved credentials for: {self.username}")
+            # Someone may have refreshed between our failure and taking the lock
+            if self.session_store.has_changed(known_version) and self.restore_session():
+                return True
+            
+            logger.info("Auto-login with saved credentials", extra={'username': self.username})
             
             # Step 1: Login
             login_result = self.login(self.username, self.password)
             if login_result.get('status') != 'success':
-                print("❌ Auto-login failed at step 1")
+                logger.warning("Auto-login failed at step 1")
                 return False
             
             # Step 2: Generate session (without OTP for auto-login)
             if self.api_key and login_result.get('data', {}).get('request_token'):
-                session_result = self.generate_session(
-                    self.api_key, 
-                    login_result['data']['request_token']
-                )
-                if session_result.get('status') == 'success':
-                    print("✅ Auto-login successful")
+                if self.generate_session(self.api_key, login_result['data']['request_token'], None):
+                    logger.info("Auto-login successful")
                     return True
             
-            print("❌ Auto-login failed at step 2")
+            logger.warning("Auto-login failed at step 2")
             return False
             
         except Exception as e:
-            print(f"❌ Auto-login error: {str(e)}")
+            logger.error("Auto-login error: %s", e)
             return False
+        finally:
+            self.session_store.release_refresh_lock(self.worker_id)
         
     def login(self, username: str, password: str) -> Dict:
         """Step 1: Login with username and password"""
@@ -202,13 +279,12 @@ class MStocksPriceFetcher:
                 'password': password
             }
             
-            print(f"🔐 Logging in with username: {username}")
-            response = requests.post(url, headers=headers, data=data, timeout=30)
+            logger.info("Logging in", extra={'username': username})
+            response = limited_call('login', requests.post, url, headers=headers, data=data, timeout=30)
             
             if response.status_code == 200:
                 result = response.json()
-                print(f"✅ Login successful: {result.get('status', 'Unknown')}")
-                print(f"🔍 Full login response: {result}")
+                logger.info("Login response: %s", result.get('status', 'Unknown'))
                 
                 # Store credentials for session persistence
                 self.username = username
@@ -216,11 +292,11 @@ class MStocksPriceFetcher:
                 
                 return result
             else:
-                print(f"❌ Login failed: {response.status_code} - {response.text}")
+                logger.warning("Login failed: %s", response.status_code, extra={'body': response.text[:200]})
                 return {'status': 'error', 'message': f'Login failed: {response.status_code}'}
                 
         except Exception as e:
-            print(f"❌ Login failed: {str(e)}")
+            logger.error("Login failed: %s", e)
             return {'status': 'error', 'message': str(e)}
     
     def generate_session(self, api_key, request_token, otp):
@@ -229,9 +305,7 @@ class MStocksPriceFetcher:
         Based on official MStocks API documentation
         """
         try:
-            print(f"🔐 Generating session with API key and OTP...")
-            print(f"API Key: {api_key[:20]}...")
-            print(f"Request Token (OTP): {request_token}")
+            logger.info("Generating session", extra={'api_key': api_key[:6] + '...'})
             
             # According to official docs: request_token should be the OTP
             payload = {
@@ -240,7 +314,9 @@ class MStocksPriceFetcher:
                 'checksum': 'L'  # Default checksum as per documentation
             }
             
-            response = requests.post(
+            response = limited_call(
+                'session_token',
+                requests.post,
                 f'{self.base_url}/session/token',
                 headers={
                     'X-Mirae-Version': '1',
@@ -250,11 +326,10 @@ class MStocksPriceFetcher:
                 timeout=30
             )
             
-            print(f"📡 Session generation response status: {response.status_code}")
+            logger.debug("Session generation response status: %s", response.status_code)
             
             if response.status_code == 200:
                 data = response.json()
-                print(f"📊 Session response: {json.dumps(data, indent=2)}")
                 
                 if data.get('status') == 'success':
                     self.access_token = data['data']['access_token']
@@ -262,96 +337,180 @@ class MStocksPriceFetcher:
                     self.enctoken = data['data'].get('enctoken', '')
                     self.refresh_token = data['data'].get('refresh_token', '')
                     
-                    print(f"✅ Session generated successfully!")
-                    print(f"Access Token: {self.access_token[:20]}...")
-                    print(f"API Key: {self.api_key[:20]}...")
-                    print(f"Enc Token: {self.enctoken[:20] if self.enctoken else 'None'}...")
+                    logger.info("Session generated successfully")
                     
                     # Save session for persistence
                     self.save_session()
                     return True
                 else:
-                    print(f"❌ Session generation failed: {data.get('message', 'Unknown error')}")
+                    logger.warning("Session generation failed: %s", data.get('message', 'Unknown error'))
                     return False
             else:
-                print(f"❌ Session generation failed with status {response.status_code}")
-                print(f"Response: {response.text}")
+                logger.warning("Session generation failed with status %s", response.status_code,
+                               extra={'body': response.text[:200]})
                 return False
                 
         except Exception as e:
-            print(f"❌ Session generation error: {str(e)}")
+            logger.error("Session generation error: %s", e)
             return False
     
-    def get_live_price(self, symbol: str) -> Dict:
-        """Get live price for a symbol with session validation using Type B API"""
+    def add_price_listener(self, callback):
+        """Call `callback(symbol, price)` for every live price fetched"""
+        self._price_listeners.append(callback)
+
+    def publish_price(self, symbol: str, price: float):
+        for callback in self._price_listeners:
+            try:
+                callback(symbol, price)
+            except Exception as e:
+                logger.warning("Price listener failed: %s", e, extra={'symbol': symbol})
+
+    def get_live_price(self, symbol: str, hedge: Optional[bool] = None) -> Dict:
+        """
+        Get live price for a symbol with session validation: Type B API first, Type A as fallback.
+        A family whose circuit is open is skipped; hedge (default ETF_HEDGE_QUOTES) races Type A
+        against a Type B quote that has not answered within hedge_delay.
+        """
         # Auto-refresh session if needed
-        if not self.auto_refresh_session():
+        with span('price.session_validation'):
+            session_ok = self.auto_refresh_session()
+        if not session_ok:
             return {'status': 'error', 'message': 'Session expired and auto-refresh failed. Please login again.'}
         
+        started = time.perf_counter()
         try:
-            # Clean symbol
-            clean_symbol = symbol.replace('NSE:', '').replace('BSE:', '')
-            
-            # Use Type B API as per official documentation
-            headers = {
-                'X-Mirae-Version': '1',
-                'Authorization': f'Bearer {self.access_token}',  # Type B uses Bearer token
-                'X-PrivateKey': self.api_key,
-                'Content-Type': 'application/json'
-            }
-            
-            # Try different symbol formats for Type B API
-            symbol_formats = [
-                f"NSE:{clean_symbol}-EQ",
-                f"NSE:{clean_symbol}",
-                clean_symbol,
-                f"{clean_symbol}-EQ"
-            ]
-            
-            for symbol_format in symbol_formats:
-                try:
-                    # Use Type B API endpoint as per official docs
-                    url = f"{self.typeb_base_url}/instruments/quote"
-                    
-                    # Prepare payload as per Type B API documentation
-                    payload = {
-                        "mode": "LTP",  # Use LTP mode for live price
-                        "exchangeTokens": {
-                            "NSE": [clean_symbol]  # We'll need to get the actual token
-                        }
-                    }
-                    
-                    print(f"🔍 Trying Type B API for symbol: {symbol_format}")
-                    response = requests.get(url, headers=headers, json=payload, timeout=10)
-                    
-                    if response.status_code == 200:
-                        data = response.json()
-                        price = self._extract_price_typeb(data, clean_symbol)
-                        
-                        if price is not None:
-                            return {
-                                'status': 'success',
-                                'price': price,
-                                'symbol': symbol,
-                                'source': 'MStocks Type B API',
-                                'timestamp': datetime.now().isoformat()
-                            }
-                    else:
-                        print(f"❌ Type B API failed for {symbol_format}: {response.status_code}")
-                        print(f"Response: {response.text}")
-                        
-                except Exception as e:
-                    print(f"❌ Error with Type B API for {symbol_format}: {str(e)}")
-                    continue
+            hedge = self.hedge_quotes if hedge is None else hedge
+            if hedge and CIRCUITS['typeb'].closed and CIRCUITS['typea'].closed:
+                source, result = self._hedged_live_price(symbol)
+            else:
+                source, result = self._live_price_chain(symbol)
             
-            # Fallback to Type A API if Type B fails
-            print("🔄 Falling back to Type A API...")
-            return self._get_live_price_typea(symbol)
+            if result.get('status') != 'success':
+                LIVE_PRICE_SOURCE.inc(source='error')
+                return result
+            LIVE_PRICE_SOURCE.inc(source=source)
+            logger.debug("Live price", extra={
+                'symbol': symbol, 'source': source, 'duration_ms': round((time.perf_counter() - started) * 1000, 2)})
+            self.publish_price(symbol, result['price'])
+            return result
             
         except Exception as e:
-            print(f"❌ Get live price error: {str(e)}")
+            LIVE_PRICE_SOURCE.inc(source='error')
+            logger.error("Get live price error: %s", e, extra={'symbol': symbol})
             return {'status': 'error', 'message': str(e)}
     
+    def _live_price_chain(self, symbol: str) -> Tuple[str, Dict]:
+        """Type B, then Type A; families with an open circuit are skipped. Returns (source, result)"""
+        if CIRCUITS['typeb'].allow():
+            result = self._get_live_price_typeb(symbol)
+            if result is not None:
+                return 'typeb', result
+            logger.debug("Falling back to Type A API", extra={'symbol': symbol})
+        else:
+            logger.debug("Type B circuit open, using Type A API", extra={'symbol': symbol})
+        
+        if not CIRCUITS['typea'].allow():
+            return 'error', {'status': 'error', 'symbol': symbol,
+                             'message': 'Broker quote APIs are unavailable (circuit open), retry shortly'}
+        with span('price.typea_fallback'):
+            return 'typea', self._get_live_price_typea(symbol)
+    
+    def _hedged_live_price(self, symbol: str) -> Tuple[str, Dict]:
+        """Type B first; if it has no price within hedge_delay, Type A races it and the first price wins"""
+        pool = _hedge_executor()
+        
+        def submit(function):
+            # Each task runs in a copy of the request context so its spans join the request trace
+            return pool.submit(contextvars.copy_context().run, function, symbol)
+        
+        pending = {submit(self._get_live_price_typeb): 'typeb'}
+        done, _ = wait(pending, timeout=self.hedge_delay)
+        for future in done:
+            if future.result() is not None:
+                HEDGED_QUOTES.inc(winner='primary')
+                return 'typeb', future.result()
+        
+        pending[submit(self._get_live_price_typea)] = 'typea'
+        for future in as_completed(pending):
+            result = future.result()
+            if result is not None and result.get('status') == 'success':
+                HEDGED_QUOTES.inc(winner='primary' if pending[future] == 'typeb' else 'hedge')
+                return pending[future], result
+        HEDGED_QUOTES.inc(winner='error')
+        return 'error', {'status': 'error', 'message': f'Price not found for {symbol}', 'symbol': symbol}
+    
+    def _get_live_price_typeb(self, symbol: str) -> Optional[Dict]:
+        """Type B quote; None when it has no price. Upstream failures count against the Type B circuit"""
+        # Clean symbol
+        clean_symbol = symbol.replace('NSE:', '').replace('BSE:', '')
+        
+        # Use Type B API as per official documentation
+        headers = {
+            'X-Mirae-Version': '1',
+            'Authorization': f'Bearer {self.access_token}',  # Type B uses Bearer token
+            'X-PrivateKey': self.api_key,
+            'Content-Type': 'application/json'
+        }
+        
+        # Try different symbol formats for Type B API
+        symbol_formats = [
+            f"NSE:{clean_symbol}-EQ",
+            f"NSE:{clean_symbol}",
+            clean_symbol,
+            f"{clean_symbol}-EQ"
+        ]
+        
+        for symbol_format in symbol_formats:
+            try:
+                # Use Type B API endpoint as per official docs
+                url = f"{self.typeb_base_url}/instruments/quote"
+                
+                # Prepare payload as per Type B API documentation
+                payload = {
+                    "mode": "LTP",  # Use LTP mode for live price
+                    "exchangeTokens": {
+                        "NSE": [clean_symbol]  # We'll need to get the actual token
+                    }
+                }
+                
+                logger.debug("Trying Type B API", extra={'symbol_format': symbol_format})
+                with span('price.typeb_attempt', symbol_format=symbol_format):
+                    response = limited_call('typeb_quote', requests.get, url, headers=headers, json=payload, timeout=10)
+            except Exception as e:
+                # Timeout or connection error: the other formats would hit the same failing API
+                CIRCUITS['typeb'].record(None)
+                logger.debug("Error with Type B API for %s: %s", symbol_format, e)
+                return None
+            
+            CIRCUITS['typeb'].record(response.status_code)
+            if upstream_failed(response.status_code):
+                logger.debug("Type B API failed", extra={'symbol_format': symbol_format,
+                                                         'status_code': response.status_code})
+                return None
+            if response.status_code == 200:
+                try:
+                    price = self._extract_price_typeb(response.json(), clean_symbol)
+                except ValueError as e:
+                    logger.debug("Invalid Type B response for %s: %s", symbol_format, e)
+                    continue
+                
+                if price is not None:
+                    SYMBOL_FORMAT_RESOLVED.inc(route='typeb_quote',
+                                               format=symbol_format_label(symbol_format, clean_symbol))
+                    return {
+                        'status': 'success',
+                        'price': price,
+                        'symbol': symbol,
+                        'source': 'MStocks Type B API',
+                        'timestamp': datetime.now().isoformat()
+                    }
+            else:
+                logger.debug("Type B API failed", extra={'symbol_format': symbol_format,
+                                                         'status_code': response.status_code})
+        
+        SYMBOL_FORMAT_EXHAUSTED.inc(route='typeb_quote')
+        return None
+    
     def _extract_price_typeb(self, data: Dict, clean_symbol: str) -> Optional[float]:
         """Extract price from Type B API response"""
         try:
@@ -362,14 +521,14 @@ class MStocksPriceFetcher:
                     if item.get('exchange') == 'NSE' and item.get('tradingSymbol', '').startswith(clean_symbol):
                         price = float(item.get('ltp', 0))
                         if price > 0:
-                            print(f"💰 Found Type B price for {clean_symbol}: {price}")
+                            logger.debug("Found Type B price", extra={'symbol': clean_symbol, 'price': price})
                             return price
             
-            print(f"❌ No valid Type B price found in response")
+            logger.debug("No valid Type B price found in response")
             return None
             
         except Exception as e:
-            print(f"❌ Type B price extraction error: {str(e)}")
+            logger.warning("Type B price extraction error: %s", e)
             return None
     
     def _extract_price(self, data: Dict, symbol_format: str, clean_symbol: str) -> Optional[float]:
@@ -386,14 +545,14 @@ class MStocksPriceFetcher:
                             item = data_content[symbol_key]
                             if isinstance(item, dict) and 'last_price' in item:
                                 price = float(item['last_price'])
-                                print(f"💰 Found Type A price in {symbol_key}.last_price: {price}")
+                                logger.debug("Found Type A price", extra={'symbol_key': symbol_key, 'price': price})
                                 return price
             
-            print(f"❌ No valid Type A price found in response")
+            logger.debug("No valid Type A price found in response")
             return None
             
         except Exception as e:
-            print(f"❌ Type A price extraction error: {str(e)}")
+            logger.warning("Type A price extraction error: %s", e)
             return None
     
     def _get_live_price_typea(self, symbol: str) -> Dict:
@@ -409,6 +568,11 @@ class MStocksPriceFetcher:
                 clean_symbol,
                 f"{clean_symbol}-EQ"
             ]
+            # Try the format that worked last time first
+            known = self._typea_formats.get(clean_symbol)
+            if known in symbol_formats:
+                symbol_formats.remove(known)
+                symbol_formats.insert(0, known)
             
             headers = {
                 'X-Mirae-Version': '1',
@@ -421,14 +585,23 @@ class MStocksPriceFetcher:
                     # Use the LTP endpoint from working script
                     url = f"{self.base_url}/instruments/quote/ltp?i={symbol_format}"
                     
-                    print(f"🔍 Trying Type A symbol format: {symbol_format}")
-                    response = requests.get(url, headers=headers, timeout=10)
+                    logger.debug("Trying Type A API", extra={'symbol_format': symbol_format})
+                    with span('price.typea_attempt', symbol_format=symbol_format):
+                        response = limited_call('typea_ltp', requests.get, url, headers=headers, timeout=10)
                     
+                    CIRCUITS['typea'].record(response.status_code)
+                    if upstream_failed(response.status_code):
+                        # The API itself is failing: other formats and the search would too
+                        return {'status': 'error', 'message': f'Type A API failed ({response.status_code})',
+                                'symbol': symbol}
                     if response.status_code == 200:
                         data = response.json()
                         price = self._extract_price(data, symbol_format, clean_symbol)
                         
                         if price is not None:
+                            self._typea_formats[clean_symbol] = symbol_format
+                            SYMBOL_FORMAT_RESOLVED.inc(route='typea_ltp',
+                                                       format=symbol_format_label(symbol_format, clean_symbol))
                             return {
                                 'status': 'success',
                                 'price': price,
@@ -437,26 +610,32 @@ class MStocksPriceFetcher:
                                 'timestamp': datetime.now().isoformat()
                             }
                     else:
-                        print(f"❌ Type A failed for {symbol_format}: {response.status_code}")
+                        logger.debug("Type A API failed", extra={'symbol_format': symbol_format, 'status_code': response.status_code})
                         
+                except requests.RequestException as e:
+                    CIRCUITS['typea'].record(None)
+                    logger.debug("Error with Type A for %s: %s", symbol_format, e)
+                    return {'status': 'error', 'message': f'Type A API unavailable: {e}', 'symbol': symbol}
                 except Exception as e:
-                    print(f"❌ Error with Type A {symbol_format}: {str(e)}")
+                    logger.debug("Error with Type A for %s: %s", symbol_format, e)
                     continue
             
             # If all formats failed, try search endpoint
+            SYMBOL_FORMAT_EXHAUSTED.inc(route='typea_ltp')
             try:
                 search_url = f"{self.base_url}/instruments/search?q={clean_symbol}"
-                search_response = requests.get(search_url, headers=headers, timeout=10)
+                with span('price.typea_search'):
+                    search_response = limited_call('typea_search', requests.get, search_url, headers=headers, timeout=10)
                 
                 if search_response.status_code == 200:
                     search_data = search_response.json()
                     if search_data.get('data') and len(search_data['data']) > 0:
                         found_symbol = search_data['data'][0].get('symbol')
                         if found_symbol:
-                            print(f"🔍 Found symbol via search: {found_symbol}")
+                            logger.debug("Found symbol via search", extra={'found_symbol': found_symbol})
                             return self._get_live_price_typea(found_symbol)
             except Exception as e:
-                print(f"❌ Search failed: {str(e)}")
+                logger.debug("Search failed: %s", e)
             
             return {
                 'status': 'error',
@@ -465,17 +644,16 @@ class MStocksPriceFetcher:
             }
             
         except Exception as e:
-            print(f"❌ Type A fallback error: {str(e)}")
+            logger.error("Type A fallback error: %s", e, extra={'symbol': symbol})
             return {'status': 'error', 'message': str(e)}
     
     def get_multiple_prices(self, symbols: List[str]) -> Dict:
-        """Get live prices for multiple symbols"""
+        """Get live prices for multiple symbols (pacing is handled by the shared rate limiter)"""
         results = {}
         for symbol in symbols:
-            print(f"\n📈 Fetching price for: {symbol}")
+            logger.debug("Fetching price", extra={'symbol': symbol})
             result = self.get_live_price(symbol)
             results[symbol] = result
-            time.sleep(0.5)  # Small delay between requests
         return results
 
     def place_order(self, tradingsymbol, exchange, transaction_type, order_type, quantity, product, validity, price, trigger_price):
@@ -484,7 +662,7 @@ class MStocksPriceFetcher:
             if not self.access_token:
                 return {'status': 'error', 'message': 'Not logged in. Please login first.'}
             
-            print(f"🔐 Placing {transaction_type} order for {tradingsymbol}")
+            logger.info("Placing %s order", transaction_type, extra={'symbol': tradingsymbol, 'quantity': quantity})
             
             # Prepare order data
             order_data = {
@@ -510,13 +688,13 @@ class MStocksPriceFetcher:
             # Convert to form data
             form_data = '&'.join([f"{k}={v}" for k, v in order_data.items()])
             
-            response = requests.post(url, headers=headers, data=form_data, timeout=30)
+            response = limited_call('place_order', requests.post, url, headers=headers, data=form_data, timeout=30)
             
-            print(f"📡 Order placement response: {response.status_code}")
+            logger.debug("Order placement response: %s", response.status_code)
             
             if response.status_code == 200:
                 result = response.json()
-                print(f"✅ Order placed successfully: {result}")
+                logger.info("Order placed successfully: %s", result)
                 return result
             else:
                 error_msg = f"Order placement failed: {response.status_code}"
@@ -525,13 +703,15 @@ class MStocksPriceFetcher:
                     error_msg += f" - {error_data.get('message', 'Unknown error')}"
                 except:
                     pass
-                print(f"❌ {error_msg}")
-                return {'status': 'error', 'message': error_msg}
+                logger.warning(error_msg)
+                # status_code tells a rejected order (4xx) from one that may still have gone through (5xx)
+                return {'status': 'error', 'message': error_msg, 'status_code': response.status_code}
                 
         except Exception as e:
             error_msg = f"Order placement error: {str(e)}"
-            print(f"❌ {error_msg}")
-            return {'status': 'error', 'message': error_msg}
+            logger.error(error_msg)
+            # No readable response (timeout, connection error): the order may have reached the broker
+            return {'status': 'error', 'message': error_msg, 'status_code': None}
 
     def get_order_book(self):
         """Get today's orders"""
@@ -546,7 +726,7 @@ class MStocksPriceFetcher:
             }
             
             url = f"{self.base_url}/orders"
-            response = requests.get(url, headers=headers, timeout=30)
+            response = limited_call('order_book', requests.get, url, headers=headers, timeout=30)
             
             if response.status_code == 200:
                 return response.json()
@@ -556,6 +736,28 @@ class MStocksPriceFetcher:
         except Exception as e:
             return {'status': 'error', 'message': f'Failed to get orders: {str(e)}'}
 
+    def get_fund_summary(self):
+        """Get the account fund summary (available cash, utilised margin, ...)"""
+        try:
+            if not self.access_token:
+                return {'status': 'error', 'message': 'Not logged in. Please login first.'}
+            
+            headers = {
+                'X-Mirae-Version': '1',
+                'Authorization': f'token {self.api_key}:{self.access_token}'
+            }
+            
+            url = f"{self.base_url}/user/fundsummary"
+            response = limited_call('fund_summary', requests.get, url, headers=headers, timeout=30)
+            
+            if response.status_code == 200:
+                return response.json()
+            else:
+                return {'status': 'error', 'message': f'Failed to get fund summary: {response.status_code}'}
+                
+        except Exception as e:
+            return {'status': 'error', 'message': f'Failed to get fund summary: {str(e)}'}
+
     def get_order_details(self, order_id, segment):
         """Get order details by order ID"""
         try:
@@ -574,7 +776,7 @@ class MStocksPriceFetcher:
             }
             
             url = f"{self.base_url}/order/details"
-            response = requests.get(url, headers=headers, params=data, timeout=30)
+            response = limited_call('order_details', requests.get, url, headers=headers, params=data, timeout=30)
             
             if response.status_code == 200:
                 return response.json()
@@ -597,7 +799,7 @@ class MStocksPriceFetcher:
             }
             
             url = f"{self.base_url}/orders/regular/{order_id}"
-            response = requests.delete(url, headers=headers, timeout=30)
+            response = limited_call('cancel_order', requests.delete, url, headers=headers, timeout=30)
             
             if response.status_code == 200:
                 return response.json()
@@ -612,14 +814,14 @@ def main():
     fetcher = MStocksPriceFetcher()
     
     # Step 1: Login
-    print("=== MStocks API Price Fetcher ===\n")
+    logger.info("MStocks API price fetcher")
     
     username = input("Enter username: ")
     password = input("Enter password: ")
     
     login_result = fetcher.login(username, password)
     if login_result.get('status') != 'success':
-        print("❌ Login failed")
+        logger.error("Login failed: %s", login_result.get('message', 'Unknown error'))
         return
     
     # Step 2: Generate session
@@ -627,28 +829,27 @@ def main():
     request_token = login_result.get('data', {}).get('request_token')
     
     if not request_token:
-        print("❌ No request token received")
+        logger.error("No request token received")
         return
     
     session_result = fetcher.generate_session(api_key, request_token)
     if session_result.get('status') != 'success':
-        print("❌ Session generation failed")
+        logger.error("Session generation failed: %s", session_result.get('message', 'Unknown error'))
         return
     
     # Step 3: Get prices
-    print("\n=== Fetching Live Prices ===")
+    logger.info("Fetching live prices")
     
     # Test symbols
     test_symbols = ['MIDSELIETF', 'NIFTYBEES', 'SETFNIF50']
     
     for symbol in test_symbols:
-        print(f"\n📈 Fetching price for: {symbol}")
         result = fetcher.get_live_price(symbol)
         
         if result.get('status') == 'success':
-            print(f"✅ {symbol}: ₹{result['price']} ({result['format_used']})")
+            logger.info("Live price", extra={'symbol': symbol, 'price': result['price'], 'format_used': result['format_used']})
         else:
-            print(f"❌ {symbol}: {result.get('message', 'Unknown error')}")
+            logger.error("Live price failed: %s", result.get('message', 'Unknown error'), extra={'symbol': symbol})
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Adaptive Rate Limiter
+Central scheduler for MStocks API calls with per-endpoint token buckets
+Adapts rates from HTTP 429 / quota headers / latency and serves waiters by priority
+(orders ahead of logins ahead of quotes ahead of history)
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from typing import Dict, Optional
+
+from metrics import timed_call, RATE_LIMIT_WAIT, RATE_LIMITED, RATE_LIMIT_RATE
+from structured_logging import get_logger
+
+logger = get_logger('rate_limiter')
+
+# Lower value is served first
+PRIORITIES = {'order': 0, 'login': 1, 'quote': 2, 'default': 3, 'history': 4}
+
+# (initial rate, max rate, burst) in requests per second
+DEFAULT_QUOTAS = {
+    'order': (5.0, 10.0, 5),
+    'login': (1.0, 2.0, 1),
+    'quote': (5.0, 10.0, 10),
+    'history': (2.0, 3.0, 3),
+    'default': (3.0, 5.0, 5),
+}
+
+# Route names used by price_fetcher/dma_calculator (timed_call routes) and MConnect (config routes)
+ROUTE_ENDPOINTS = {
+    'login': 'login', 'session_token': 'login', 'generate_session': 'login',
+    'validate_session': 'quote', 'typeb_quote': 'quote', 'typea_ltp': 'quote', 'typea_search': 'quote',
+    'typea_instruments_ltp': 'quote', 'market_ltp': 'quote', 'market_ohlc': 'quote',
+    'history': 'history', 'market_history': 'history', 'historical_chart': 'history',
+    'place_order': 'order', 'modify_order': 'order', 'cancel_order': 'order', 'cancel_all': 'order',
+    'order_book': 'order', 'order_details': 'order',
+    'fund_summary': 'default', 'calculate_order_margin': 'default', 'calculate_basket': 'default',
+}
+
+
+class EndpointQuota:
+    """Token bucket whose refill rate is adjusted with AIMD"""
+
+    def __init__(self, name: str, rate: float, max_rate: float, burst: int):
+        self.name = name
+        self.rate = rate
+        self.max_rate = max_rate
+        self.min_rate = max(rate / 20, 0.1)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.latency_target = 2.0  # seconds; slower responses ease the rate down
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available (0 when one is ready now)"""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def on_throttled(self, retry_after: Optional[float], now: float):
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = 0.0
+        self.blocked_until = max(self.blocked_until, now + (retry_after if retry_after else 1 / self.rate))
+
+    def on_success(self, latency: float):
+        if latency > self.latency_target:
+            self.rate = max(self.min_rate, self.rate * 0.9)
+        else:
+            self.rate = min(self.max_rate, self.rate + 0.1)
+
+
+class RateLimitScheduler:
+    def __init__(self, quotas: Optional[Dict] = None, max_retries: int = 3):
+        self.quotas = {
+            name: EndpointQuota(name, *limits)
+            for name, limits in (quotas or DEFAULT_QUOTAS).items()
+        }
+        self.max_retries = max_retries
+        self._cond = threading.Condition()
+        self._waiters = []  # heap of (priority, seq, endpoint)
+        self._seq = itertools.count()
+
+    def endpoint_for(self, route: str) -> str:
+        endpoint = ROUTE_ENDPOINTS.get(route, route)
+        return endpoint if endpoint in self.quotas else 'default'
+
+    def _can_proceed(self, entry, now: float) -> bool:
+        """Head-of-line check: no higher-priority waiter whose endpoint is ready goes before us"""
+        quota = self.quotas[entry[2]]
+        if quota.delay(now) > 0:
+            return False
+        for other in self._waiters:
+            if other[:2] < entry[:2] and self.quotas[other[2]].delay(now) == 0:
+                return False
+        return True
+
+    def acquire(self, route: str, priority: Optional[int] = None, timeout: Optional[float] = None) -> float:
+        """Block until `route` may be called; returns seconds waited"""
+        endpoint = self.endpoint_for(route)
+        quota = self.quotas[endpoint]
+        entry = (PRIORITIES.get(endpoint, 3) if priority is None else priority, next(self._seq), endpoint)
+        start = time.monotonic()
+        with self._cond:
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    for each in self.quotas.values():
+                        each.refill(now)
+                    if self._can_proceed(entry, now):
+                        quota.tokens -= 1
+                        break
+                    wait = quota.delay(now) or 0.01
+                    if timeout is not None:
+                        remaining = timeout - (now - start)
+                        if remaining <= 0:
+                            raise TimeoutError(f'Rate limit wait for {endpoint} exceeded {timeout}s')
+                        wait = min(wait, remaining)
+                    self._cond.wait(wait)
+            finally:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+        waited = time.monotonic() - start
+        if waited > 0.001:
+            RATE_LIMIT_WAIT.inc(waited, route=endpoint)
+        return waited
+
+    def feedback(self, route: str, status_code, latency: float, headers=None) -> Optional[float]:
+        """
+        Adapt the endpoint rate from a response.
+        Returns the back-off in seconds when the response was a 429, otherwise None.
+        """
+        endpoint = self.endpoint_for(route)
+        quota = self.quotas[endpoint]
+        headers = headers or {}
+        now = time.monotonic()
+        with self._cond:
+            if status_code == 429:
+                retry_after = _parse_seconds(headers.get('Retry-After'))
+                quota.on_throttled(retry_after, now)
+                RATE_LIMITED.inc(endpoint=endpoint)
+                logger.warning("Rate limited by broker", extra={
+                    'endpoint': endpoint, 'retry_after': retry_after, 'rate': round(quota.rate, 2)})
+                backoff = quota.blocked_until - now
+            else:
+                quota.on_success(latency)
+                remaining = _parse_seconds(headers.get('X-RateLimit-Remaining'))
+                reset = _parse_seconds(headers.get('X-RateLimit-Reset'))
+                if remaining is not None and remaining <= 0 and reset:
+                    # Quota exhausted for this window; reset may be epoch seconds or a delta
+                    delta = reset - time.time() if reset > 1e9 else reset
+                    quota.blocked_until = max(quota.blocked_until, now + max(delta, 0))
+                backoff = None
+            RATE_LIMIT_RATE.set(round(quota.rate, 3), endpoint=endpoint)
+            self._cond.notify_all()
+        return backoff
+
+    def call(self, route: str, func, *args, priority: Optional[int] = None, **kwargs):
+        """acquire -> func(*args, **kwargs) -> feedback, retrying 429 responses after their back-off"""
+        for attempt in range(self.max_retries + 1):
+            self.acquire(route, priority=priority)
+            start = time.monotonic()
+            response = func(*args, **kwargs)
+            backoff = self.feedback(route, getattr(response, 'status_code', None),
+                                    time.monotonic() - start, getattr(response, 'headers', None))
+            if backoff is None or attempt == self.max_retries:
+                return response
+            logger.debug("Retrying after 429", extra={'route': route, 'attempt': attempt + 1})
+        return response
+
+
+def _parse_seconds(value) -> Optional[float]:
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+# Shared by every fetcher/calculator in this process
+RATE_LIMITER = RateLimitScheduler()
+
+
+def limited_call(route: str, func, *args, **kwargs):
+    """Rate-limited, metered upstream call (see metrics.timed_call)"""
+    return RATE_LIMITER.call(route, timed_call, route, func, *args, **kwargs)
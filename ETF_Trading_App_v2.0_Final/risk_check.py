@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Pre-trade Risk Check
+Checks a whole order list against available cash in one pass: fund summary is cached and only
+refreshed after fills, prices come from one batched LTP request, and the basket margin is used
+when there is one (per-order broker margins, memoised per order shape, otherwise)
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from metrics import CACHE_REQUESTS
+from order_state import TERMINAL_STATUSES
+from structured_logging import get_logger
+
+logger = get_logger('risk_check')
+
+CASH_FIELDS = ('available_cash', 'AVAILABLE_BALANCE', 'available_balance', 'availablecash',
+               'net_available', 'cash', 'net')
+MARGIN_FIELDS = ('total', 'required', 'total_margin', 'required_margin', 'margin')
+
+
+def _number(data, fields) -> Optional[float]:
+    """First numeric field from a response dict (or the first dict of a list)"""
+    if isinstance(data, list):
+        data = data[0] if data else {}
+    if not isinstance(data, dict):
+        return None
+    for field in fields:
+        try:
+            if data.get(field) not in (None, ''):
+                return float(data[field])
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+class FundCache:
+    """
+    Cached fund summary with local reservations.
+    Approved orders reserve cash immediately; the broker figures are re-read only after a fill
+    (or when the cache is older than `max_age`). A refresh starts a new generation, so releasing
+    a reservation the refresh already dropped is a no-op.
+    """
+
+    def __init__(self, fetcher, max_age: float = 300):
+        self.fetcher = fetcher
+        self.max_age = max_age
+        self._available = None
+        self._loaded_at = 0.0
+        self._reserved = 0.0
+        self._generation = 0
+        self._stale = True
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        self._stale = True
+
+    def on_order_update(self, order: Dict):
+        """Order store listener: fills change the cash balance"""
+        if order.get('status') in TERMINAL_STATUSES or order.get('filled_quantity'):
+            self._stale = True
+
+    def available(self) -> Optional[float]:
+        with self._lock:
+            if self._stale or time.time() - self._loaded_at > self.max_age:
+                CACHE_REQUESTS.inc(cache='fund_summary', result='miss')
+                result = self.fetcher.get_fund_summary()
+                cash = _number(result.get('data') if isinstance(result, dict) else None, CASH_FIELDS)
+                if cash is None:
+                    logger.warning("Fund summary without a cash figure", extra={'result': result})
+                    return None
+                self._available = cash
+                self._reserved = 0.0
+                self._generation += 1
+                self._loaded_at = time.time()
+                self._stale = False
+            else:
+                CACHE_REQUESTS.inc(cache='fund_summary', result='hit')
+            return self._available - self._reserved
+
+    def reserve(self, amount: float) -> int:
+        """Hold `amount` back from later checks; returns the generation to release it against"""
+        with self._lock:
+            self._reserved += amount
+            return self._generation
+
+    def release(self, amount: float, generation: int):
+        """Give back part of a reservation (an order that was not placed or was rejected)"""
+        with self._lock:
+            if generation == self._generation:
+                self._reserved = max(self._reserved - amount, 0.0)
+
+
+class PreTradeRisk:
+    def __init__(self, fetcher, client_factory: Optional[Callable] = None, fund_cache: Optional[FundCache] = None,
+                 margin_ttl: float = 60, max_workers: int = 8, sell_credit: float = 0.0):
+        """
+        client_factory: returns an MConnect for get_ltp and calculate_order_margin
+                        (None = live prices one by one and notional value only)
+        sell_credit: fraction of sell proceeds counted as cash for buys in the same batch
+        """
+        self.fetcher = fetcher
+        self.client_factory = client_factory
+        self.funds = fund_cache or FundCache(fetcher)
+        self.margin_ttl = margin_ttl
+        self.max_workers = max_workers
+        self.sell_credit = sell_credit
+        self._margins: Dict[tuple, tuple] = {}
+
+    def _prices(self, orders: List[Dict]) -> Dict[int, Optional[float]]:
+        """
+        Price per order (keyed by id): the order's own price if it has one, otherwise one batched
+        LTP request for all the rest, with per-symbol live prices for whatever the batch missed
+        """
+        prices = {id(order): float(order['price']) for order in orders if order.get('price')}
+        wanted = list(dict.fromkeys(f"{order.get('exchange', 'NSE')}:{order['symbol']}"
+                                    for order in orders if id(order) not in prices))
+        quotes = {}
+        if wanted and self.client_factory is not None:
+            try:
+                data = self.client_factory().get_ltp(wanted).json().get('data') or {}
+                for key, quote in data.items():
+                    price = quote.get('last_price') if isinstance(quote, dict) else None
+                    if price:
+                        quotes[key] = float(price)
+            except Exception as e:
+                logger.warning("Batched LTP failed, using live prices: %s", e)
+        missing = [key for key in wanted if key not in quotes]
+        if missing:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                results = executor.map(lambda key: self.fetcher.get_live_price(key.split(':', 1)[1]), missing)
+                for key, result in zip(missing, results):
+                    quotes[key] = result.get('price') if result.get('status') == 'success' else None
+        for order in orders:
+            if id(order) not in prices:
+                prices[id(order)] = quotes.get(f"{order.get('exchange', 'NSE')}:{order['symbol']}")
+        return prices
+
+    def _margin(self, order: Dict, price: float) -> float:
+        """Broker-computed requirement for one order, memoised by order shape for `margin_ttl`"""
+        notional = order['quantity'] * price
+        if self.client_factory is None:
+            return notional
+        key = (order['symbol'], order['transaction_type'], order['quantity'], order['product'],
+               order['order_type'], round(price, 2))
+        cached = self._margins.get(key)
+        if cached and time.time() - cached[1] < self.margin_ttl:
+            CACHE_REQUESTS.inc(cache='order_margin', result='hit')
+            return cached[0]
+        CACHE_REQUESTS.inc(cache='order_margin', result='miss')
+        try:
+            response = self.client_factory().calculate_order_margin(
+                order.get('exchange', 'NSE'), order['symbol'], order['transaction_type'], 'regular',
+                order['product'], order['order_type'], str(order['quantity']), str(price),
+                str(order.get('trigger_price') or 0))
+            margin = _number(response.json().get('data'), MARGIN_FIELDS)
+        except Exception as e:
+            logger.debug("Margin lookup failed, using notional: %s", e, extra={'symbol': order['symbol']})
+            margin = None
+        margin = notional if margin is None else margin
+        self._margins[key] = (margin, time.time())
+        return margin
+
+    def release(self, amount: float, reservation: int):
+        """Release one leg's share of a reservation made by check(reserve=True)"""
+        if amount:
+            self.funds.release(amount, reservation)
+
+    def check(self, orders: List[Dict], reserve: bool = False, basket_margin: Optional[float] = None,
+              basket_orders: Optional[List[Dict]] = None) -> Dict:
+        """
+        Check normalized orders (see order_engine.normalize_order) against available cash.
+        basket_margin: broker margin for the whole list from calculate_basket, replacing per-order lookups
+        (split across the buys by notional for the per-order figures)
+        basket_orders: the full basket when `orders` is only part of it; the orders are charged their share
+        With `reserve`, an approved list's requirement is held back from later checks until the next refresh;
+        `reservation` in the result releases single legs again (see release).
+        """
+        buys = [order for order in orders if order['transaction_type'] == 'BUY']
+        sells = [order for order in orders if order['transaction_type'] == 'SELL']
+
+        legs = {id(order): order for order in list(orders) + list(basket_orders or [])}
+        priced = self._prices(list(legs.values()))
+        unpriced = [order['symbol'] for order in legs.values() if priced[id(order)] is None]
+        if unpriced:
+            return {'status': 'error', 'ok': False, 'message': f"No price for {', '.join(unpriced)}"}
+
+        if basket_margin is not None:
+            total = sum(order['quantity'] * priced[id(order)] for order in basket_orders or orders
+                        if order['transaction_type'] == 'BUY')
+            margins = [float(basket_margin) * order['quantity'] * priced[id(order)] / total if total else 0.0
+                       for order in buys]
+            required = float(basket_margin) if basket_orders is None else sum(margins)
+        else:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                margins = list(executor.map(lambda order: self._margin(order, priced[id(order)]), buys))
+            required = sum(margins)
+        per_order = [{'index': order.get('index'), 'symbol': order['symbol'], 'required': round(margin, 2)}
+                     for order, margin in zip(buys, margins)]
+
+        proceeds = sum(order['quantity'] * priced[id(order)] for order in sells)
+        available = self.funds.available()
+        if available is None:
+            return {'status': 'error', 'ok': False, 'message': 'Fund summary unavailable'}
+        usable = available + proceeds * self.sell_credit
+        ok = required <= usable
+        reservation = self.funds.reserve(required) if ok and reserve else None
+        result = {
+            'status': 'success',
+            'ok': ok,
+            'available': round(available, 2),
+            'sell_proceeds': round(proceeds, 2),
+            'required': round(required, 2),
+            'shortfall': round(max(required - usable, 0), 2),
+            'orders': per_order,
+        }
+        if reservation is not None:
+            result['reservation'] = reservation
+        if not ok:
+            result['message'] = f"Insufficient funds: need {result['required']}, have {round(usable, 2)}"
+        return result
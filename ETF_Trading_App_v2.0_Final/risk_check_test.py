@@ -0,0 +1,161 @@
+import pytest
+
+from order_engine import BulkOrderEngine, IdempotencyStore, normalize_order
+from risk_check import FundCache, PreTradeRisk
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return {'status': 'success', 'data': self.data}
+
+
+class FakeClient:
+    """MConnect stand-in: LTP for the symbols in `ltp`, a fixed per-order margin"""
+
+    def __init__(self, ltp, margin=None):
+        self.ltp = ltp
+        self.margin = margin
+        self.ltp_calls = []
+        self.margin_calls = 0
+
+    def get_ltp(self, instruments):
+        self.ltp_calls.append(list(instruments))
+        return FakeResponse({key: {'last_price': self.ltp[key]} for key in instruments if key in self.ltp})
+
+    def calculate_order_margin(self, *args):
+        self.margin_calls += 1
+        return FakeResponse({'total': self.margin})
+
+
+class FakeFetcher:
+    def __init__(self, cash=10000.0, live=None, results=None):
+        self.cash = cash
+        self.live = live or {}
+        self.live_calls = []
+        self.fund_calls = 0
+        self.results = list(results or [])
+
+    def get_fund_summary(self):
+        self.fund_calls += 1
+        return {'status': 'success', 'data': [{'available_cash': self.cash}]}
+
+    def get_live_price(self, symbol):
+        self.live_calls.append(symbol)
+        if symbol in self.live:
+            return {'status': 'success', 'price': self.live[symbol]}
+        return {'status': 'error', 'message': 'No price'}
+
+    def place_order(self, **order):
+        if self.results:
+            return self.results.pop(0)
+        return {'status': 'success', 'data': [{'order_id': f"OID-{order['tradingsymbol']}"}]}
+
+    def get_order_book(self):
+        return {'status': 'success', 'data': []}
+
+
+def orders(*specs):
+    return [normalize_order({'symbol': symbol, 'transaction_type': side, 'quantity': quantity})[0]
+            for symbol, side, quantity in specs]
+
+
+def test_fund_cache_reserve_and_release():
+    funds = FundCache(FakeFetcher(cash=1000.0))
+    assert funds.available() == 1000.0
+    generation = funds.reserve(400.0)
+    assert funds.available() == 600.0
+    funds.release(150.0, generation)
+    assert funds.available() == 750.0
+
+
+def test_release_after_refresh_is_ignored():
+    fetcher = FakeFetcher(cash=1000.0)
+    funds = FundCache(fetcher)
+    funds.available()
+    generation = funds.reserve(400.0)
+    funds.invalidate()
+    assert funds.available() == 1000.0  # the refresh dropped the reservation
+    later = funds.reserve(300.0)
+    funds.release(400.0, generation)
+    assert funds.available() == 700.0
+    assert later != generation
+
+
+def test_prices_come_from_one_batched_ltp_call():
+    client = FakeClient({'NSE:NIFTYBEES': 250.0, 'NSE:GOLDBEES': 60.0})
+    fetcher = FakeFetcher(live={'ITBEES': 40.0})
+    risk = PreTradeRisk(fetcher, client_factory=lambda: client)
+    result = risk.check(orders(('NIFTYBEES', 'BUY', 10), ('GOLDBEES', 'BUY', 5), ('ITBEES', 'SELL', 2)))
+    assert client.ltp_calls == [['NSE:NIFTYBEES', 'NSE:GOLDBEES', 'NSE:ITBEES']]
+    assert fetcher.live_calls == ['ITBEES']  # only what the batch missed
+    assert result['sell_proceeds'] == 80.0
+
+
+def test_unpriced_order_fails_the_check():
+    risk = PreTradeRisk(FakeFetcher(), client_factory=lambda: FakeClient({}))
+    result = risk.check(orders(('NIFTYBEES', 'BUY', 10)))
+    assert not result['ok']
+    assert 'NIFTYBEES' in result['message']
+
+
+def test_basket_margin_replaces_per_order_margins():
+    client = FakeClient({'NSE:NIFTYBEES': 100.0, 'NSE:GOLDBEES': 100.0}, margin=999.0)
+    risk = PreTradeRisk(FakeFetcher(), client_factory=lambda: client)
+    basket = orders(('NIFTYBEES', 'BUY', 30), ('GOLDBEES', 'BUY', 10))
+    result = risk.check(basket, basket_margin=2000.0)
+    assert client.margin_calls == 0
+    assert result['required'] == 2000.0
+    assert [leg['required'] for leg in result['orders']] == [1500.0, 500.0]
+
+    # Part of the basket is charged its share of the basket margin
+    part = risk.check(basket[1:], basket_margin=2000.0, basket_orders=basket)
+    assert part['required'] == 500.0
+    assert client.margin_calls == 0
+
+
+def test_reservation_held_until_released():
+    client = FakeClient({'NSE:NIFTYBEES': 100.0})
+    risk = PreTradeRisk(FakeFetcher(cash=1500.0), client_factory=lambda: client, margin_ttl=0)
+    client.margin = 1000.0
+    first = risk.check(orders(('NIFTYBEES', 'BUY', 10)), reserve=True)
+    assert first['ok']
+    assert not risk.check(orders(('NIFTYBEES', 'BUY', 10)))['ok']
+    risk.release(first['orders'][0]['required'], first['reservation'])
+    assert risk.check(orders(('NIFTYBEES', 'BUY', 10)))['ok']
+
+
+def test_rejected_check_reserves_nothing():
+    risk = PreTradeRisk(FakeFetcher(cash=100.0), client_factory=lambda: FakeClient({'NSE:NIFTYBEES': 100.0}))
+    result = risk.check(orders(('NIFTYBEES', 'BUY', 10)), reserve=True)
+    assert not result['ok']
+    assert 'reservation' not in result
+    assert risk.funds.available() == 100.0
+
+
+@pytest.fixture
+def store(tmp_path):
+    return IdempotencyStore(str(tmp_path / 'orders.db'))
+
+
+def test_failed_leg_gives_its_cash_back(store):
+    fetcher = FakeFetcher(cash=5000.0, results=[{'status': 'error', 'message': 'RMS', 'status_code': 400}])
+    risk = PreTradeRisk(fetcher, client_factory=lambda: FakeClient({'NSE:NIFTYBEES': 100.0}))
+    engine = BulkOrderEngine(fetcher, store=store, risk=risk)
+    result = engine.submit([{'symbol': 'NIFTYBEES', 'transaction_type': 'BUY', 'quantity': 10}])
+    assert result['orders'][0]['state'] == 'failed'
+    assert risk.funds.available() == 5000.0
+
+
+def test_retried_batch_is_not_rejected_for_its_own_reservation(store):
+    fetcher = FakeFetcher(cash=1500.0)
+    risk = PreTradeRisk(fetcher, client_factory=lambda: FakeClient({'NSE:NIFTYBEES': 100.0}))
+    engine = BulkOrderEngine(fetcher, store=store, risk=risk)
+    batch = [{'symbol': 'NIFTYBEES', 'transaction_type': 'BUY', 'quantity': 10}]
+    assert engine.submit(batch, batch_id='b1')['status'] == 'success'
+    assert risk.funds.available() == 500.0
+    retry = engine.submit(batch, batch_id='b1')
+    assert retry['summary']['duplicates'] == 1
+    assert risk.funds.available() == 500.0
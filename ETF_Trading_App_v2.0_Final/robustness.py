@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Robustness Engine
+Walk-forward validation and Monte Carlo resampling for the DMA20 dip-buy strategy.
+Walk-forward picks the best grid point on each in-sample window and scores it on the window
+that follows; Monte Carlo block-bootstraps historical daily returns into simulated paths and
+steps a whole batch of paths at once through backtester.Simulation. Batches and windows are
+spread over a process pool that maps the price history from shared .npy files
+"""
+
+import argparse
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from backtester import Backtester, Simulation, TRADING_DAYS, cagr, forward_fill
+from dma_calculator import DMA_WINDOW
+from parameter_sweep import METRICS, run_point, grid, market, pool_map, shared_arrays
+from structured_logging import get_logger
+
+logger = get_logger('robustness')
+
+PERCENTILES = (5, 25, 50, 75, 95)
+DISTRIBUTION_METRICS = ('cagr', 'max_drawdown', 'utilisation', 'total_return')
+
+
+def distribution(values) -> Dict:
+    """Summary statistics of one metric across scenarios or windows"""
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return {'count': 0}
+    result = {'count': int(len(values)), 'mean': float(values.mean()), 'std': float(values.std()),
+              'min': float(values.min()), 'max': float(values.max())}
+    result.update({f'p{p}': float(value) for p, value in zip(PERCENTILES, np.percentile(values, PERCENTILES))})
+    return result
+
+
+def walk_forward(dates, closes: np.ndarray, points: List[Dict], train_days: int = 504, test_days: int = 126,
+                 workers: Optional[int] = None, sort_by: str = 'cagr') -> Dict:
+    """
+    Rolling walk-forward: for each window choose the best of `points` on `train_days` rows,
+    then backtest that choice on the next `test_days` rows (DMA warmed up on the rows before them).
+    """
+    closes = np.asarray(closes, dtype=np.float64)
+    days = len(closes)
+    windows = [(start, start + train_days, start + train_days + test_days)
+               for start in range(0, days - train_days - test_days + 1, test_days)]
+    if not windows or not points:
+        return {'status': 'error', 'message': f'Need at least {train_days + test_days} days of history and one grid point'}
+    warmup = max(point.get('dma_window', DMA_WINDOW) for point in points)
+    started = time.perf_counter()
+
+    with shared_arrays(dates=np.asarray(dates, dtype='datetime64[D]'), closes=closes) as directory:
+        in_sample = pool_map(run_point, [dict(point, window=(start, start, middle))
+                                        for start, middle, _ in windows for point in points], directory, workers)
+        chosen = []
+        for index in range(len(windows)):
+            rows = [row for row in in_sample[index * len(points):(index + 1) * len(points)]
+                    if row.get(sort_by) is not None]
+            best = max(rows, key=lambda row: row[sort_by]) if rows else dict(points[0])
+            chosen.append(best)
+        out_of_sample = pool_map(run_point, [
+            dict({key: value for key, value in best.items() if key not in METRICS and key not in ('window', 'error')},
+                 window=(max(middle - warmup, 0), middle, end))
+            for best, (_, middle, end) in zip(chosen, windows)], directory, workers)
+
+    dates = np.asarray(dates, dtype='datetime64[D]')
+    results = []
+    for (start, middle, end), best, test in zip(windows, chosen, out_of_sample):
+        results.append({
+            'train_start': str(dates[start]), 'test_start': str(dates[middle]), 'test_end': str(dates[end - 1]),
+            'params': {key: value for key, value in test.items() if key not in METRICS and key != 'window'},
+            'in_sample': {name: best.get(name) for name in DISTRIBUTION_METRICS if name in best},
+            'out_of_sample': {name: test.get(name) for name in METRICS if name in test},
+        })
+    in_cagr = np.array([row['in_sample'].get('cagr', np.nan) for row in results], dtype=np.float64)
+    out_cagr = np.array([row['out_of_sample'].get('cagr', np.nan) for row in results], dtype=np.float64)
+    logger.info("Walk-forward finished", extra={
+        'windows': len(windows), 'points': len(points),
+        'duration_ms': round((time.perf_counter() - started) * 1000, 1)})
+    return {
+        'status': 'success',
+        'windows': results,
+        'out_of_sample': {name: distribution([row['out_of_sample'].get(name, np.nan) for row in results])
+                          for name in DISTRIBUTION_METRICS},
+        # Out-of-sample CAGR as a share of in-sample CAGR; well below 1 suggests overfitting
+        'efficiency': float(np.nanmean(out_cagr) / np.nanmean(in_cagr)) if np.nanmean(in_cagr) else None,
+    }
+
+
+def _simulate_batch(task) -> Dict[str, np.ndarray]:
+    """Step one batch of bootstrapped paths through the strategy"""
+    seed, scenarios, horizon, block, params = task
+    returns, history = market('returns'), market('history')
+    rng = np.random.default_rng(seed)
+    strategy = Backtester(**params)
+    window = strategy.dma_window
+    count = returns.shape[1]
+
+    # Block bootstrap: runs of `block` consecutive days keep short-term autocorrelation and co-movement
+    starts = rng.integers(0, len(returns) - block + 1, size=(scenarios, -(-horizon // block)))
+    rows = (starts[:, :, None] + np.arange(block)).reshape(scenarios, -1)[:, :horizon]
+
+    recent = np.repeat(np.asarray(history[-window:])[:, None, :], scenarios, axis=1)  # ring buffer of closes
+    total = recent.sum(axis=0)
+    close = recent[-1].copy()
+    simulation = Simulation(strategy, scenarios, count)
+    peak = np.full(scenarios, float(strategy.capital))
+    drawdown = np.zeros(scenarios)
+    equity = peak.copy()
+    for day in range(horizon):
+        close = close * (1 + returns[rows[:, day]])
+        slot = day % window
+        total += close - recent[slot]
+        recent[slot] = close
+        dma = total / window
+        equity = simulation.step(day * 365 // TRADING_DAYS, close, (close - dma) / dma, close)
+        np.maximum(peak, equity, out=peak)
+        np.maximum(drawdown, (peak - equity) / peak, out=drawdown)
+    growth = equity / strategy.capital
+    return {'cagr': cagr(growth, horizon), 'total_return': growth - 1, 'max_drawdown': drawdown,
+            'utilisation': simulation.utilisation / horizon}
+
+
+def monte_carlo(closes: np.ndarray, scenarios: int = 10000, horizon: int = TRADING_DAYS, block: int = 5,
+                batch: int = 500, workers: Optional[int] = None, seed: Optional[int] = None,
+                keep_paths: bool = False, **params) -> Dict:
+    """
+    Distribution of strategy outcomes over `scenarios` simulated `horizon`-day paths, each starting
+    from the last historical closes with fresh capital. ETFs with gaps in the history are left out.
+    """
+    prices = forward_fill(np.asarray(closes, dtype=np.float64))
+    complete = ~np.isnan(prices).any(axis=0)
+    prices = prices[:, complete]
+    window = params.get('dma_window', DMA_WINDOW)
+    if prices.shape[1] == 0 or len(prices) < max(window, block) + 1:
+        return {'status': 'error', 'message': 'Not enough complete price history to resample'}
+    returns = prices[1:] / prices[:-1] - 1
+    started = time.perf_counter()
+
+    seeds = np.random.SeedSequence(seed).spawn(-(-scenarios // batch))
+    sizes = [min(batch, scenarios - index * batch) for index in range(len(seeds))]
+    tasks = [(child.generate_state(1)[0], size, horizon, block, params) for child, size in zip(seeds, sizes)]
+    with shared_arrays(returns=returns, history=prices[-window:]) as directory:
+        batches = pool_map(_simulate_batch, tasks, directory, workers)
+    paths = {name: np.concatenate([result[name] for result in batches]) for name in DISTRIBUTION_METRICS}
+
+    logger.info("Monte Carlo finished", extra={
+        'scenarios': scenarios, 'horizon': horizon, 'etfs': int(complete.sum()),
+        'duration_ms': round((time.perf_counter() - started) * 1000, 1)})
+    result = {
+        'status': 'success',
+        'scenarios': scenarios,
+        'horizon': horizon,
+        'etfs': int(complete.sum()),
+        'dropped': int((~complete).sum()),
+        'distribution': {name: distribution(values) for name, values in paths.items()},
+        'probability_of_loss': float((paths['total_return'] < 0).mean()),
+    }
+    if keep_paths:
+        result['paths'] = paths
+    return result
+
+
+def main():
+    from history_store import HistoryStore, HISTORY_DB
+
+    parser = argparse.ArgumentParser(description='Walk-forward and Monte Carlo robustness checks')
+    parser.add_argument('mode', choices=('walk-forward', 'monte-carlo'))
+    parser.add_argument('--db', default=HISTORY_DB)
+    parser.add_argument('--symbols', help='comma separated, default every symbol in the store')
+    parser.add_argument('--start')
+    parser.add_argument('--end')
+    parser.add_argument('--target', default='0.06', help='comma separated values (walk-forward grid)')
+    parser.add_argument('--parts', default='50')
+    parser.add_argument('--scenarios', type=int, default=10000)
+    parser.add_argument('--horizon', type=int, default=TRADING_DAYS)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    dates, _, closes = HistoryStore(args.db).closes(args.symbols.split(',') if args.symbols else None,
+                                                    args.start, args.end)
+    targets = [float(value) for value in args.target.split(',')]
+    parts = [int(value) for value in args.parts.split(',')]
+    if args.mode == 'walk-forward':
+        result = walk_forward(dates, closes, grid(target=targets, parts=parts), workers=args.workers)
+    else:
+        result = monte_carlo(closes, args.scenarios, args.horizon, workers=args.workers, seed=args.seed,
+                             target=targets[0], parts=parts[0])
+    for name, value in result.items():
+        if name != 'windows':
+            print(f"{name}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from parameter_sweep import grid
+from robustness import distribution, monte_carlo, walk_forward
+
+POINTS = grid(target=[0.04, 0.06], parts=[10], capital=[100000])
+
+
+def market(days=400, count=5, seed=3):
+    rng = np.random.default_rng(seed)
+    closes = 100 * np.cumprod(1 + rng.normal(0.0003, 0.015, size=(days, count)), axis=0)
+    return np.datetime64('2021-01-04') + np.arange(days), closes
+
+
+def test_distribution():
+    stats = distribution([1.0, 2.0, np.nan, 3.0])
+    assert (stats['count'], stats['mean'], stats['min'], stats['max'], stats['p50']) == (3, 2.0, 1.0, 3.0, 2.0)
+    assert distribution([np.nan]) == {'count': 0}
+
+
+def test_walk_forward_windows_and_determinism():
+    dates, closes = market()
+    result = walk_forward(dates, closes, POINTS, train_days=200, test_days=50, workers=1)
+    assert result['status'] == 'success'
+    assert len(result['windows']) == 4
+    assert result['windows'][0]['test_start'] == str(dates[200])
+    assert all(window['params']['target'] in (0.04, 0.06) for window in result['windows'])
+    assert walk_forward(dates, closes, POINTS, train_days=200, test_days=50, workers=1) == result
+
+
+def test_walk_forward_needs_enough_history():
+    dates, closes = market(days=100)
+    assert walk_forward(dates, closes, POINTS, train_days=200, test_days=50, workers=1)['status'] == 'error'
+
+
+def test_monte_carlo_is_reproducible_for_a_seed():
+    _, closes = market()
+    run = dict(scenarios=60, horizon=40, batch=25, workers=1, keep_paths=True, capital=100000, parts=10)
+    first = monte_carlo(closes, seed=42, **run)
+    again = monte_carlo(closes, seed=42, **run)
+    other = monte_carlo(closes, seed=43, **run)
+    assert first['status'] == 'success'
+    assert first['paths']['cagr'].shape == (60,)
+    for name in first['paths']:
+        np.testing.assert_array_equal(first['paths'][name], again['paths'][name])
+    assert not np.array_equal(first['paths']['total_return'], other['paths']['total_return'])
+    assert 0.0 <= first['probability_of_loss'] <= 1.0
+
+
+def test_monte_carlo_drops_gappy_etfs():
+    _, closes = market()
+    closes[100:110, 0] = np.nan  # forward-filled, kept
+    closes[:50, 1] = np.nan      # listed late, dropped
+    result = monte_carlo(closes, scenarios=10, horizon=10, batch=10, workers=1, seed=1)
+    assert (result['etfs'], result['dropped']) == (4, 1)
+
+
+def test_monte_carlo_needs_history():
+    assert monte_carlo(np.ones((5, 2)), scenarios=10, workers=1)['status'] == 'error'
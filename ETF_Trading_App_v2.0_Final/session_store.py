@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Shared Session Store
+SQLite-backed MStocks session storage shared by every worker and process
+Atomic updates, a version counter for change detection and a refresh lock
+"""
+
+import inspect
+import json
+import sqlite3
+import threading
+import time
+import weakref
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+from structured_logging import get_logger
+
+logger = get_logger('session_store')
+
+DATETIME_FIELDS = ('token_expiry', 'saved_at')
+
+
+class SessionStore:
+    def __init__(self, path: str = "mstocks_session.db", key: str = "default"):
+        self.path = path
+        self.key = key
+        self._local = threading.local()
+        self._listeners = []
+        self._watcher = None
+        self._listeners_lock = threading.Lock()
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        """One connection per thread, autocommit mode with explicit transactions"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS session ('
+            ' key TEXT PRIMARY KEY,'
+            ' version INTEGER NOT NULL DEFAULT 0,'
+            ' data TEXT,'
+            ' validated_at REAL,'
+            ' validated_version INTEGER,'
+            ' refresh_owner TEXT,'
+            ' refresh_until REAL)'
+        )
+        conn.execute('INSERT OR IGNORE INTO session (key, version) VALUES (?, 0)', (self.key,))
+
+    @staticmethod
+    def _encode(data: Dict) -> str:
+        encoded = dict(data)
+        for field in DATETIME_FIELDS:
+            if isinstance(encoded.get(field), datetime):
+                encoded[field] = encoded[field].isoformat()
+        return json.dumps(encoded)
+
+    @staticmethod
+    def _decode(raw: str) -> Dict:
+        data = json.loads(raw)
+        for field in DATETIME_FIELDS:
+            if data.get(field):
+                data[field] = datetime.fromisoformat(data[field])
+        return data
+
+    def version(self) -> int:
+        """Current session version; bumps on every save or clear"""
+        row = self._connect().execute(
+            'SELECT version FROM session WHERE key = ?', (self.key,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def has_changed(self, known_version: int) -> bool:
+        return self.version() != known_version
+
+    def save(self, data: Dict) -> int:
+        """Atomically replace the session and return its new version"""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                'UPDATE session SET data = ?, version = version + 1,'
+                ' validated_at = NULL, validated_version = NULL WHERE key = ?',
+                (self._encode(data), self.key)
+            )
+            version = conn.execute(
+                'SELECT version FROM session WHERE key = ?', (self.key,)
+            ).fetchone()[0]
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return version
+
+    def load(self):
+        """Return (data, version); data is None when no session is stored"""
+        row = self._connect().execute(
+            'SELECT data, version FROM session WHERE key = ?', (self.key,)
+        ).fetchone()
+        if not row or not row[0]:
+            return None, row[1] if row else 0
+        return self._decode(row[0]), row[1]
+
+    def clear(self, expected_version: Optional[int] = None) -> bool:
+        """
+        Remove the stored session.
+        With expected_version set, only clear if nobody saved a newer session meanwhile.
+        """
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if expected_version is None:
+                cursor = conn.execute(
+                    'UPDATE session SET data = NULL, version = version + 1,'
+                    ' validated_at = NULL, validated_version = NULL WHERE key = ?',
+                    (self.key,)
+                )
+            else:
+                cursor = conn.execute(
+                    'UPDATE session SET data = NULL, version = version + 1,'
+                    ' validated_at = NULL, validated_version = NULL'
+                    ' WHERE key = ? AND version = ? AND data IS NOT NULL',
+                    (self.key, expected_version)
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return cursor.rowcount > 0
+
+    def mark_validated(self, version: int):
+        """Record a successful upstream validation of the given session version"""
+        self._connect().execute(
+            'UPDATE session SET validated_at = ?, validated_version = ? WHERE key = ? AND version = ?',
+            (time.time(), version, self.key, version)
+        )
+
+    def validated_within(self, version: int, seconds: float) -> bool:
+        """True if any worker validated this session version in the last `seconds`"""
+        row = self._connect().execute(
+            'SELECT validated_at, validated_version FROM session WHERE key = ?', (self.key,)
+        ).fetchone()
+        if not row or row[0] is None or row[1] != version:
+            return False
+        return time.time() - row[0] < seconds
+
+    def acquire_refresh_lock(self, owner: str, ttl: float = 60) -> bool:
+        """Try to become the single worker allowed to refresh the session"""
+        now = time.time()
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            cursor = conn.execute(
+                'UPDATE session SET refresh_owner = ?, refresh_until = ?'
+                ' WHERE key = ? AND (refresh_until IS NULL OR refresh_until < ? OR refresh_owner = ?)',
+                (owner, now + ttl, self.key, now, owner)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return cursor.rowcount > 0
+
+    def release_refresh_lock(self, owner: str):
+        self._connect().execute(
+            'UPDATE session SET refresh_owner = NULL, refresh_until = NULL'
+            ' WHERE key = ? AND refresh_owner = ?',
+            (self.key, owner)
+        )
+
+    def wait_for_change(self, known_version: int, timeout: float = 30, interval: float = 0.25) -> bool:
+        """Block until another worker publishes a new session version"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.has_changed(known_version):
+                return True
+            time.sleep(interval)
+        return False
+
+    def add_listener(self, callback: Callable[[int], None], interval: float = 1.0):
+        """
+        Call `callback(version)` whenever the stored session changes.
+        A bound method is held weakly, so subscribing does not keep its object alive; the watcher
+        thread stops once every listener is gone.
+        """
+        ref = weakref.WeakMethod(callback) if inspect.ismethod(callback) else (lambda: callback)
+        with self._listeners_lock:
+            self._listeners.append(ref)
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=self._watch, args=(interval,), daemon=True,
+                                                 name='session-watch')
+                self._watcher.start()
+
+    def _watch(self, interval: float):
+        known_version = None
+        while True:
+            try:
+                version = self.version()
+            except sqlite3.Error as e:
+                logger.warning("Session watch failed to read the store: %s", e)
+                version = known_version
+            with self._listeners_lock:
+                self._listeners = [ref for ref in self._listeners if ref() is not None]
+                if not self._listeners:
+                    self._watcher = None
+                    return
+                callbacks = [ref() for ref in self._listeners]
+            if known_version is not None and version != known_version:
+                for callback in callbacks:
+                    if callback is None:
+                        continue
+                    try:
+                        callback(version)
+                    except Exception as e:
+                        logger.error("Session listener failed: %s", e, exc_info=True, extra={'version': version})
+            known_version = version
+            del callbacks
+            time.sleep(interval)
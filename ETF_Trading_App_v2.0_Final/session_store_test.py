@@ -0,0 +1,71 @@
+import gc
+import time
+
+import session_store
+from price_fetcher import MStocksPriceFetcher
+from session_store import SessionStore
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_listener_is_called_on_change(tmp_path):
+    path = str(tmp_path / 'session.db')
+    seen = []
+    SessionStore(path).add_listener(seen.append, interval=0.05)
+    time.sleep(0.2)
+    version = SessionStore(path).save({'access_token': 'T1'})
+    assert wait_until(lambda: seen == [version])
+
+
+def test_listener_errors_are_logged_and_others_still_run(tmp_path, monkeypatch):
+    path = str(tmp_path / 'session.db')
+    errors, seen = [], []
+    monkeypatch.setattr(session_store.logger, 'error', lambda *args, **kwargs: errors.append(args))
+    store = SessionStore(path)
+
+    def broken(version):
+        raise RuntimeError('listener bug')
+
+    store.add_listener(broken, interval=0.05)
+    store.add_listener(seen.append, interval=0.05)
+    time.sleep(0.2)
+    SessionStore(path).save({'access_token': 'T1'})
+    assert wait_until(lambda: seen and errors)
+    assert 'listener bug' in str(errors[0])
+
+
+def test_watcher_stops_when_its_listener_is_gone(tmp_path):
+    class Subscriber:
+        def on_change(self, version):
+            pass
+
+    store = SessionStore(str(tmp_path / 'session.db'))
+    subscriber = Subscriber()
+    store.add_listener(subscriber.on_change, interval=0.05)
+    watcher = store._watcher
+    del subscriber
+    gc.collect()
+    watcher.join(timeout=2)
+    assert not watcher.is_alive()
+    assert store._watcher is None
+
+
+def test_fetcher_picks_up_a_session_saved_by_another_worker(tmp_path, monkeypatch):
+    monkeypatch.setenv('MSTOCKS_SESSION_DB', str(tmp_path / 'session.db'))
+    idle = MStocksPriceFetcher(restore=False)
+    time.sleep(1.2)  # let the watcher read the starting version
+    worker = MStocksPriceFetcher(restore=False)
+    worker.access_token, worker.api_key = 'TOKEN', 'KEY'
+    worker.save_session()
+    assert wait_until(lambda: idle.access_token == 'TOKEN')
+    assert idle.session_version == worker.session_version
+
+    worker.clear_session()
+    assert wait_until(lambda: idle.access_token is None)
@@ -371,6 +371,32 @@ const ETFRanking = () => {
     try {
       console.log('🔄 Updating ETF prices and DMA20 with live data...');
       
+      // One server-side ranking call fetches every price and DMA20 together
+      const ranking = await pythonPriceApiService.getRanking(
+        etfs.map(etf => etf.symbol),
+        holdings.map(h => h.symbol)
+      );
+      if (ranking.status === 'success') {
+        const bySymbol = new Map(ranking.results.map(item => [item.symbol, item]));
+        const now = new Date().toISOString();
+        etfs.forEach(etf => {
+          const item = bySymbol.get(etf.symbol.replace('NSE:', '').replace('BSE:', ''));
+          if (!item || item.cmp == null) return;
+          const updatedETF = { ...etf, cmp: item.cmp, currentPrice: item.cmp, lastUpdated: now, dataSource: 'Python MStocks API' };
+          if (item.dma20 != null) {
+            updatedETF.dma20 = item.dma20;
+            // Rolled forward from stored closes because today's history was unavailable
+            updatedETF.dmaStale = Boolean(item.dma_stale);
+          }
+          dispatch({ type: 'UPDATE_ETF', payload: updatedETF });
+        });
+        await loadSessionStatus();
+        setPriceUpdateMessage(`✅ ETF prices and DMA20 updated! (${ranking.ranked} ranked, ${ranking.unranked.length} without data)`);
+        setTimeout(() => setPriceUpdateMessage(''), 5000);
+        return;
+      }
+      console.warn('⚠️ Ranking endpoint unavailable, updating ETFs one by one:', ranking.message);
+      
       // Update prices first
       await handleUpdateETFPrices();
       
@@ -410,7 +436,7 @@ const ETFRanking = () => {
     } finally {
       setIsUpdatingPrices(false);
     }
-  }, [etfs, handleUpdateETFPrices, calculateDMA20, dispatch]);
+  }, [etfs, holdings, handleUpdateETFPrices, calculateDMA20, dispatch]);
 
   // Helper function to check if market is open
   const isMarketOpen = () => {
@@ -680,7 +706,19 @@ const ETFRanking = () => {
                       )}
                     </div>
                   </td>
-                  <td className="px-6 py-4 whitespace-nowrap text-sm text-gray-900">₹{etf.dma20}</td>
+                  <td className="px-6 py-4 whitespace-nowrap text-sm text-gray-900">
+                    <div className="flex items-center">
+                      <span>₹{etf.dma20}</span>
+                      {etf.dmaStale && (
+                        <span
+                          className="ml-2 px-2 py-1 text-xs bg-yellow-100 text-yellow-800 rounded-full"
+                          title="Estimated from stored closes and the live price; today's history was unavailable"
+                        >
+                          Stale
+                        </span>
+                      )}
+                    </div>
+                  </td>
                   <td className="px-6 py-4 whitespace-nowrap text-sm font-medium text-red-600">
                     <TrendingDown className="inline w-4 h-4 mr-1" />
                     {Math.abs(etf.percentDiff).toFixed(2)}%
@@ -314,6 +314,31 @@ class PythonPriceApiService {
     }
   }
 
+  // Rank ETFs by % distance from DMA20 server-side (one call for the whole universe)
+  async getRanking(symbols, holdings = []) {
+    try {
+      console.log(`📊 Fetching ranking for ${symbols.length} symbols via Python API...`);
+      const response = await fetch(`${this.baseUrl}/ranking`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ symbols, holdings })
+      });
+      
+      if (!response.ok) {
+        throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+      }
+      
+      const result = await response.json();
+      console.log(`📊 Python API ranking result:`, result);
+      return result;
+    } catch (error) {
+      console.error('Python API ranking failed:', error);
+      return { status: 'error', message: error.message };
+    }
+  }
+
   // Check if session is valid and auto-refresh if needed
   async checkAndRefreshSession() {
     try {
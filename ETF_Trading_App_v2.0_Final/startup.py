@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Server Start-up
+Keeps process start cheap: heavy components (numpy-backed ranking, history, snapshots) are
+built on first use, and the start-up work (session restore and validation, order stream,
+component loading) runs once in order on a background thread that reports readiness per step
+"""
+
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from structured_logging import get_logger
+
+logger = get_logger('startup')
+
+
+class Lazy:
+    """
+    Proxy that builds its object with `factory` on first attribute access (once, thread-safe),
+    so the modules the factory imports load only when the component is used
+    """
+
+    def __init__(self, factory: Callable, name: Optional[str] = None):
+        self._factory = factory
+        self._name = name or getattr(factory, '__name__', 'component')
+        self._value = None
+        self._lock = threading.Lock()
+
+    @property
+    def built(self) -> bool:
+        return self._value is not None
+
+    def get(self):
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    started = time.perf_counter()
+                    self._value = self._factory()
+                    logger.debug("Built %s", self._name,
+                                 extra={'duration_ms': round((time.perf_counter() - started) * 1000, 2)})
+        return self._value
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+class Startup:
+    """Named start-up steps run once, in order; each step's outcome and timing is kept for /api/ready"""
+
+    def __init__(self):
+        self._steps: List[Tuple[str, Callable]] = []
+        self._done: Dict[str, threading.Event] = {}
+        self.results: Dict[str, Dict] = {}
+        self.created = time.perf_counter()
+        self.started_at = None
+        self.ready_ms = None
+        self._ready = threading.Event()
+
+    def add(self, name: str, function: Callable):
+        self._steps.append((name, function))
+        self._done[name] = threading.Event()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def wait(self, name: Optional[str] = None, timeout: Optional[float] = None) -> bool:
+        """Wait for one step (or every step) to finish; True if it has"""
+        event = self._done[name] if name else self._ready
+        return event.wait(timeout)
+
+    def start(self, background: bool = True):
+        self.started_at = datetime.now().isoformat()
+        if background:
+            threading.Thread(target=self.run, name='startup', daemon=True).start()
+        else:
+            self.run()
+
+    def run(self):
+        for name, function in self._steps:
+            started = time.perf_counter()
+            try:
+                result = function()
+                self.results[name] = {'status': 'success', 'result': result}
+            except Exception as e:
+                logger.warning("Start-up step %s failed: %s", name, e)
+                self.results[name] = {'status': 'error', 'message': str(e)}
+            self.results[name]['duration_ms'] = round((time.perf_counter() - started) * 1000, 2)
+            self._done[name].set()
+        self.ready_ms = round((time.perf_counter() - self.created) * 1000, 2)
+        self._ready.set()
+        logger.info("Server ready", extra={'ready_ms': self.ready_ms,
+                                           'failed_steps': [name for name, step in self.results.items()
+                                                            if step['status'] != 'success']})
+
+    def status(self) -> Dict:
+        return {
+            'ready': self.ready,
+            'started_at': self.started_at,
+            'ready_ms': self.ready_ms,
+            'steps': {name: self.results.get(name, {'status': 'done' if self._done[name].is_set() else 'pending'})
+                      for name, _ in self._steps},
+        }
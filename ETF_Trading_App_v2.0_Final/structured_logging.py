@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Structured Logging
+JSON-lines logging with levels, sampling and a queued (non-blocking) handler
+Per-request IDs are attached from a context variable so every line can be correlated
+"""
+
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Optional
+
+request_id_var = contextvars.ContextVar('request_id', default=None)
+
+# Attributes every LogRecord has; anything else came in through `extra=` and is emitted as a field
+_RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'request_id'}
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Render a record as one JSON object per line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        request_id = getattr(record, 'request_id', None) or request_id_var.get()
+        if request_id:
+            payload['request_id'] = request_id
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and key not in payload:
+                payload[key] = value
+        if record.exc_info:
+            payload['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            payload['exc'] = record.exc_text
+        return json.dumps(payload, default=str)
+
+
+class StructuredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that keeps the traceback out of the message: the stock prepare() folds it into
+    `msg`, which would leave the JSON `exc` field empty. It is formatted here on the calling thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class RequestContextFilter(logging.Filter):
+    """Capture the request ID on the calling thread, before the record is queued"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, 'request_id'):
+            record.request_id = request_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a fraction of DEBUG/INFO records; warnings and errors always pass"""
+
+    def __init__(self, rate: float = 1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.rate >= 1.0:
+            return True
+        return random.random() < self.rate
+
+
+def configure_logging(level: Optional[str] = None, sample_rate: Optional[float] = None, stream=None):
+    """
+    Install the queued JSON handler on the `etf` logger tree.
+    ETF_LOG_LEVEL (default INFO) and ETF_LOG_SAMPLE_RATE (default 1.0) override the defaults.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    level = (level or os.environ.get('ETF_LOG_LEVEL', 'INFO')).upper()
+    if sample_rate is None:
+        sample_rate = float(os.environ.get('ETF_LOG_SAMPLE_RATE', '1.0'))
+
+    root = logging.getLogger('etf')
+    root.setLevel(level)
+    root.propagate = False
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter())
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = StructuredQueueHandler(log_queue)
+    queue_handler.addFilter(RequestContextFilter())
+    queue_handler.addFilter(SamplingFilter(sample_rate))
+    root.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger under the `etf` namespace, configured on first use"""
+    configure_logging()
+    return logging.getLogger(f'etf.{name}')
+
+
+def new_request_id(request_id: Optional[str] = None) -> str:
+    """Set (or generate) the request ID for the current context"""
+    request_id = request_id or uuid.uuid4().hex[:16]
+    request_id_var.set(request_id)
+    return request_id
+
+
+@contextmanager
+def log_timing(logger: logging.Logger, event: str, level: int = logging.DEBUG, **fields):
+    """Log `event` with its duration in milliseconds when the block exits"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if logger.isEnabledFor(level):
+            fields['duration_ms'] = round((time.perf_counter() - start) * 1000, 2)
+            logger.log(level, event, extra=fields)
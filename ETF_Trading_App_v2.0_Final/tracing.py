@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Request Tracing and Profiling
+Lightweight nested timing spans carried in a context variable
+Profiled requests return a timing breakdown; sampled traces are appended to a JSONL file
+"""
+
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+
+TRACE_SAMPLE_RATE = float(os.environ.get('ETF_TRACE_SAMPLE_RATE', '0'))
+TRACE_FILE = os.environ.get('ETF_TRACE_FILE', 'traces.jsonl')
+
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+_current_span = contextvars.ContextVar('current_span', default=None)
+_file_lock = threading.Lock()
+
+
+class Trace:
+    def __init__(self, name: str, sampled: bool = False, profiled: bool = False):
+        self.name = name
+        self.sampled = sampled
+        self.profiled = profiled
+        self.started_at = datetime.now()
+        self.start = time.perf_counter()
+        self.end = None
+        self.spans: List[Dict] = []
+        self._lock = threading.Lock()
+
+    def add_span(self, span: Dict):
+        with self._lock:
+            self.spans.append(span)
+
+    def breakdown(self) -> Dict:
+        """Total time plus every span (offset and duration in ms) in start order"""
+        end = self.end if self.end is not None else time.perf_counter()
+        with self._lock:
+            spans = sorted(self.spans, key=lambda item: item['start_ms'])
+        return {
+            'trace': self.name,
+            'started_at': self.started_at.isoformat(),
+            'total_ms': round((end - self.start) * 1000, 2),
+            'spans': spans,
+        }
+
+
+def start_trace(name: str, profile: bool = False) -> Optional[Trace]:
+    """Begin a trace for the current context if profiling was requested or it is sampled"""
+    sampled = TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE
+    if not (profile or sampled):
+        return None
+    trace = Trace(name, sampled=sampled, profiled=profile)
+    _current_trace.set(trace)
+    _current_span.set(None)
+    return trace
+
+
+def finish_trace(trace: Optional[Trace]) -> Optional[Dict]:
+    """Close the trace, write it to TRACE_FILE if sampled, and return its breakdown"""
+    if trace is None:
+        return None
+    trace.end = time.perf_counter()
+    _current_trace.set(None)
+    breakdown = trace.breakdown()
+    if trace.sampled:
+        line = json.dumps(breakdown, default=str)
+        with _file_lock:
+            with open(TRACE_FILE, 'a', encoding='utf-8') as trace_file:
+                trace_file.write(line + '\n')
+    return breakdown
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Time a stage of work; a no-op unless the current context is being traced"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+    parent = _current_span.get()
+    record = {'name': name, 'parent': parent['name'] if parent else None}
+    if attrs:
+        record['attrs'] = attrs
+    token = _current_span.set(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        end = time.perf_counter()
+        _current_span.reset(token)
+        record['start_ms'] = round((start - trace.start) * 1000, 2)
+        record['duration_ms'] = round((end - start) * 1000, 2)
+        trace.add_span(record)
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Pre-market Warmup
+Daily job that runs before the 9:15 IST open so the first requests of the day hit warm caches:
+validates the session, refreshes the instrument master, backfills daily bars into the history
+store (priming the per-day DMA20 cache and the resolved history formats on the way) and ranks
+the universe once to warm prices, price formats and the ranking index
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from etf_ranking import clean_symbol
+from structured_logging import get_logger
+
+logger = get_logger('warmup')
+
+IST = timezone(timedelta(hours=5, minutes=30))
+MARKET_OPEN = (9, 15)
+MARKET_CLOSE = (15, 30)
+WARMUP_AT = os.environ.get('ETF_WARMUP_AT', '08:45')  # IST, HH:MM
+# Exchange holidays on top of weekends (YYYY-MM-DD, comma separated)
+MARKET_HOLIDAYS = {day.strip() for day in os.environ.get('ETF_MARKET_HOLIDAYS', '').split(',') if day.strip()}
+RETRY_SECONDS = 300  # a skipped or failed warmup is retried this often until the close
+BACKFILL_DAYS = 30  # calendar days that cover the 20 bars DMA20 needs
+BACKFILL_MAX_DAYS = 400
+
+
+def _at(day: datetime, hour_minute) -> datetime:
+    return day.replace(hour=hour_minute[0], minute=hour_minute[1], second=0, microsecond=0)
+
+
+def is_trading_day(day: date) -> bool:
+    return day.weekday() < 5 and day.isoformat() not in MARKET_HOLIDAYS
+
+
+def configured_symbols() -> List[str]:
+    """Extra warmup symbols from ETF_WARMUP_SYMBOLS (comma separated)"""
+    return [symbol.strip() for symbol in os.environ.get('ETF_WARMUP_SYMBOLS', '').split(',') if symbol.strip()]
+
+
+class WarmupJob:
+    def __init__(self, fetcher, dma_calculator, ranking, history, portfolio=None, basket_pipeline=None,
+                 symbols: Optional[List[str]] = None, max_workers: int = 8):
+        """
+        The universe is `symbols` (default ETF_WARMUP_SYMBOLS) plus the last ranking request,
+        the held ETFs and every symbol already in the history store
+        """
+        self.fetcher = fetcher
+        self.dma_calculator = dma_calculator
+        self.ranking = ranking
+        self.history = history
+        self.portfolio = portfolio
+        self.basket_pipeline = basket_pipeline
+        self.symbols = configured_symbols() if symbols is None else list(symbols)
+        self.max_workers = max_workers
+
+    def holdings(self) -> List[str]:
+        if self.portfolio is not None and self.portfolio.ensure_loaded():
+            return self.portfolio.symbols()
+        return []
+
+    def universe(self) -> List[str]:
+        symbols = self.symbols + self.ranking.last_symbols + self.holdings() + self.history.symbols()
+        return list(dict.fromkeys(clean_symbol(symbol) for symbol in symbols if str(symbol).strip()))
+
+    def run(self) -> Dict:
+        started, started_at = time.perf_counter(), datetime.now(IST).isoformat()
+        if not self.fetcher.access_token:
+            self.fetcher.restore_session()  # another worker may have logged in since start-up
+        if not (self.fetcher.access_token and self.fetcher.auto_refresh_session()):
+            return {'status': 'skipped', 'message': 'Not logged in', 'started_at': started_at}
+        self.dma_calculator.access_token = self.fetcher.access_token
+        self.dma_calculator.api_key = self.fetcher.api_key
+
+        steps = {}
+        if self.basket_pipeline is not None:
+            steps['instruments'] = self._step(self._refresh_instruments)
+        symbols = self.universe()
+        steps['history'] = self._step(self._backfill, symbols)
+        steps['ranking'] = self._step(self._rank, symbols)
+
+        duration_ms = round((time.perf_counter() - started) * 1000, 1)
+        ok = all(step['status'] == 'success' for step in steps.values())
+        logger.info("Warmup finished", extra={'symbols': len(symbols), 'duration_ms': duration_ms,
+                                              'failed_steps': [name for name, step in steps.items()
+                                                               if step['status'] != 'success']})
+        return {
+            'status': 'success' if ok else 'partial',
+            'started_at': started_at,
+            'symbols': len(symbols),
+            'duration_ms': duration_ms,
+            'steps': steps,
+        }
+
+    @staticmethod
+    def _step(function, *args) -> Dict:
+        started = time.perf_counter()
+        try:
+            result = {'status': 'success', **function(*args)}
+        except Exception as e:
+            logger.warning("Warmup step %s failed: %s", function.__name__, e)
+            result = {'status': 'error', 'message': str(e)}
+        result['duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        return result
+
+    def _refresh_instruments(self) -> Dict:
+        return {'instruments': len(self.basket_pipeline.instrument_index(refresh=True))}
+
+    def _backfill_one(self, symbol: str, today: date) -> Optional[tuple]:
+        """Fetch the bars missing since the last stored day, store them and prime the DMA20 cache"""
+        last = self.history.last_date(symbol)
+        days = BACKFILL_DAYS
+        if last:
+            days = min(max(days, (today - date.fromisoformat(last)).days + 1), BACKFILL_MAX_DAYS)
+        result = self.dma_calculator.get_historical_data(symbol, days=days)
+        if result.get('status') != 'success':
+            return None
+        stored = self.history.add_bars(symbol, result['data'])
+        return stored, self.dma_calculator.dma20_from_history(symbol, history=result) is not None
+
+    def _backfill(self, symbols: List[str]) -> Dict:
+        today = datetime.now(IST).date()  # the trading day, whatever the host timezone
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(executor.map(lambda symbol: self._backfill_one(symbol, today), symbols))
+        done = [result for result in results if result is not None]
+        return {
+            'symbols': len(symbols),
+            'bars': sum(stored for stored, _ in done),
+            'dma20': sum(primed for _, primed in done),
+            'failed': [symbol for symbol, result in zip(symbols, results) if result is None],
+        }
+
+    def _rank(self, symbols: List[str]) -> Dict:
+        if not symbols:
+            return {'ranked': 0}
+        result = self.ranking.rank(symbols, self.holdings())
+        return {'ranked': result['ranked'], 'unranked': result['unranked']}
+
+
+class WarmupScheduler:
+    """
+    Runs a WarmupJob at `at` (IST) every trading day. A server started later in the day warms up
+    straight away, and a skipped or failed run is retried every RETRY_SECONDS until the close.
+    """
+
+    def __init__(self, job: WarmupJob, at: str = WARMUP_AT, enabled: Optional[bool] = None):
+        self.job = job
+        self.at = tuple(int(part) for part in at.split(':'))
+        self.enabled = os.environ.get('ETF_WARMUP', '1') != '0' if enabled is None else enabled
+        self.running = False
+        self.last_result: Optional[Dict] = None
+        self.last_attempt: Optional[datetime] = None
+        self.last_warm_day: Optional[date] = None
+        self.next_run: Optional[datetime] = None
+        self._thread = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._run_lock = threading.Lock()
+
+    def start(self) -> bool:
+        if not self.enabled or (self._thread is not None and self._thread.is_alive()):
+            return False
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='warmup', daemon=True)
+        self._thread.start()
+        logger.info("Warmup scheduler started", extra={'warmup_at': '%02d:%02d IST' % self.at})
+        return True
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def trigger(self):
+        """Run the warmup now on the scheduler thread (or inline when the scheduler is not running)"""
+        if self._thread is not None and self._thread.is_alive():
+            self._wake.set()
+        else:
+            threading.Thread(target=self.run_now, daemon=True).start()
+
+    def run_now(self) -> Dict:
+        if not self._run_lock.acquire(blocking=False):
+            return {'status': 'error', 'message': 'Warmup already running'}
+        try:
+            self.running = True
+            self.last_attempt = datetime.now(IST)
+            try:
+                result = self.job.run()
+            except Exception as e:
+                logger.error("Warmup failed: %s", e)
+                result = {'status': 'error', 'message': str(e)}
+            self.last_result = result
+            if result.get('status') in ('success', 'partial'):
+                self.last_warm_day = self.last_attempt.date()
+            return result
+        finally:
+            self.running = False
+            self._run_lock.release()
+
+    def next_due(self, now: datetime) -> datetime:
+        """When the next warmup should run, given the current IST time"""
+        if is_trading_day(now.date()) and self.last_warm_day != now.date() and now < _at(now, MARKET_CLOSE):
+            if now < _at(now, self.at):
+                return _at(now, self.at)
+            if self.last_attempt is None or self.last_attempt.date() != now.date():
+                return now
+            return max(now, self.last_attempt + timedelta(seconds=RETRY_SECONDS))
+        day = now + timedelta(days=1)
+        while not is_trading_day(day.date()):
+            day += timedelta(days=1)
+        return _at(day, self.at)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            now = datetime.now(IST)
+            self.next_run = self.next_due(now)
+            if self._wake.wait(max((self.next_run - now).total_seconds(), 0)):
+                self._wake.clear()
+            if self._stop.is_set():
+                break
+            self.run_now()
+
+    def status(self) -> Dict:
+        return {
+            'enabled': self.enabled,
+            'running': self.running,
+            'warmup_at': '%02d:%02d IST' % self.at,
+            'market_open': '%02d:%02d IST' % MARKET_OPEN,
+            'next_run': self.next_run.isoformat() if self.next_run else None,
+            'last_attempt': self.last_attempt.isoformat() if self.last_attempt else None,
+            'warm_today': self.last_warm_day == datetime.now(IST).date(),
+            'last_result': self.last_result,
+        }
@@ -0,0 +1,81 @@
+from datetime import date, datetime
+
+import pytest
+
+import warmup
+from warmup import IST, WarmupJob, WarmupScheduler, is_trading_day
+
+
+def ist(day, hour, minute=0):
+    return datetime(2024, 1, day, hour, minute, tzinfo=IST)
+
+
+# 2024-01-05 is a Friday; 2024-01-26 (Republic Day, a Friday) is listed as a holiday
+HOLIDAYS = {'2024-01-26'}
+
+CASES = [
+    # (now, last attempt, last warm day, expected)
+    ('before warmup time', ist(5, 7), None, None, ist(5, 8, 45)),
+    ('at warmup time', ist(5, 8, 45), None, None, ist(5, 8, 45)),
+    ('missed, never tried', ist(5, 9), None, None, ist(5, 9)),
+    ('missed, tried yesterday', ist(5, 9), ist(4, 9), None, ist(5, 9)),
+    ('retry after a failure', ist(5, 9), ist(5, 8, 58), None, ist(5, 9, 3)),
+    ('retry already due', ist(5, 9, 10), ist(5, 8, 45), None, ist(5, 9, 10)),
+    ('warm today', ist(5, 9), ist(5, 8, 45), date(2024, 1, 5), ist(8, 8, 45)),
+    ('after the close', ist(5, 16), None, None, ist(8, 8, 45)),
+    ('saturday', ist(6, 10), None, None, ist(8, 8, 45)),
+    ('sunday night', ist(7, 23, 59), None, None, ist(8, 8, 45)),
+    ('eve of a holiday', ist(25, 16), None, None, ist(29, 8, 45)),
+    ('on a holiday', ist(26, 7), None, None, ist(29, 8, 45)),
+]
+
+
+@pytest.mark.parametrize('name, now, last_attempt, last_warm_day, expected', CASES, ids=[case[0] for case in CASES])
+def test_next_due(monkeypatch, name, now, last_attempt, last_warm_day, expected):
+    monkeypatch.setattr(warmup, 'MARKET_HOLIDAYS', HOLIDAYS)
+    scheduler = WarmupScheduler(job=None, at='08:45', enabled=False)
+    scheduler.last_attempt, scheduler.last_warm_day = last_attempt, last_warm_day
+    assert scheduler.next_due(now) == expected
+
+
+def test_is_trading_day(monkeypatch):
+    monkeypatch.setattr(warmup, 'MARKET_HOLIDAYS', HOLIDAYS)
+    assert [is_trading_day(date(2024, 1, day)) for day in (5, 6, 7, 8, 26)] == [True, False, False, True, False]
+
+
+class FakeHistory:
+    def __init__(self, last):
+        self.last = last
+        self.added = []
+
+    def last_date(self, symbol):
+        return self.last
+
+    def add_bars(self, symbol, bars):
+        self.added.extend(bars)
+        return len(bars)
+
+
+class FakeDMA:
+    def __init__(self):
+        self.requested_days = []
+
+    def get_historical_data(self, symbol, days):
+        self.requested_days.append(days)
+        return {'status': 'success', 'data': [{'date': '2024-01-04', 'close': 1.0}]}
+
+    def dma20_from_history(self, symbol, history=None):
+        return {'dma20': 1.0}
+
+
+@pytest.mark.parametrize('last, days', [
+    (None, warmup.BACKFILL_DAYS),                 # nothing stored: the default window
+    ('2024-01-01', warmup.BACKFILL_DAYS),         # recent: still at least the DMA window
+    ('2023-10-01', 97),                           # older: back to the last stored day
+    ('2020-01-01', warmup.BACKFILL_MAX_DAYS),     # capped
+])
+def test_backfill_window(last, days):
+    dma = FakeDMA()
+    job = WarmupJob(fetcher=None, dma_calculator=dma, ranking=None, history=FakeHistory(last), symbols=[])
+    assert job._backfill_one('NIFTYBEES', date(2024, 1, 5)) == (1, True)
+    assert dma.requested_days == [days]
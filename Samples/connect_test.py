@@ -1,4 +1,6 @@
 import os,sys
+import contextlib
+import json
 import pytest
 import responses
 from urllib.parse import urljoin
@@ -7,6 +9,7 @@ parent_dir=os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.append(parent_dir)
 from helpers import utils
 import tradingapi_a.exceptions as ex
+from tradingapi_a import scriptmaster
 
 @responses.activate
 def test_place_order(mconnect):
@@ -194,3 +197,152 @@ def test_modify_order(mconnect):
     mod_order=mconnect.modify_order("1181250203103","SL","5","723","DAY","720","0")
     assert mod_order
 
+
+@responses.activate
+def test_tracer_spans(mconnect):
+    '''Tracer receives one span per request stage'''
+    responses.add(
+        responses.GET,
+        urljoin(mconnect.default_root_uri, mconnect.routes["order_book"]),
+        body=utils.get_response('order_book'),
+        content_type="application/json"
+    )
+    recorded=[]
+
+    @contextlib.contextmanager
+    def tracer(name, **attrs):
+        recorded.append((name, attrs.get("route")))
+        yield
+
+    mconnect.set_tracer(tracer)
+    mconnect.get_order_book()
+    assert recorded==[("mconnect.http","order_book"),("mconnect.parse","order_book")]
+
+@responses.activate
+def test_retry_on_rate_limit(mconnect):
+    '''429 responses are retried after Retry-After'''
+    url=urljoin(mconnect.default_root_uri, mconnect.routes["market_ltp"])
+    responses.add(responses.GET, url, status=429, headers={"Retry-After":"0"}, body="{}", content_type="application/json")
+    responses.add(responses.GET, url, body=utils.get_response("market_ltp"), content_type="application/json")
+    fetch_ltp=mconnect.get_ltp(["NSE:ACC"])
+    assert fetch_ltp.json()["data"]
+    assert len(responses.calls)==2
+
+@responses.activate
+def test_no_retry_on_post_gateway_error(mconnect):
+    '''Orders are not resent after a gateway error'''
+    responses.add(
+        responses.POST,
+        urljoin(mconnect.default_root_uri, mconnect.routes["place_order"]),
+        status=503,
+        body=utils.get_response("place_order"),
+        content_type="application/json"
+    )
+    mconnect.place_order("SBICARD","NSE","BUY","MARKET","10","CNC","DAY","0","0")
+    assert len(responses.calls)==1
+
+@responses.activate
+def test_ltp_sends_every_instrument(mconnect):
+    '''Each instrument is sent as its own i= parameter'''
+    responses.add(
+        responses.GET,
+        urljoin(mconnect.default_root_uri, mconnect.routes["market_ltp"]),
+        body=utils.get_response("market_ltp"),
+        content_type="application/json"
+    )
+    mconnect.get_ltp(["NSE:ACC","BSE:ACC","NSE:ACC"])
+    assert len(responses.calls)==1
+    assert responses.calls[0].request.url.endswith("?i=NSE%3AACC&i=BSE%3AACC")
+
+@responses.activate
+def test_ltp_chunks_and_merges(mconnect):
+    '''Lists above the per-request limit are chunked and merged by symbol'''
+    url=urljoin(mconnect.default_root_uri, mconnect.routes["market_ltp"])
+    responses.add(responses.GET, url, json={"status":"success","data":{"NSE:A":{"last_price":1},"NSE:B":{"last_price":2}}})
+    responses.add(responses.GET, url, json={"status":"success","data":{"NSE:C":{"last_price":3}}})
+    mconnect._max_quote_instruments=2
+    fetch_ltp=mconnect.get_ltp(["NSE:A","NSE:B","NSE:C"])
+    assert len(responses.calls)==2
+    assert responses.calls[1].request.url.endswith("?i=NSE%3AC")
+    assert fetch_ltp.json()["data"]["NSE:C"]["last_price"]==3
+    assert set(fetch_ltp.json()["data"])=={"NSE:A","NSE:B","NSE:C"}
+
+@responses.activate
+def test_json_response_decoded_once(mconnect):
+    '''JSON bodies are parsed once and exposed through the response wrapper'''
+    responses.add(
+        responses.GET,
+        urljoin(mconnect.default_root_uri, mconnect.routes["order_book"]),
+        body=utils.get_response('order_book'),
+        content_type="application/json"
+    )
+    order_book=mconnect.get_order_book()
+    assert order_book.json() is order_book.json()
+    assert order_book["status"]==order_book.status
+    assert order_book.status_code==200
+
+@responses.activate
+def test_instrument_scrip_stream_to_file(mconnect, tmp_path):
+    '''The scriptmaster can be streamed straight to disk'''
+    responses.add(
+        responses.GET,
+        urljoin(mconnect.default_root_uri, mconnect.routes["instrument_scrip"]),
+        body=utils.get_response("instrument_scrip"),
+        content_type="text/csv"
+    )
+    path=str(tmp_path / "scriptmaster.csv")
+    assert mconnect.get_instruments(path)==path
+    with open(path) as scrip_file:
+        assert scrip_file.read()==utils.get_response("instrument_scrip")
+
+@responses.activate
+def test_iter_instruments_filters_etfs(mconnect):
+    '''Scriptmaster rows are streamed and filtered while parsing'''
+    responses.add(
+        responses.GET,
+        urljoin(mconnect.default_root_uri, mconnect.routes["instrument_scrip"]),
+        body=utils.get_response("instrument_scrip"),
+        content_type="text/csv"
+    )
+    rows=list(mconnect.iter_instruments(scriptmaster.is_etf))
+    assert [row["tradingsymbol"] for row in rows]==["NIFTYBEES"]
+
+@responses.activate
+def test_build_instrument_index(mconnect, tmp_path):
+    '''ETF rows are written to a binary index that can be looked up by symbol'''
+    responses.add(
+        responses.GET,
+        urljoin(mconnect.default_root_uri, mconnect.routes["instrument_scrip"]),
+        body=utils.get_response("instrument_scrip"),
+        content_type="text/csv"
+    )
+    path=str(tmp_path / "etf.idx")
+    assert mconnect.build_instrument_index(path)==1
+    index=scriptmaster.InstrumentIndex(path)
+    assert index.get("NIFTYBEES")["instrument_token"]==1
+    assert index.get("ACC") is None
+
+@responses.activate
+def test_pool_consolidates_holdings():
+    '''Holdings are fetched for every account and merged per symbol'''
+    from tradingapi_a.mpool import MConnectPool
+    pool=MConnectPool()
+    first=pool.add_account("first","k1","t1")
+    pool.add_account("second","k2","t2")
+    url=urljoin(first.default_root_uri, first.routes["holdings"])
+
+    def holdings(request):
+        quantity=10 if "k1:t1" in request.headers["Authorization"] else 30
+        body={"status":"success","data":[{"exchange":"NSE","tradingsymbol":"NIFTYBEES","quantity":quantity,"average_price":quantity}]}
+        return (200,{},json.dumps(body))
+
+    responses.add_callback(responses.GET, url, callback=holdings, content_type="application/json")
+    view=pool.consolidated_holdings()
+    pool.close()
+    assert view["status"]=="success"
+    assert len(responses.calls)==2
+    holding=view["data"][0]
+    assert holding["quantity"]==40
+    assert holding["average_price"]==25
+    assert holding["accounts"]=={"first":10,"second":30}
+    assert pool.client("first").request_session is pool.client("second").request_session
@@ -3,24 +3,122 @@ import json
 import logging
 import requests
 import sys,traceback
+import time
+import contextlib
 import tradingapi_a.exceptions as ex
 from tradingapi_a import __config__
-from urllib.parse import urljoin
+from tradingapi_a import scriptmaster
+from urllib.parse import urljoin, quote_plus
 
 #Creating Default Log file for API
 default_log = logging.getLogger("mconnect.log")
 default_log.addHandler(logging.FileHandler("mconnect.log", mode='a'))
 
+try:
+    # Optional fast JSON backend
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+_STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+class MResponse:
+    """
+    Decoded JSON response.
+    The body is parsed once in `MConnect._request`; `json()` and field access reuse that result.
+    Anything else (`status_code`, `headers`, `content`, ...) is read from the underlying `requests.Response`.
+    """
+
+    def __init__(self, payload, response=None):
+        self._payload = payload
+        self.response = response
+
+    def json(self):
+        return self._payload
+
+    @property
+    def status(self):
+        return self._body().get("status")
+
+    @property
+    def data(self):
+        return self._body().get("data")
+
+    def _body(self):
+        # List payloads carry the status/data object first, as checked in `_request`
+        payload = self._payload
+        if type(payload) == list:
+            payload = payload[0] if payload else {}
+        return payload if isinstance(payload, dict) else {}
+
+    def get(self, key, default=None):
+        return self._body().get(key, default)
+
+    def __getitem__(self, key):
+        return self._body()[key]
+
+    def __contains__(self, key):
+        return key in self._body()
+
+    def __getattr__(self, name):
+        response = self.__dict__.get("response")
+        if response is None:
+            raise AttributeError(name)
+        return getattr(response, name)
+
+    def __bool__(self):
+        return getattr(self.response, "ok", True)
+
+    def __repr__(self):
+        return "<MResponse [{}]>".format(getattr(self.response, "status_code", None))
+
+
+class BatchResponse(MResponse):
+    """
+    Merged result of several chunked quote requests.
+    Mirrors the parts of `requests.Response` callers use: `json()`, `status_code`, `headers`, `content`.
+    """
+
+    def __init__(self, data, responses):
+        super().__init__(data)
+        self.responses = responses
+        self.status_code = max(response.status_code for response in responses)
+        self.headers = {"Content-Type": "application/json"}
+
+    @property
+    def content(self):
+        return json.dumps(self._payload).encode()
+
+    @property
+    def text(self):
+        return json.dumps(self._payload)
+
+
 class MConnect:
     
     _default_timeout = 7
+    _default_max_retries = 2
+    _default_retry_backoff = 0.5
+    # Statuses retried automatically. 429 means the request was not processed, so it is safe for every
+    # method; gateway errors are only retried for idempotent GET requests.
+    _retry_any_method = (429,)
+    _retry_idempotent = (502, 503, 504)
+    # Quote endpoints take repeated `i=` parameters; larger lists are split across requests
+    _max_quote_instruments = 50
+    _max_url_length = 2000
     
-    def __init__(self,api_key=None,access_Token=None,pool=None,timeout=None,debug=True,logger=default_log,disable_ssl=True): 
+    def __init__(self,api_key=None,access_Token=None,pool=None,timeout=None,debug=True,logger=default_log,disable_ssl=True,max_retries=None,retry_backoff=None): 
         self.api_key=api_key
         self.access_token=access_Token
         self.session_expiry_hook = None
+        self.tracer = None
         self.disable_ssl = disable_ssl
         self.timeout = timeout or self._default_timeout
+        self.max_retries = self._default_max_retries if max_retries is None else max_retries
+        self.retry_backoff = retry_backoff or self._default_retry_backoff
+        self.rate_limiter = None
         self.debug=debug
         self.logger=logger
 
@@ -48,6 +146,41 @@ class MConnect:
 
         self.session_expiry_hook = method
 
+    def set_tracer(self, tracer):
+        """
+        Set a tracer used to time the stages of every request.
+        `tracer(name, **attrs)` must return a context manager, e.g. a tracing span factory.
+        """
+        if not callable(tracer):
+            raise TypeError("Invalid input type. Only functions are accepted.")
+
+        self.tracer = tracer
+
+    def set_rate_limiter(self, limiter):
+        """
+        Set a shared rate limiter. It must provide `acquire(route)` and
+        `feedback(route, status_code, latency, headers)`, called around every request.
+        """
+        if not (hasattr(limiter, "acquire") and hasattr(limiter, "feedback")):
+            raise TypeError("Invalid rate limiter. It must provide acquire() and feedback().")
+
+        self.rate_limiter = limiter
+
+    def _retry_delay(self, response_data, attempt):
+        """Seconds to wait before a retry: Retry-After when the server sends it, else exponential backoff"""
+        if response_data is not None:
+            try:
+                return float(response_data.headers.get("Retry-After"))
+            except (TypeError, ValueError):
+                pass
+        return self.retry_backoff * (2 ** attempt)
+
+    def _span(self, name, **attrs):
+        """Tracer span for a request stage, or a no-op when no tracer is set"""
+        if self.tracer is None:
+            return contextlib.nullcontext()
+        return self.tracer(name, **attrs)
+
     def login(self,user_id,password):
         '''
         Login with credentials 
@@ -280,15 +413,10 @@ class MConnect:
     def get_ohlc(self,ohlc_input):
         '''
         ohlc_input: List of strings in exchange:trading symbol format
+        Large lists are split into several requests and merged into one symbol-keyed response.
         '''
-        ohlc_details={"i":value for value in ohlc_input}
         try:
-            #Using session request
-            get_ohlc_data=self._get(
-                route="market_ohlc",
-                url_args=None,
-                params=ohlc_details
-            )
+            get_ohlc_data=self._get_quote_batches("market_ohlc",ohlc_input)
         except Exception as e:
             type_, value_, traceback_ = sys.exc_info()
             stack_trace = traceback.format_exception(type_, value_, traceback_)
@@ -300,28 +428,67 @@ class MConnect:
     def get_ltp(self,ltp_input):
         '''
         ltp_input: List of strings in exchange:trading symbol format
+        Large lists are split into several requests and merged into one symbol-keyed response.
         '''
-        ltp_details={"i":value for value in ltp_input}
         try:
-            #Using session request
-            get_ltp_data=self._get(
-                route="market_ltp",
-                url_args=None,
-                params=ltp_details
-            )
+            get_ltp_data=self._get_quote_batches("market_ltp",ltp_input)
         except Exception as e:
             type_, value_, traceback_ = sys.exc_info()
             stack_trace = traceback.format_exception(type_, value_, traceback_)
             self.logger.error(stack_trace)
             raise e
         return get_ltp_data
+
+    def _quote_chunks(self,route,instruments):
+        """Split instruments into chunks within the per-request instrument and URL length limits"""
+        base_length=len(urljoin(self.default_root_uri,self.routes[route]))+1
+        chunks=[]
+        chunk=[]
+        length=base_length
+        for instrument in instruments:
+            # "i=" plus the (percent-encoded) instrument and a separating "&"
+            size=len(quote_plus(instrument))+3
+            if chunk and (len(chunk)>=self._max_quote_instruments or length+size>self._max_url_length):
+                chunks.append(chunk)
+                chunk=[]
+                length=base_length
+            chunk.append(instrument)
+            length+=size
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    def _get_quote_batches(self,route,instruments):
+        """
+        Request quotes with repeated `i=` query parameters, one request per chunk.
+        A single chunk returns the server response as is; several are merged into a `BatchResponse`.
+        """
+        if isinstance(instruments,str):
+            instruments=[instruments]
+        # Drop duplicates, keep the caller's order
+        instruments=list(dict.fromkeys(instruments))
+        responses=[
+            self._get(route=route,url_args=None,params=[("i",instrument) for instrument in chunk])
+            for chunk in self._quote_chunks(route,instruments)
+        ]
+        if len(responses)==1:
+            return responses[0]
+        merged={}
+        for response in responses:
+            merged.update(response.json().get("data") or {})
+        return BatchResponse({"status":"success","data":merged},responses)
     
-    def get_instruments(self):
+    def get_instruments(self,path=None):
+        '''
+        Download the instrument scriptmaster.
+        path: optional file to stream the CSV into instead of holding it in memory; the path is returned.
+        '''
         try:
             #Using session request
             get_instrument=self._get(
                 route="instrument_scrip",
-                url_args=None
+                url_args=None,
+                stream_to=path
             )
         except Exception as e:
             type_, value_, traceback_ = sys.exc_info()
@@ -330,6 +497,32 @@ class MConnect:
             raise e
         return get_instrument
     
+    def iter_instruments(self,row_filter=None):
+        '''
+        Stream the instrument scriptmaster and yield one dict per row as it is received.
+        row_filter: optional callable, e.g. `scriptmaster.is_etf`, applied while parsing
+        '''
+        response=self._get(route="instrument_scrip",url_args=None,stream=True)
+        try:
+            for row in scriptmaster.iter_rows(response.iter_lines(chunk_size=64 * 1024),row_filter):
+                yield row
+        finally:
+            response.close()
+
+    def build_instrument_index(self,path,row_filter=scriptmaster.is_etf):
+        '''
+        Stream the scriptmaster into a compact binary index at `path` (ETF rows only by default).
+        Returns the number of instruments written; read it back with `scriptmaster.InstrumentIndex`.
+        '''
+        try:
+            count=scriptmaster.write_index(self.iter_instruments(row_filter),path)
+        except Exception as e:
+            type_, value_, traceback_ = sys.exc_info()
+            stack_trace = traceback.format_exception(type_, value_, traceback_)
+            self.logger.error(stack_trace)
+            raise e
+        return count
+
     def get_fund_summary(self):
         try:
             #Using session request
@@ -442,7 +635,7 @@ class MConnect:
         try:
             data_packet={"BasketId":_BasketId}
             _delete_basket=self._delete(
-                route="delete_packet",
+                route="delete_basket",
                 url_args=None,
                 content_type="application/x-www-form-urlencoded",
                 params=data_packet
@@ -472,9 +665,9 @@ class MConnect:
 
 
     #Aliases for get,post,delete requests
-    def _get(self, route, url_args=None, content_type=None, params=None, is_json=False):
+    def _get(self, route, url_args=None, content_type=None, params=None, is_json=False, stream_to=None, stream=False):
         """Alias for sending a GET request."""
-        return self._request(route, "GET", url_args=url_args,content_type=content_type, params=params, is_json=is_json)
+        return self._request(route, "GET", url_args=url_args,content_type=content_type, params=params, is_json=is_json, stream_to=stream_to, stream=stream)
 
     def _post(self, route, url_args=None, content_type=None, params=None, is_json=False, query_params=None):
         """Alias for sending a POST request."""
@@ -488,8 +681,14 @@ class MConnect:
         """Alias for sending a DELETE request."""
         return self._request(route, "DELETE", url_args=url_args,content_type=content_type, params=params, is_json=is_json)
     
-    def _request(self, route, method, url_args=None, content_type=None,params=None, is_json=False, query_params=None):
-        """Make an HTTP request."""
+    def _request(self, route, method, url_args=None, content_type=None,params=None, is_json=False, query_params=None, stream_to=None, stream=False):
+        """
+        Make an HTTP request.
+        JSON responses are decoded once and returned as an `MResponse`.
+        With `stream_to` set, a CSV/text body is written to that file in chunks and the path is returned.
+        With `stream` set, a CSV/text response is returned unread for the caller to iterate and close.
+        """
+        stream = stream or stream_to is not None
         # Form a restful URL
         if url_args:
             uri = self.routes[route].format(**url_args)
@@ -511,8 +710,11 @@ class MConnect:
             auth_header = self.api_key + ":" + self.access_token
             headers["Authorization"] = "token {}".format(auth_header)
 
+        # Formatting large payloads is costly, only do it when debug records are actually emitted
+        log_debug = self.debug and self.logger.isEnabledFor(logging.DEBUG)
+
         #Adding to debug logs if flag set to true
-        if self.debug:
+        if log_debug:
             if is_json:
                 self.logger.debug("Request: {method} {url} {json} {headers}".format(method=method, url=url, json=params, headers=headers))
             else:
@@ -522,35 +724,61 @@ class MConnect:
         if method in ["GET", "DELETE"]:
             query_params = params
 
-        try:
-            response_data = self.request_session.request(method,
-                                        url,
-                                        json=params if (method in ["POST", "PUT"] and is_json) else None,
-                                        data=params if (method in ["POST", "PUT"] and not is_json) else None,
-                                        params=query_params,
-                                        headers=headers,
-                                        verify=not self.disable_ssl,
-                                        allow_redirects=True,
-                                        timeout=self.timeout)
-        except Exception as e:
-            raise e
-
-        if self.debug:
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(route)
+            started = time.monotonic()
+            try:
+                with self._span("mconnect.http", route=route, method=method, attempt=attempt):
+                    response_data = self.request_session.request(method,
+                                                url,
+                                                json=params if (method in ["POST", "PUT"] and is_json) else None,
+                                                data=params if (method in ["POST", "PUT"] and not is_json) else None,
+                                                params=query_params,
+                                                headers=headers,
+                                                verify=not self.disable_ssl,
+                                                allow_redirects=True,
+                                                stream=stream,
+                                                timeout=self.timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                # Only GET is safe to resend when we don't know whether the server saw the request
+                if method == "GET" and attempt < self.max_retries:
+                    self.logger.warning("Retrying {route} after {error}".format(route=route, error=e))
+                    time.sleep(self._retry_delay(None, attempt))
+                    continue
+                raise e
+
+            if self.rate_limiter is not None:
+                self.rate_limiter.feedback(route, response_data.status_code, time.monotonic() - started, response_data.headers)
+
+            retryable = response_data.status_code in self._retry_any_method or (
+                method == "GET" and response_data.status_code in self._retry_idempotent)
+            if not retryable or attempt == self.max_retries:
+                break
+            delay = self._retry_delay(response_data, attempt)
+            response_data.close()
+            self.logger.warning("Retrying {route} after HTTP {code} in {delay}s".format(
+                route=route, code=response_data.status_code, delay=delay))
+            time.sleep(delay)
+
+        if log_debug and not stream:
             self.logger.debug("Response: {code} {content}".format(code=response_data.status_code, content=response_data.content))
 
         # Validate the content type.
         if "content-type" in response_data.headers:
             if "json" in response_data.headers["content-type"]:
                 try:
-                    data = response_data.json()
+                    with self._span("mconnect.parse", route=route):
+                        payload = _json_loads(response_data.content)
                 except ValueError:
                     raise ex.DataException("Couldn't parse the JSON response received from the server: {content}".format(
                         content=response_data.content))
 
+                data = payload
                 if type(data)==list:
                     data=data[0]
                 # api error
-                if data.get("status") == "error":
+                if isinstance(data, dict) and data.get("status") == "error":
                     if "error_type" in data:
                         # Call session hook if its registered and TokenException is raised
                         if self.session_expiry_hook and response_data.status_code == 403 and data["error_type"] == "TokenException":
@@ -561,7 +789,12 @@ class MConnect:
                         raise exp(data["message"], code=response_data.status_code)
                     else:
                         raise ex.GeneralException(data["message"], code=response_data.status_code)
-            
+                return MResponse(payload, response_data)
+
+            elif stream_to is not None:
+                return self._stream_to_file(response_data, stream_to)
+            elif stream:
+                return response_data
             elif "csv" in response_data.headers["content-type"]:
                 return response_data.content
             elif "text/plain" in response_data.headers["content-type"]:
@@ -571,7 +804,25 @@ class MConnect:
                     content_type=response_data.headers["content-type"],
                     content=response_data.content))
 
-        return response_data 
+        if stream_to is not None:
+            return self._stream_to_file(response_data, stream_to)
+        return response_data
+
+    def _stream_to_file(self, response_data, path):
+        """Write a streamed response body to `path` chunk by chunk; the file is replaced atomically"""
+        partial = path + ".part"
+        try:
+            with self._span("mconnect.download", path=path):
+                with open(partial, "wb") as output:
+                    for chunk in response_data.iter_content(chunk_size=_STREAM_CHUNK_SIZE):
+                        if chunk:
+                            output.write(chunk)
+            os.replace(partial, path)
+        finally:
+            response_data.close()
+            if os.path.exists(partial):
+                os.remove(partial)
+        return path 
 
 
 
@@ -0,0 +1,197 @@
+'''
+Multi-account client pool.
+Manages one authenticated MConnect per trading account over a shared HTTP connection pool,
+with a separate rate limiter per account, and fans calls out across accounts in parallel.
+'''
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+
+from tradingapi_a.mconnect import MConnect
+
+
+class AccountRateLimiter:
+    '''
+    Token bucket for a single account.
+    Implements the `acquire(route)` / `feedback(...)` interface expected by `MConnect.set_rate_limiter`.
+    '''
+
+    def __init__(self, rate=10.0, burst=10):
+        self.rate = float(rate)
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, route=None):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if now >= self._blocked_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = max(self._blocked_until - now, (1 - self._tokens) / self.rate)
+            time.sleep(wait)
+
+    def feedback(self, route, status_code, latency, headers=None):
+        if status_code != 429:
+            return
+        try:
+            retry_after = float((headers or {}).get("Retry-After"))
+        except (TypeError, ValueError):
+            retry_after = 1.0
+        with self._lock:
+            self._tokens = 0.0
+            self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+
+
+class MConnectPool:
+    '''
+    Pool of MConnect clients keyed by account name.
+    All clients share one `requests.Session` (and so its connection pool); cookies are never
+    stored so one account's session cannot leak into another's requests.
+    '''
+
+    def __init__(self, max_workers=8, pool_maxsize=32, limiter_factory=AccountRateLimiter, **client_kwargs):
+        self.client_kwargs = client_kwargs
+        self.limiter_factory = limiter_factory
+        self.session = requests.Session()
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mconnect-pool")
+
+    def add_account(self, account, api_key=None, access_token=None, client=None):
+        '''Register an account by credentials, or an already configured MConnect as `client`'''
+        if client is None:
+            client = MConnect(api_key=api_key, access_Token=access_token, **self.client_kwargs)
+        client.request_session = self.session
+        if self.limiter_factory is not None and client.rate_limiter is None:
+            client.set_rate_limiter(self.limiter_factory())
+        with self._lock:
+            self._clients[account] = client
+        return client
+
+    def remove_account(self, account):
+        with self._lock:
+            return self._clients.pop(account, None)
+
+    def client(self, account):
+        return self._clients[account]
+
+    @property
+    def accounts(self):
+        with self._lock:
+            return list(self._clients)
+
+    def map(self, method, *args, accounts=None, **kwargs):
+        '''
+        Call `client.<method>(*args, **kwargs)` on every account in parallel.
+        Returns {account: {"status": "success", "data": ...} or {"status": "error", "message": ...}}
+        '''
+        with self._lock:
+            clients = {account: self._clients[account] for account in (accounts or self._clients)}
+        futures = {
+            account: self._executor.submit(getattr(client, method), *args, **kwargs)
+            for account, client in clients.items()
+        }
+        results = {}
+        for account, future in futures.items():
+            try:
+                response = future.result()
+                data = response.json().get("data") if hasattr(response, "json") else response
+                results[account] = {"status": "success", "data": data}
+            except Exception as e:
+                results[account] = {"status": "error", "message": str(e)}
+        return results
+
+    def consolidated_holdings(self, accounts=None):
+        '''Holdings summed per exchange/symbol across accounts, with average price weighted by quantity'''
+        results = self.map("get_holdings", accounts=accounts)
+        merged = {}
+        for account, result in _successful(results):
+            for holding in result or []:
+                key = (holding.get("exchange"), holding.get("tradingsymbol"))
+                quantity = _number(holding.get("quantity"))
+                entry = merged.setdefault(key, {
+                    "exchange": key[0], "tradingsymbol": key[1], "quantity": 0,
+                    "invested": 0.0, "last_price": holding.get("last_price"), "accounts": {},
+                })
+                entry["quantity"] += quantity
+                entry["invested"] += quantity * _number(holding.get("average_price"))
+                entry["accounts"][account] = quantity
+        for entry in merged.values():
+            entry["average_price"] = entry["invested"] / entry["quantity"] if entry["quantity"] else 0.0
+        return _view(list(merged.values()), results)
+
+    def consolidated_positions(self, accounts=None):
+        '''Net positions summed per exchange/symbol/product across accounts'''
+        results = self.map("get_net_position", accounts=accounts)
+        merged = {}
+        for account, result in _successful(results):
+            positions = result.get("net", []) if isinstance(result, dict) else result or []
+            for position in positions:
+                key = (position.get("exchange"), position.get("tradingsymbol"), position.get("product"))
+                entry = merged.setdefault(key, {
+                    "exchange": key[0], "tradingsymbol": key[1], "product": key[2],
+                    "quantity": 0, "pnl": 0.0, "accounts": {},
+                })
+                entry["quantity"] += _number(position.get("quantity"))
+                entry["pnl"] += _number(position.get("pnl"))
+                entry["accounts"][account] = _number(position.get("quantity"))
+        return _view(list(merged.values()), results)
+
+    def consolidated_funds(self, accounts=None):
+        '''Numeric fund summary fields totalled across accounts'''
+        results = self.map("get_fund_summary", accounts=accounts)
+        totals = {}
+        for account, result in _successful(results):
+            for summary in (result if isinstance(result, list) else [result or {}]):
+                for field, value in summary.items():
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        totals[field] = totals.get(field, 0) + value
+        return _view(totals, results)
+
+    def consolidated_order_book(self, accounts=None):
+        '''All accounts' orders in one list, each tagged with its account'''
+        results = self.map("get_order_book", accounts=accounts)
+        orders = [
+            dict(order, account=account)
+            for account, result in _successful(results)
+            for order in result or []
+        ]
+        return _view(orders, results)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.session.close()
+
+
+def _successful(results):
+    return [(account, result["data"]) for account, result in results.items() if result["status"] == "success"]
+
+
+def _view(data, results):
+    errors = {account: result["message"] for account, result in results.items() if result["status"] == "error"}
+    if not errors:
+        status = "success"
+    else:
+        status = "partial" if len(errors) < len(results) else "error"
+    return {"status": status, "data": data, "errors": errors}
+
+
+def _number(value):
+    try:
+        number = float(value) if value not in (None, "") else 0
+    except (TypeError, ValueError):
+        return 0
+    return int(number) if float(number).is_integer() else number
@@ -0,0 +1,153 @@
+'''
+Streaming scriptmaster parsing and a compact binary instrument index.
+Rows are parsed one line at a time so the full instrument master is never held in memory.
+'''
+import csv
+import os
+import struct
+
+# Index file layout: header (magic, version, record count) followed by fixed-size records
+INDEX_MAGIC = b"MSIX"
+INDEX_VERSION = 1
+_HEADER = struct.Struct("<4sHI")
+# instrument_token, exchange_token, tick_size, lot_size, exchange, tradingsymbol, instrument_type, name
+_RECORD = struct.Struct("<qqdI8s32s8s48s")
+
+ETF_SYMBOL_MARKERS = ("BEES", "ETF", "IETF")
+
+
+def iter_rows(lines, row_filter=None):
+    '''
+    Parse scriptmaster CSV lines into dict rows as they arrive.
+    lines: iterable of str or bytes lines, e.g. `response.iter_lines()`
+    row_filter: optional callable; only rows for which it returns True are yielded
+    '''
+    decoded = (line.decode("utf-8") if isinstance(line, bytes) else line for line in lines)
+    for row in csv.DictReader(line for line in decoded if line):
+        if row_filter is None or row_filter(row):
+            yield row
+
+
+def is_etf(row):
+    '''True for exchange traded fund rows, by instrument type, segment or the usual symbol markers'''
+    instrument_type = (row.get("instrument_type") or "").upper()
+    if instrument_type == "ETF" or "ETF" in (row.get("segment") or "").upper():
+        return True
+    if instrument_type not in ("", "EQ"):
+        return False
+    symbol = (row.get("tradingsymbol") or "").upper()
+    name = (row.get("name") or "").upper()
+    return any(marker in symbol for marker in ETF_SYMBOL_MARKERS) or " ETF" in name
+
+
+def _encode(value, size):
+    return (value or "").encode("utf-8")[:size]
+
+
+def _number(value, cast, default=0):
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return default
+
+
+class InstrumentIndexWriter:
+    '''
+    Append instrument rows to a binary index file as they are parsed.
+    The file is written to a temporary path and moved into place on close.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._partial = path + ".part"
+        self._file = open(self._partial, "wb")
+        self._file.write(_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, 0))
+
+    def add(self, row):
+        self._file.write(_RECORD.pack(
+            _number(row.get("instrument_token"), int),
+            _number(row.get("exchange_token"), int),
+            _number(row.get("tick_size"), float, 0.0),
+            _number(row.get("lot_size"), int, 1),
+            _encode(row.get("exchange"), 8),
+            _encode(row.get("tradingsymbol"), 32),
+            _encode(row.get("instrument_type"), 8),
+            _encode(row.get("name"), 48),
+        ))
+        self.count += 1
+
+    def close(self):
+        self._file.seek(0)
+        self._file.write(_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, self.count))
+        self._file.close()
+        os.replace(self._partial, self.path)
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self._partial):
+            os.remove(self._partial)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def write_index(rows, path):
+    '''Write rows to a binary index at `path` and return the number of records'''
+    with InstrumentIndexWriter(path) as writer:
+        for row in rows:
+            writer.add(row)
+    return writer.count
+
+
+class InstrumentIndex:
+    '''Read-only lookup over a binary index written by `InstrumentIndexWriter`'''
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as index_file:
+            magic, version, count = _HEADER.unpack(index_file.read(_HEADER.size))
+            if magic != INDEX_MAGIC or version != INDEX_VERSION:
+                raise ValueError("Not an instrument index: {}".format(path))
+            self._buffer = index_file.read(count * _RECORD.size)
+        self.count = count
+        self._offsets = {}
+        for position in range(count):
+            offset = position * _RECORD.size
+            exchange, symbol = struct.unpack_from("<8s32s", self._buffer, offset + 28)
+            self._offsets[(exchange.rstrip(b"\0").decode(), symbol.rstrip(b"\0").decode())] = offset
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, key):
+        return key in self._offsets
+
+    def _record(self, offset):
+        token, exchange_token, tick_size, lot_size, exchange, symbol, instrument_type, name = \
+            _RECORD.unpack_from(self._buffer, offset)
+        return {
+            "instrument_token": token,
+            "exchange_token": exchange_token,
+            "tradingsymbol": symbol.rstrip(b"\0").decode(),
+            "name": name.rstrip(b"\0").decode(errors="ignore"),
+            "instrument_type": instrument_type.rstrip(b"\0").decode(),
+            "exchange": exchange.rstrip(b"\0").decode(),
+            "tick_size": tick_size,
+            "lot_size": lot_size,
+        }
+
+    def get(self, tradingsymbol, exchange="NSE"):
+        '''Instrument record for `exchange:tradingsymbol`, or None'''
+        offset = self._offsets.get((exchange, tradingsymbol))
+        return None if offset is None else self._record(offset)
+
+    def __iter__(self):
+        for offset in self._offsets.values():
+            yield self._record(offset)
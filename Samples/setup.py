@@ -17,6 +17,10 @@ setup(
         "setuptools",
         "twisted"
     ],
+    extras_require={
+        # Faster JSON decoding of API responses
+        "fast": ["orjson"],
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",